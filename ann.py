@@ -0,0 +1,323 @@
+"""
+Index FAISS approchés (HNSW, IVF-Flat, IVF-PQ), compacts (float16, int8,
+PCA + int8) et rapport rappel / latence.
+
+L'index exact (Flat) reste la référence sur disque : c'est lui que la
+réindexation incrémentale met à jour. L'index approché est reconstruit à partir
+de ses vecteurs après chaque modification, enregistré dans ann.faiss, puis
+utilisé à la place de l'index exact pour les recherches.
+
+Les index compacts stockent chaque vecteur sur 2 octets (SQ-fp16) ou 1 octet
+(SQ8) par dimension, éventuellement après une projection PCA apprise à
+l'indexation (PCA-SQ8). Les premiers candidats peuvent être reclassés par
+distance exacte (rescore) : leurs vecteurs float32 sont relus dans l'index
+exact, mappé en mémoire, sans le charger entièrement. Seule la mémoire
+résidente diminue : l'index exact restant sur disque, l'index approché s'y
+ajoute.
+
+Usage du rapport (questions de bench.py par défaut) :
+    python ann.py report --index faiss_index/ [--types Flat,HNSW,SQ8,PCA-SQ8] [--queries questions.txt] [--rescore 4]
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+ANN_FILE = "ann.faiss"
+ANN_META_FILE = "ann.json"
+
+# Types d'index disponibles -> chaîne de fabrique FAISS ({nlist} et {m} calculés selon le corpus)
+INDEX_TYPES = {
+    "Flat": "Flat",
+    "HNSW": "HNSW32",
+    "IVF-Flat": "IVF{nlist},Flat",
+    "IVF-PQ": "IVF{nlist},PQ{m}",
+    "SQ-fp16": "SQfp16",
+    "SQ8": "SQ8",
+    "PCA-SQ8": "PCA{pca},SQ8",
+}
+
+# Paramètres de recherche par défaut (syntaxe faiss.ParameterSpace)
+DEFAULT_SEARCH_PARAMS = {
+    "Flat": "",
+    "HNSW": "efSearch=64",
+    "IVF-Flat": "nprobe=16",
+    "IVF-PQ": "nprobe=16",
+    "SQ-fp16": "",
+    "SQ8": "",
+    "PCA-SQ8": "",
+}
+
+
+def resolve_factory(index_type, n_vectors, dim):
+    """Traduit un type d'index (ou une chaîne de fabrique brute) en chaîne de fabrique FAISS
+
+    Le nombre de listes IVF suit ~4·√n, borné pour disposer d'au moins 39
+    vecteurs d'entraînement par liste. Si le corpus est trop petit pour entraîner
+    l'index demandé, l'index exact est utilisé. La projection PCA garde la moitié
+    des dimensions.
+    """
+    template = INDEX_TYPES.get(index_type, index_type)
+    nlist = max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39))
+    # Nombre de sous-quantificateurs PQ : 8 dimensions par sous-vecteur
+    m = next(m for m in (dim // 8, dim // 4, dim // 2, dim) if m and dim % m == 0)
+    factory = template.format(nlist=nlist, m=m, pca=dim // 2)
+    if "PQ" in factory and n_vectors < 256:
+        return "Flat"  # PQ 8 bits : 256 centroïdes à entraîner
+    if "IVF" in factory and n_vectors < 39:
+        return "Flat"
+    if "PCA" in factory and n_vectors < dim:
+        return "Flat"  # Covariance à estimer sur au moins autant de vecteurs que de dimensions
+    return factory
+
+
+def build_index(vectors, factory, search_params=""):
+    """Construit (entraîne si nécessaire) un index FAISS sur des vecteurs float32"""
+    import faiss
+
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index = faiss.index_factory(vectors.shape[1], factory)
+    if not index.is_trained:
+        # Un échantillon suffit pour l'entraînement (k-means / PQ)
+        sample_size = min(len(vectors), 256 * 256)
+        rng = np.random.default_rng(0)
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)] if sample_size < len(vectors) else vectors
+        index.train(sample)
+    index.add(vectors)
+    apply_search_params(index, search_params)
+    return index
+
+
+def apply_search_params(index, search_params):
+    """Applique des paramètres de recherche (ex. "nprobe=16" ou "efSearch=64")"""
+    if search_params:
+        import faiss
+        faiss.ParameterSpace().set_index_parameters(index, search_params)
+
+
+def index_vectors(index):
+    """Récupère tous les vecteurs d'un index exact (Flat)"""
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def rescore(exact_index, queries, positions, k):
+    """Reclasse les candidats d'un index approché par distance exacte
+
+    Args:
+        exact_index: Index exact (Flat, éventuellement mappé en mémoire) dont les
+            vecteurs float32 sont relus pour les seuls candidats
+        queries: Vecteurs des requêtes (float32, q x d)
+        positions: Pour chaque requête, positions candidates (-1 = place vide)
+        k: Nombre de résultats gardés par requête
+
+    Returns:
+        Tableau (q x k) des positions reclassées, complété par -1
+    """
+    import faiss
+
+    queries = np.asarray(queries, dtype=np.float32)
+    result = np.full((len(queries), k), -1, dtype=np.int64)
+    for q, row in enumerate(positions):
+        ids = np.asarray([p for p in row if p != -1], dtype=np.int64)
+        if not len(ids):
+            continue
+        vectors = exact_index.reconstruct_batch(ids)
+        if exact_index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            distances = -(vectors @ queries[q])
+        else:
+            distances = ((vectors - queries[q]) ** 2).sum(axis=1)
+        best = ids[np.argsort(distances, kind="stable")[:k]]
+        result[q, :len(best)] = best
+    return result
+
+
+def index_size(index):
+    """Taille sérialisée de l'index en octets"""
+    import faiss
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def directory_size(path):
+    """Taille totale des fichiers d'un dossier en octets"""
+    return sum(
+        os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names
+    )
+
+
+def save_ann_index(index_path, index, factory, search_params):
+    """Enregistre l'index approché et ses paramètres à côté de l'index exact"""
+    import faiss
+
+    tmp_path = os.path.join(index_path, ANN_FILE + ".tmp")
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, os.path.join(index_path, ANN_FILE))
+    with open(os.path.join(index_path, ANN_META_FILE), 'w', encoding='utf-8') as f:
+        json.dump({"factory": factory, "search_params": search_params, "ntotal": int(index.ntotal)}, f)
+
+
+def load_ann_meta(index_path):
+    """Paramètres de l'index approché enregistré, ou None"""
+    path = os.path.join(index_path, ANN_META_FILE)
+    if not os.path.exists(path) or not os.path.exists(os.path.join(index_path, ANN_FILE)):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_ann_index(index_path, search_params=None):
+    """Charge l'index approché enregistré, ou None"""
+    import faiss
+
+    meta = load_ann_meta(index_path)
+    if meta is None:
+        return None
+    index = faiss.read_index(os.path.join(index_path, ANN_FILE))
+    apply_search_params(index, meta["search_params"] if search_params is None else search_params)
+    return index
+
+
+def remove_ann_index(index_path):
+    """Supprime l'index approché (retour à l'index exact)"""
+    for name in (ANN_FILE, ANN_META_FILE):
+        path = os.path.join(index_path, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def recall_report(vectors, queries, index_types, k=10, search_params=None, rescore_factor=0):
+    """Compare plusieurs types d'index à l'index exact
+
+    Args:
+        vectors: Vecteurs du corpus (float32, n x d)
+        queries: Vecteurs de requête (float32, q x d)
+        index_types: Types d'index (clés de INDEX_TYPES) ou chaînes de fabrique
+        k: Profondeur du rappel (recall@k)
+        search_params: Dict optionnel {type: paramètres de recherche}
+        rescore_factor: Si > 0, ajoute pour chaque index non exact une ligne où les
+            k x rescore_factor premiers candidats sont reclassés par distance exacte
+
+    Returns:
+        Liste de dicts (un par type, puis par type reclassé) : fabrique, rappel@k,
+        latences, temps de construction, taille
+    """
+    import faiss
+
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    search_params = search_params or {}
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    rows = []
+    for index_type in index_types:
+        factory = resolve_factory(index_type, len(vectors), vectors.shape[1])
+        params = search_params.get(index_type, DEFAULT_SEARCH_PARAMS.get(index_type, ""))
+        if factory == "Flat":
+            params = ""  # Corpus trop petit : repli sur l'index exact, sans paramètres
+        start = time.perf_counter()
+        index = build_index(vectors, factory, params)
+        build_s = time.perf_counter() - start
+
+        size = index_size(index)
+        for factor in (0, rescore_factor) if rescore_factor and factory != "Flat" else (0,):
+            latencies = []
+            found = np.empty_like(truth)
+            for i in range(len(queries)):
+                start = time.perf_counter()
+                if factor:
+                    _, candidates = index.search(queries[i:i + 1], k * factor)
+                    found[i:i + 1] = rescore(exact, queries[i:i + 1], candidates, k)
+                else:
+                    _, found[i:i + 1] = index.search(queries[i:i + 1], k)
+                latencies.append((time.perf_counter() - start) * 1000)
+
+            hits = sum(len(set(truth[i]) & set(found[i])) for i in range(len(queries)))
+            rows.append({
+                "index_type": f"{index_type}+x{factor}" if factor else index_type,
+                "factory": factory,
+                "search_params": params,
+                "rescore": factor,
+                f"recall@{k}": round(hits / truth.size, 4),
+                "latency_ms_p50": round(float(np.percentile(latencies, 50)), 3),
+                "latency_ms_p95": round(float(np.percentile(latencies, 95)), 3),
+                "build_s": round(build_s, 3),
+                "size_bytes": size,
+                "bytes_per_vector": round(size / len(vectors), 1),
+            })
+    return rows
+
+
+def main(argv=None):
+    import faiss
+
+    parser = argparse.ArgumentParser(description="Rapport rappel / latence des index FAISS approchés")
+    sub = parser.add_subparsers(dest="command", required=True)
+    report = sub.add_parser("report", help="Compare les types d'index sur l'index exact existant")
+    report.add_argument("--index", default="faiss_index/", help="Dossier de l'index FAISS")
+    report.add_argument("--types", default=",".join(INDEX_TYPES), help="Types d'index à comparer")
+    report.add_argument("--queries", help="Fichier texte de questions (une par ligne) ; par défaut celles de bench.py")
+    report.add_argument("--k", type=int, default=10)
+    report.add_argument("--rescore", type=int, default=4,
+                        help="Candidats reclassés par distance exacte : k x N (0 = pas de lignes reclassées)")
+    report.add_argument("--json", help="Écrit aussi le rapport dans ce fichier JSON")
+    args = parser.parse_args(argv)
+
+    from embeddings import create_embeddings
+    from manifest import load_manifest
+    from versions import reading
+
+    # Version protégée de la collecte le temps de la lire
+    with reading(args.index) as index_path:
+        vectors = index_vectors(faiss.read_index(os.path.join(index_path, "index.faiss")))
+        manifest = load_manifest(index_path) or {}
+        # Dossier de la version sans son index approché actuel (remplacé par celui de chaque ligne)
+        ann_path = os.path.join(index_path, ANN_FILE)
+        base_disk = directory_size(index_path) - (os.path.getsize(ann_path) if os.path.exists(ann_path) else 0)
+
+    # Vraies questions, vectorisées comme à l'indexation (modèle@moteur du manifeste) :
+    # des segments du corpus pris comme requêtes surestimeraient le rappel
+    if args.queries:
+        with open(args.queries, 'r', encoding='utf-8') as f:
+            questions = [line.strip() for line in f if line.strip()]
+    else:
+        from bench import DEFAULT_QUERIES
+        questions = DEFAULT_QUERIES
+    key = manifest.get("settings", {}).get("embedding_model", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+    model_name, _, backend = key.partition("@")
+    embeddings = create_embeddings(backend or "torch", model_name)
+    queries = np.array(embeddings.embed_documents(questions), dtype=np.float32)
+
+    rows = recall_report(
+        vectors, queries, [t.strip() for t in args.types.split(",")], k=args.k, rescore_factor=args.rescore
+    )
+    for row in rows:
+        # Sur disque, l'index exact est toujours gardé : l'index approché s'y ajoute
+        row["disk_bytes"] = base_disk + (0 if row["factory"] == "Flat" else row["size_bytes"])
+    print(f"{len(vectors)} vecteurs, {len(queries)} requêtes, version sur disque : {base_disk / 1e6:.2f} Mo sans index approché\n")
+    header = (
+        f"{'type':<14} {'fabrique':<22} {'recall@' + str(args.k):>10} {'p50 ms':>8} {'p95 ms':>8} {'build s':>8} "
+        f"{'mémoire Mo':>10} {'o/vecteur':>10} {'disque Mo':>10}"
+    )
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(
+            f"{row['index_type']:<14} {row['factory']:<22} {row[f'recall@{args.k}']:>10.3f} "
+            f"{row['latency_ms_p50']:>8.3f} {row['latency_ms_p95']:>8.3f} {row['build_s']:>8.2f} "
+            f"{row['size_bytes'] / 1e6:>10.2f} {row['bytes_per_vector']:>10.1f} {row['disk_bytes'] / 1e6:>10.2f}"
+        )
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""
+Cache sémantique des réponses.
+
+Une réponse est réutilisée si une question antérieure, posée dans le même mode
+et sur la même version de l'index, a un embedding suffisamment proche (cosinus
+au-dessus du seuil). Les entrées expirent après une durée de vie (TTL) et les
+moins récemment utilisées sont évincées au-delà d'un nombre maximal d'entrées.
+
+Chaque entrée garde la version de l'index sur laquelle elle a été produite.
+Pendant une bascule, les sessions encore sur l'ancienne version et celles déjà
+sur la nouvelle utilisent chacune leurs entrées ; celles des versions plus
+anciennes que les max_versions dernières rencontrées sont retirées au passage.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from itertools import count
+
+import numpy as np
+
+
+class AnswerCache:
+    """Cache (question ~ embedding, mode, version de l'index) -> (réponse, sources)"""
+
+    def __init__(self, threshold=0.95, ttl_seconds=24 * 3600, max_entries=500, max_versions=2):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._ids = count()
+        self.max_versions = max(1, max_versions)
+        # Versions de l'index rencontrées, de la moins à la plus récemment utilisée
+        self._versions = OrderedDict()
+
+    def _check_version(self, index_version):
+        # Appelé avec _lock : seules les max_versions versions les plus récemment utilisées sont gardées
+        self._versions[index_version] = True
+        self._versions.move_to_end(index_version)
+        if len(self._versions) <= self.max_versions:
+            return
+        while len(self._versions) > self.max_versions:
+            self._versions.popitem(last=False)
+        stale = [k for k, e in self._entries.items() if e["version"] not in self._versions]
+        for key in stale:
+            del self._entries[key]
+
+    def _purge_expired(self, now):
+        expired = [k for k, e in self._entries.items() if now - e["created"] > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+
+    def lookup(self, question_vector, mode, index_version):
+        """Retourne l'entrée la plus proche au-dessus du seuil, ou None
+
+        L'entrée retournée contient "answer", "sources", "question" et "similarity".
+        """
+        vector = _normalize(question_vector)
+        now = time.time()
+        with self._lock:
+            self._check_version(index_version)
+            self._purge_expired(now)
+            candidates = [
+                (k, e) for k, e in self._entries.items() if e["mode"] == mode and e["version"] == index_version
+            ]
+            if candidates:
+                matrix = np.stack([e["vector"] for _, e in candidates])
+                scores = matrix @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    key, entry = candidates[best]
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return dict(entry, similarity=float(scores[best]))
+            self.misses += 1
+            return None
+
+    def store(self, question, question_vector, mode, index_version, answer, sources):
+        """Ajoute une réponse au cache"""
+        with self._lock:
+            self._check_version(index_version)
+            self._entries[next(self._ids)] = {
+                "question": question,
+                "vector": _normalize(question_vector),
+                "mode": mode,
+                "version": index_version,
+                "answer": answer,
+                "sources": sources,
+                "created": time.time(),
+            }
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Vide le cache"""
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+    def stats(self):
+        """Nombre d'entrées et taux de succès"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def _normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
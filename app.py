@@ -1,29 +1,164 @@
+import json
 import os
 import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import streamlit as st
 from dotenv import load_dotenv
-import nest_asyncio
-
-# Permettre les boucles d'événements imbriquées pour Streamlit
-nest_asyncio.apply()
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from openai import OpenAI
-
-# Importer le text splitter selon la version disponible
-try:
-    from langchain_text_splitters import RecursiveCharacterTextSplitter
-except ImportError:
-    try:
-        from langchain.text_splitter import RecursiveCharacterTextSplitter
-    except ImportError:
-        from langchain_community.text_splitter import RecursiveCharacterTextSplitter
+
+# Seuls des modules légers sont importés ici : LangChain, FAISS, OpenAI et PyTorch sont
+# importés à leur première utilisation, pour que l'écran de connexion s'affiche sans attendre
+from ann import (
+    ANN_FILE,
+    ANN_META_FILE,
+    DEFAULT_SEARCH_PARAMS,
+    build_index as build_ann_index,
+    index_vectors,
+    load_ann_index,
+    load_ann_meta,
+    remove_ann_index,
+    rescore,
+    resolve_factory,
+    save_ann_index,
+)
+from answer_cache import AnswerCache
+from bm25 import BM25Index, reciprocal_rank_fusion
+from context import expand_to_parents, pack_context
+from dedup import (
+    ChunkDeduplicator,
+    add_copy_citations,
+    apply_citations,
+    citation,
+    duplicate_files,
+    files_to_requeue,
+    indexed_copies,
+    strip_citations,
+)
+from extraction import iter_pages
+from text_cache import is_cached, prune as prune_text_cache
+from history import ChatHistory, prune_history, ref_citations, resolve_refs, source_refs
+from indexing import JobManager, Reporter, checkpoint_path, clear_checkpoint
+from ingest import AdaptiveBatcher, ParentChildSplitter, iter_chunks
+from metrics import (
+    prometheus_text,
+    record_generation,
+    recent_spans,
+    span,
+    span_summary,
+    start_metrics_server,
+    trace,
+)
+from manifest import (
+    chunk_id,
+    diff_files,
+    fingerprint_files,
+    load_manifest,
+    new_manifest,
+    save_manifest,
+)
+from rerank import CrossEncoderReranker
+from resources import index_version, registry
+from shards import ShardMap, fan_out_search
+from versions import new_version, publish, resolve_index_path, unpublish
 
 # Configuration des chemins
 DATA_PATH = "data/"
 FAISS_PATH = "faiss_index/"
 
+# Paramètres d'indexation
+EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
+
+# Découpage : flat (segments de CHUNK_SIZE avec chevauchement) ou parent-child (petits
+# segments enfants sans chevauchement vectorisés, passages parents envoyés au modèle ;
+# PARENT_CHUNK_SIZE = 0 : la page entière sert de parent)
+CHUNKING = os.getenv("CHUNKING", "flat")
+CHILD_CHUNK_SIZE = int(os.getenv("CHILD_CHUNK_SIZE", "500"))
+PARENT_CHUNK_SIZE = int(os.getenv("PARENT_CHUNK_SIZE", "1500"))
+PARENT_TOP_N = int(os.getenv("PARENT_TOP_N", "4"))  # Passages parents envoyés au modèle (0 = budget seul)
+
+# Cache du texte extrait des PDFs, par empreinte de contenu : changer le découpage
+# ne rouvre aucun PDF (voir `python text_cache.py rechunk`)
+TEXT_CACHE = os.getenv("TEXT_CACHE", "1") != "0"
+TEXT_CACHE_PATH = "text_cache/"
+
+# Cache disque des embeddings (réutilisé d'une indexation à l'autre)
+EMBEDDING_CACHE_PATH = "embedding_cache/"
+EMBEDDING_CACHE_MAX_MB = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "512"))
+
+# Paramètres de génération
+TOP_K = 10
+
+# Recherche hybride (vectorielle + lexicale BM25)
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") != "0"
+HYBRID_CANDIDATES_FACTOR = 3  # Chaque classement fournit k x 3 candidats à la fusion
+
+# Recherche filtrée : nombre de recherches FAISS parallèles sur les fragments (un par source)
+SHARD_SEARCH_WORKERS = int(os.getenv("SHARD_SEARCH_WORKERS", "4"))
+RRF_K = 60
+
+# Type d'index FAISS utilisé pour la recherche : Flat (exact), HNSW, IVF-Flat, IVF-PQ,
+# compact (SQ-fp16, SQ8, PCA-SQ8) ou une chaîne de fabrique FAISS ; voir `python ann.py report` pour choisir
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "Flat")
+FAISS_SEARCH_PARAMS = os.getenv("FAISS_SEARCH_PARAMS", DEFAULT_SEARCH_PARAMS.get(FAISS_INDEX_TYPE, ""))
+# Reclassement exact (float32) des k x N premiers candidats de l'index approché (0 = désactivé)
+FAISS_RESCORE = int(os.getenv("FAISS_RESCORE", "0"))
+LLM_MODEL = "gpt-4-turbo-preview"
+LLM_MAX_TOKENS = 3000
+LLM_TIMEOUT = 90
+
+# Reclassement optionnel par cross-encoder : candidats élargis, seuls les meilleurs vont au LLM
+RERANK = os.getenv("RERANK", "0") != "0"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "50"))
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "5"))
+RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", "256"))  # Tokens par paire (question + segment)
+RERANK_BUDGET_MS = int(os.getenv("RERANK_BUDGET_MS", "1500"))
+RERANK_WORKERS = int(os.getenv("RERANK_WORKERS", "2"))
+
+# Assemblage du contexte : budget de tokens, compromis pertinence / diversité (MMR)
+CONTEXT_PACKING = os.getenv("CONTEXT_PACKING", "1") != "0"
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+
+# Cache sémantique des réponses (questions identiques ou quasi identiques)
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL_HOURS = float(os.getenv("ANSWER_CACHE_TTL_HOURS", "24"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "500"))
+
+# Historique de conversation : messages gardés en mémoire (les plus anciens sont déversés
+# dans history/<utilisateur>/), et nombre de messages affichés par page
+HISTORY_PATH = "history/"
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "50"))
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "10"))
+HISTORY_RETENTION_DAYS = float(os.getenv("HISTORY_RETENTION_DAYS", "7"))  # 0 = conserver indéfiniment
+
+# Port HTTP de l'export Prometheus /metrics (0 = désactivé)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Taille initiale des lots d'embeddings (ajustée ensuite pour ~2 s par lot)
+INDEX_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", "64"))
+
+# Indexation en tâche de fond : état et point de reprise (au plus tous les N lots, et seulement
+# quand l'index a grossi d'une fraction donnée depuis le dernier : coût total linéaire)
+INDEX_JOB_PATH = "index_job/"
+INDEX_CHECKPOINT_EVERY = int(os.getenv("INDEX_CHECKPOINT_EVERY", "20"))
+INDEX_CHECKPOINT_GROWTH = float(os.getenv("INDEX_CHECKPOINT_GROWTH", "0.25"))
+
+# Nombre de processus pour l'extraction des PDFs (0 = un par cœur)
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", "0")) or None
+
+# Dédoublonnage à l'indexation : copies identiques de PDFs et segments quasi identiques
+DEDUP = os.getenv("DEDUP", "1") != "0"
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))  # Similarité de Jaccard estimée (MinHash)
+
+# Préchargement en arrière-plan, dès la connexion, du modèle d'embeddings et de l'index
+PREWARM = os.getenv("PREWARM", "1") != "0"
+
 # Charger les variables d'environnement
 def load_env_file():
     """Charge le fichier .env depuis le répertoire courant"""
@@ -44,17 +179,23 @@ def load_env_file():
         return True
     return False
 
+def setup_runtime():
+    """Initialisation faite une seule fois par processus, et non à chaque réexécution du script"""
+    def setup():
+        import nest_asyncio
+        
+        # Permettre les boucles d'événements imbriquées pour Streamlit
+        nest_asyncio.apply()
+        return load_env_file()
+    
+    return registry.get_resource("runtime_setup", setup)
+
 # Charger le .env au démarrage
-load_env_file()
+setup_runtime()
 
 # Chargement des secrets (local .env ou Streamlit secrets pour déploiement)
 def get_secret(key):
     """Récupère une variable depuis .env ou st.secrets"""
-    # Recharger le .env à chaque fois pour être sûr (seulement en mode développement)
-    if not hasattr(get_secret, '_env_loaded'):
-        load_env_file()
-        get_secret._env_loaded = True
-    
     # Essayer d'abord avec os.getenv (pour développement local avec .env)
     value = os.getenv(key)
     if value is not None and value.strip() != '':
@@ -136,161 +277,817 @@ def authenticate():
                 return False
             else:
                 st.session_state.authenticated = True
+                st.session_state.username = input_username
+                if PREWARM:
+                    prewarm(restart=True)
                 st.rerun()
     
     return st.session_state.get("authenticated", False)
 
 # Fonction pour obtenir les embeddings (locaux, rapides)
 def get_embeddings():
-    """Retourne les embeddings locaux (Sentence Transformers) - beaucoup plus rapides que Gemini"""
-    # Utiliser un modèle français léger et rapide
-    model_name = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
-    return HuggingFaceEmbeddings(
-        model_name=model_name,
-        model_kwargs={'device': 'cpu'},  # Utiliser CPU (plus compatible)
-        encode_kwargs={'normalize_embeddings': True}
+    """Retourne les embeddings locaux (Sentence Transformers) - beaucoup plus rapides que Gemini
+
+    Le modèle est chargé une seule fois par processus et partagé entre toutes les sessions.
+    Les vecteurs déjà calculés (segments comme questions) sont relus depuis le cache disque.
+    """
+    def build():
+        from embedding_cache import CachedEmbeddings, EmbeddingCache
+        from embeddings import create_embeddings
+        
+        # Utiliser un modèle français léger et rapide
+        # Moteur PyTorch (référence) : les autres moteurs d'embeddings.py n'ont pas été validés
+        model = create_embeddings("torch", EMBEDDING_MODEL)
+        cache = EmbeddingCache(
+            EMBEDDING_CACHE_PATH,
+            EMBEDDING_MODEL,
+            normalize=True,
+            max_bytes=EMBEDDING_CACHE_MAX_MB * 1024 * 1024
+        )
+        return CachedEmbeddings(model, cache)
+    
+    return registry.get_embeddings(EMBEDDING_MODEL, build)
+
+def get_answer_cache():
+    """Retourne le cache sémantique des réponses (partagé par toutes les sessions)"""
+    return registry.get_resource("answer_cache", lambda: AnswerCache(
+        threshold=ANSWER_CACHE_THRESHOLD,
+        ttl_seconds=ANSWER_CACHE_TTL_HOURS * 3600,
+        max_entries=ANSWER_CACHE_MAX_ENTRIES
+    ))
+
+def get_search_pool():
+    """Retourne le pool de threads des recherches filtrées (partagé par toutes les sessions)"""
+    return registry.get_resource("search_pool", lambda: ThreadPoolExecutor(
+        max_workers=SHARD_SEARCH_WORKERS, thread_name_prefix="shard-search"
+    ))
+
+def get_reranker():
+    """Retourne le cross-encoder de reclassement (partagé par toutes les sessions)"""
+    return registry.get_resource("reranker", lambda: CrossEncoderReranker(
+        RERANK_MODEL, max_length=RERANK_MAX_LENGTH, workers=RERANK_WORKERS
+    ))
+
+def load_vector_store(index_path, writable=False):
+    """Charge l'index FAISS depuis le disque, avec son index lexical BM25 s'il existe
+
+    Args:
+        index_path: Dossier de l'index
+        writable: False (recherche) : vecteurs en mémoire mappée, texte des segments lu à la
+            demande dans SQLite et index approché (HNSW, IVF...) s'il a été construit ;
+            True (réindexation) : index exact et segments chargés en mémoire pour être modifiés
+    """
+    from docstore import has_store, load_store
+    
+    if has_store(index_path):
+        vector_store = load_store(index_path, get_embeddings(), writable=writable)
+    else:
+        from langchain_community.vectorstores import FAISS
+        
+        # Ancien format (docstore picklée) : converti à la prochaine indexation
+        vector_store = FAISS.load_local(index_path, get_embeddings(), allow_dangerous_deserialization=True)
+    vector_store.lexical_index = BM25Index.load(index_path)
+    if not writable:
+        # Fragments par source pour les filtres de recherche (reconstruits si absents ou périmés) ;
+        # les copies identiques d'un PDF renvoient au fragment de leur original
+        copies = indexed_copies(load_manifest(index_path))
+        shards = ShardMap.load(index_path, copies)
+        if shards is None or len(shards) != vector_store.index.ntotal:
+            shards = ShardMap.build((doc for _, doc in stored_documents(vector_store)), copies)
+        vector_store.shards = shards
+    if not writable and FAISS_INDEX_TYPE != "Flat":
+        ann_index = load_ann_index(index_path, FAISS_SEARCH_PARAMS)
+        if ann_index is not None and ann_index.ntotal == vector_store.index.ntotal:
+            # Index exact (mappé) gardé pour reclasser les candidats de l'index approché
+            vector_store.exact_index = vector_store.index if FAISS_RESCORE else None
+            vector_store.index = ann_index
+    return vector_store
+
+def ann_factory(exact_index):
+    """Chaîne de fabrique de l'index approché configuré, ou "Flat" (index exact seul)"""
+    if FAISS_INDEX_TYPE == "Flat":
+        return "Flat"
+    return resolve_factory(FAISS_INDEX_TYPE, exact_index.ntotal, exact_index.d)
+
+def ann_up_to_date(exact_index, index_path):
+    """Indique si l'index approché de index_path correspond à la configuration et au nombre de vecteurs"""
+    factory = ann_factory(exact_index)
+    meta = load_ann_meta(index_path)
+    if factory == "Flat":
+        return meta is None
+    return meta is not None and meta["factory"] == factory and meta["ntotal"] == exact_index.ntotal
+
+def update_ann_index(vector_store, index_path, reuse_from=None):
+    """Écrit dans index_path l'index approché configuré, construit à partir de l'index exact
+
+    Args:
+        reuse_from: Dossier d'une version précédente dont l'index approché est recopié
+            s'il correspond déjà à la configuration et au nombre de vecteurs
+    """
+    exact_index = vector_store.index
+    factory = ann_factory(exact_index)
+    if factory == "Flat":
+        remove_ann_index(index_path)
+        return
+    if reuse_from is not None and ann_up_to_date(exact_index, reuse_from):
+        for name in (ANN_FILE, ANN_META_FILE):
+            shutil.copy2(os.path.join(reuse_from, name), os.path.join(index_path, name))
+        return
+    ann_index = build_ann_index(index_vectors(exact_index), factory, FAISS_SEARCH_PARAMS)
+    save_ann_index(index_path, ann_index, factory, FAISS_SEARCH_PARAMS)
+
+def stored_documents(vector_store):
+    """Parcourt les (identifiant, Document) du vector store, dans l'ordre de l'index"""
+    docstore = vector_store.docstore
+    return ((cid, docstore.search(cid)) for cid in vector_store.index_to_docstore_id.values())
+
+def build_lexical_index(vector_store):
+    """Construit l'index BM25 sur les segments du vector store"""
+    return BM25Index.build((cid, doc.page_content) for cid, doc in stored_documents(vector_store))
+
+def publish_vector_store(vector_store, manifest, dedup=None, reuse_from=None):
+    """Écrit l'index complet dans une nouvelle version puis la publie (bascule atomique)
+
+    Les sessions continuent d'interroger la version précédente jusqu'à leur
+    prochaine interaction ; elle est supprimée quand plus aucune ne la détient.
+
+    Args:
+        vector_store: Index à publier
+        manifest: Manifeste des fichiers indexés
+        dedup: Signatures MinHash des segments (ChunkDeduplicator) ou None
+        reuse_from: Version précédente dont l'index approché peut être recopié
+
+    Returns:
+        Dossier de la version publiée
+    """
+    from docstore import save_store
+    
+    version, staging = new_version(FAISS_PATH)
+    # Format sans pickle : vecteurs FAISS + segments dans SQLite
+    save_store(vector_store, staging)
+    # Index lexical reconstruit sur l'ensemble des segments (quelques secondes au plus)
+    build_lexical_index(vector_store).save(staging)
+    # Source et page de chaque position, pour les recherches filtrées
+    ShardMap.build(doc for _, doc in stored_documents(vector_store)).save(staging)
+    # Index approché (HNSW, IVF...) reconstruit à partir des vecteurs de l'index exact
+    update_ann_index(vector_store, staging, reuse_from)
+    if dedup is not None:
+        dedup.save(staging)
+    # Le manifeste en dernier : une version n'est complète qu'avec lui
+    save_manifest(staging, manifest)
+    return publish(FAISS_PATH, version)
+
+def create_text_splitter():
+    """Découpeur des pages en segments de CHUNK_SIZE caractères (ou parent-enfant selon CHUNKING)"""
+    # Importer le text splitter selon la version disponible
+    try:
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+    except ImportError:
+        try:
+            from langchain.text_splitter import RecursiveCharacterTextSplitter
+        except ImportError:
+            from langchain_community.text_splitter import RecursiveCharacterTextSplitter
+    
+    if CHUNKING == "parent-child":
+        # Séparateurs par défaut : paragraphes, puis lignes, puis mots
+        return ParentChildSplitter(
+            RecursiveCharacterTextSplitter(chunk_size=CHILD_CHUNK_SIZE, chunk_overlap=0),
+            RecursiveCharacterTextSplitter(chunk_size=PARENT_CHUNK_SIZE, chunk_overlap=0) if PARENT_CHUNK_SIZE else None,
+        )
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP
     )
 
+def index_settings():
+    """Paramètres qui, s'ils changent, imposent une reconstruction complète de l'index"""
+    settings = {
+        "embedding_model": EMBEDDING_MODEL,
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "dedup_threshold": DEDUP_THRESHOLD if DEDUP else None,
+    }
+    if CHUNKING == "parent-child":
+        # Absent en découpage flat : les index existants restent valides
+        settings["chunking"] = {"mode": CHUNKING, "child_size": CHILD_CHUNK_SIZE, "parent_size": PARENT_CHUNK_SIZE}
+    return settings
+
+def store_parents(vector_store, parents):
+    """Ajoute à la docstore les passages parents qui n'y sont pas déjà (point de reprise)"""
+    docstore = vector_store.docstore
+    new = {pid: doc for pid, doc in parents.items() if isinstance(docstore.search(pid), str)}
+    if new:
+        docstore.add(new)
+
+def delete_parents(vector_store, parent_ids):
+    """Retire de la docstore les passages parents des fichiers supprimés ou modifiés"""
+    docstore = vector_store.docstore
+    present = [pid for pid in parent_ids if not isinstance(docstore.search(pid), str)]
+    if present:
+        docstore.delete(present)
+
 # Fonction d'indexation des documents
-def index_documents():
-    """Indexe les documents PDF dans FAISS"""
+def index_documents(reporter=None):
+    """Indexe les documents PDF dans FAISS
+
+    L'indexation est incrémentale : le manifeste stocké à côté de l'index indique
+    quels fichiers ont déjà été indexés. Seuls les PDFs nouveaux ou modifiés sont
+    découpés et vectorisés, et les segments des PDFs supprimés ou modifiés sont
+    retirés de l'index.
+
+    Au plus tous les INDEX_CHECKPOINT_EVERY lots, et dès que l'index a grossi de
+    INDEX_CHECKPOINT_GROWTH depuis la sauvegarde précédente, l'index partiel et le
+    manifeste des fichiers entièrement traités sont sauvegardés comme point de
+    reprise : une indexation interrompue repart de ce point au lieu de tout
+    recommencer. Chaque sauvegarde réécrit tout l'index ; l'intervalle croissant
+    avec sa taille, le coût total reste proportionnel au nombre de vecteurs.
+
+    Avec DEDUP, les copies identiques d'un PDF ne sont pas réextraites et les
+    segments quasi identiques à un segment déjà indexé ne sont pas vectorisés :
+    le segment conservé cite toutes les sources (metadata["also_in"]).
+
+    Args:
+        reporter: Destinataire des messages et de la progression (indexing.Reporter) ;
+            par défaut la console
+    """
+    from docstore import has_store, save_store
+    from langchain_community.vectorstores import FAISS
+    
+    reporter = reporter or Reporter()
+    checkpoint = checkpoint_path(INDEX_JOB_PATH)
     try:
-        # Vérifier si l'index existe déjà
-        if os.path.exists(FAISS_PATH) and os.path.exists(os.path.join(FAISS_PATH, "index.faiss")):
-            st.info("📚 Chargement de l'index existant...")
-            embeddings = get_embeddings()
-            vector_store = FAISS.load_local(FAISS_PATH, embeddings, allow_dangerous_deserialization=True)
-            st.success("✅ Index chargé avec succès !")
-            return vector_store
-        
-        # Sinon, créer un nouvel index
-        st.info("📚 Création d'un nouvel index...")
-        
         # Vérifier que le dossier data existe
         if not os.path.exists(DATA_PATH):
-            st.error(f"❌ Le dossier {DATA_PATH} n'existe pas. Veuillez le créer et y placer vos fichiers PDF.")
+            reporter.error(f"❌ Le dossier {DATA_PATH} n'existe pas. Veuillez le créer et y placer vos fichiers PDF.")
             return None
         
-        # Charger les fichiers PDF
-        pdf_files = [f for f in os.listdir(DATA_PATH) if f.endswith('.pdf')]
+        # Lister les fichiers PDF (ordre trié pour un index reproductible)
+        pdf_files = sorted(f for f in os.listdir(DATA_PATH) if f.endswith('.pdf'))
         
         if not pdf_files:
-            st.error(f"❌ Aucun fichier PDF trouvé dans {DATA_PATH}")
+            reporter.error(f"❌ Aucun fichier PDF trouvé dans {DATA_PATH}")
             return None
         
-        st.info(f"📄 {len(pdf_files)} fichier(s) PDF trouvé(s). Indexation en cours...")
-        
-        # Charger et segmenter les documents
-        documents = []
-        for pdf_file in pdf_files:
-            loader = PyPDFLoader(os.path.join(DATA_PATH, pdf_file))
-            docs = loader.load()
-            # Ajouter le nom du fichier comme métadonnée
-            for doc in docs:
-                doc.metadata['source'] = pdf_file
-            documents.extend(docs)
-        
-        # Segmenter les documents
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200
-        )
-        splits = text_splitter.split_documents(documents)
+        # Reprendre une indexation interrompue, sinon partir de l'index publié
+        resuming = has_store(checkpoint) and load_manifest(checkpoint) is not None
+        base_path = checkpoint if resuming else resolve_index_path(FAISS_PATH)
         
-        st.info(f"📝 {len(splits)} segments créés. Génération des embeddings en cours...")
-        st.info("💡 Utilisation d'embeddings locaux (rapides) - le modèle sera téléchargé la première fois uniquement")
+        # Vérifier si un index compatible existe déjà
+        index_exists = os.path.exists(os.path.join(base_path, "index.faiss"))
+        manifest = load_manifest(base_path) if index_exists else None
+        if index_exists and manifest is None:
+            reporter.info("ℹ️ Index existant sans manifeste : reconstruction complète.")
+        elif manifest is not None and manifest.get("settings") != index_settings():
+            reporter.info("ℹ️ Paramètres d'indexation modifiés : reconstruction complète.")
+            manifest = None
+            resuming = False
         
-        # Utiliser les embeddings locaux (beaucoup plus rapides)
-        with st.spinner("Chargement du modèle d'embeddings (première fois uniquement)..."):
-            embeddings = get_embeddings()
+        previous = manifest["files"] if manifest else {}
+        current = fingerprint_files(DATA_PATH, pdf_files, previous)
+        added, modified, removed, unchanged = diff_files(previous, current)
         
-        # Pour les petits documents (< 100 segments), traiter tout en une fois (plus rapide)
-        # Pour les gros documents, utiliser des lots pour éviter les timeouts
-        if len(splits) < 100:
-            # Traitement en une seule fois pour les petits documents
-            with st.spinner("Génération des embeddings (quelques secondes)..."):
-                try:
-                    vector_store = FAISS.from_documents(splits, embeddings)
-                except Exception as e:
-                    st.warning(f"⚠️ Erreur, nouvelle tentative...")
-                    vector_store = FAISS.from_documents(splits, embeddings)
+        # Copies identiques d'un même PDF : seul l'original est extrait et vectorisé
+        duplicates = duplicate_files(
+            current, preferred={name for name, entry in previous.items() if not entry.get("duplicate_of")}
+        ) if DEDUP else {}
+        # Fichiers inchangés dont l'original ou les segments fusionnés disparaissent : retraités
+        requeued = files_to_requeue(previous, unchanged, duplicates, added + modified + removed)
+        if requeued:
+            modified = sorted(modified + requeued)
+            unchanged = [name for name in unchanged if name not in requeued]
+        
+        embeddings = None
+        vector_store = None
+        if manifest is not None:
+            reporter.info("🔁 Reprise de l'indexation interrompue..." if resuming else "📚 Chargement de l'index existant...")
+            # Copie privée : l'index partagé par les sessions n'est jamais modifié en place
+            embeddings = get_embeddings()
+            vector_store = load_vector_store(base_path, writable=True)
+            
+            if resuming:
+                # Segments d'un fichier dont la vectorisation n'était pas terminée au point de reprise
+                indexed = {cid for entry in previous.values() for cid in entry["chunk_ids"]}
+                orphans = [cid for cid in vector_store.index_to_docstore_id.values() if cid not in indexed]
+                if orphans:
+                    vector_store.delete(orphans)
+            elif not (added or modified or removed):
+                complete = (
+                    has_store(base_path)
+                    and vector_store.lexical_index is not None
+                    and ShardMap.load(base_path) is not None
+                    and ann_up_to_date(vector_store.index, base_path)
+                )
+                if not complete:
+                    # Index d'une version antérieure (docstore picklée, sans index lexical ni
+                    # fragments par source) ou type d'index approché modifié : nouvelle version
+                    dedup = ChunkDeduplicator.load(base_path, DEDUP_THRESHOLD) if DEDUP else None
+                    base_path = publish_vector_store(vector_store, manifest, dedup, reuse_from=base_path)
+                reporter.success(f"✅ Index à jour ({len(unchanged)} fichier(s), aucune modification).")
+                return load_vector_store(base_path)
         else:
-            # Traitement par lots pour les gros documents
-            batch_size = 50  # Lots plus grands pour réduire le nombre d'appels
-            total_batches = (len(splits) + batch_size - 1) // batch_size
+            manifest = new_manifest(index_settings())
+        
+        # Signatures MinHash des segments déjà indexés (recalculées si absentes)
+        dedup = None
+        if DEDUP:
+            if vector_store is not None:
+                dedup = ChunkDeduplicator.load(base_path, DEDUP_THRESHOLD)
+            if dedup is None:
+                dedup = ChunkDeduplicator.build(
+                    stored_documents(vector_store) if vector_store is not None else (), threshold=DEDUP_THRESHOLD
+                )
+            elif vector_store is not None:
+                dedup.retain(vector_store.index_to_docstore_id.values())
+        
+        reporter.info(
+            f"📄 {len(pdf_files)} fichier(s) PDF : {len(added)} nouveau(x), {len(modified)} modifié(s), "
+            f"{len(removed)} supprimé(s), {len(unchanged)} inchangé(s). Indexation en cours..."
+        )
+        
+        # Retirer de l'index les segments des fichiers supprimés ou modifiés
+        stale_ids = [cid for name in removed + modified for cid in previous[name]["chunk_ids"]]
+        if stale_ids:
+            vector_store.delete(stale_ids)
+            if dedup is not None:
+                dedup.remove(stale_ids)
+        stale_parents = [pid for name in removed + modified for pid in previous[name].get("parent_ids", ())]
+        if stale_parents:
+            delete_parents(vector_store, stale_parents)
+        for name in removed + modified:
+            # Un fichier modifié n'est réinscrit qu'une fois tous ses segments vectorisés
+            del manifest["files"][name]
+        if vector_store is not None and (added or modified or removed):
+            # Citations de fichiers retirés ou retraités (recréées à leur passage)
+            strip_citations((doc for _, doc in stored_documents(vector_store)), added + modified + removed)
+        
+        # Copies identiques : inscrites au manifeste sans extraction, citées aux pages de l'original
+        copies = [name for name in added + modified if name in duplicates]
+        for name in copies:
+            manifest["files"][name] = dict(current[name], chunk_ids=[], duplicate_of=duplicates[name])
+        
+        # Charger, segmenter et vectoriser en flux uniquement les fichiers nouveaux ou modifiés :
+        # extraction (processus en parallèle) -> découpage -> lots d'embeddings -> index
+        text_splitter = create_text_splitter()
+        to_extract = [name for name in added + modified if name not in duplicates]
+        failures = {}
+        counts = {"files": 0, "pages": 0, "chunks": 0, "duplicates": 0}
+        # Segments restant à vectoriser par fichier : le fichier entre au manifeste quand il n'en reste plus
+        remaining = {}
+        
+        if to_extract:
+            if embeddings is None:
+                reporter.info("💡 Utilisation d'embeddings locaux (rapides) - le modèle sera téléchargé la première fois uniquement")
+                # Utiliser les embeddings locaux (beaucoup plus rapides)
+                reporter.progress(0, "Chargement du modèle d'embeddings (première fois uniquement)...")
+                embeddings = get_embeddings()
             
-            progress_bar = st.progress(0)
-            status_text = st.empty()
+            text_cache = TEXT_CACHE_PATH if TEXT_CACHE else None
+            hashes = {name: current[name]["sha256"] for name in to_extract}
+            if text_cache:
+                cached = sum(is_cached(text_cache, hashes[name]) for name in to_extract)
+                if cached:
+                    reporter.info(f"♻️ Texte déjà extrait pour {cached}/{len(to_extract)} fichier(s) : PDFs non réanalysés.")
             
-            # Créer le vector store progressivement
-            vector_store = None
-            for i in range(0, len(splits), batch_size):
-                batch = splits[i:i + batch_size]
-                batch_num = (i // batch_size) + 1
-                
-                status_text.text(f"Traitement du lot {batch_num}/{total_batches} ({len(batch)} segments)...")
-                progress_bar.progress(batch_num / total_batches)
-                
-                try:
-                    if vector_store is None:
-                        # Premier lot : créer le vector store
-                        vector_store = FAISS.from_documents(batch, embeddings)
-                    else:
-                        # Lots suivants : ajouter au vector store existant
-                        vector_store.add_documents(batch)
-                except Exception as e:
-                    # En cas d'erreur, réessayer une fois
-                    st.warning(f"⚠️ Erreur sur le lot {batch_num}, nouvelle tentative...")
-                    try:
-                        if vector_store is None:
-                            vector_store = FAISS.from_documents(batch, embeddings)
-                        else:
-                            vector_store.add_documents(batch)
-                    except Exception as e2:
-                        st.error(f"❌ Erreur persistante sur le lot {batch_num}: {str(e2)}")
-                        raise e2
+            def on_file(pdf_file, docs, ids, error):
+                counts["files"] += 1
+                if error is not None:
+                    # Les fichiers en échec ne sont pas inscrits au manifeste : ils seront retentés au prochain passage
+                    failures[pdf_file] = error
+                    reporter.warning(f"⚠️ Impossible de lire {pdf_file} : {error}")
+                    return
+                counts["pages"] += len(docs)
+                entry = dict(current[pdf_file], chunk_ids=list(ids))
+                if pdf_file in file_parents:
+                    entry["parent_ids"] = file_parents.pop(pdf_file)
+                if ids:
+                    remaining[pdf_file] = [len(ids), entry]
+                else:
+                    manifest["files"][pdf_file] = entry
+            
+            def on_chunk_done(cid):
+                pdf_file = chunk_files.pop(cid)
+                remaining[pdf_file][0] -= 1
+                if remaining[pdf_file][0] == 0:
+                    manifest["files"][pdf_file] = remaining.pop(pdf_file)[1]
             
-            progress_bar.empty()
-            status_text.empty()
+            # Citations des segments écartés, reportées sur leur original une fois celui-ci dans l'index
+            pending_citations = {}
+            
+            def on_duplicate(doc, cid, canonical_id):
+                counts["duplicates"] += 1
+                entry = remaining[chunk_files[cid]][1]
+                entry["chunk_ids"].remove(cid)
+                source = dedup.source(canonical_id)
+                if source and source not in entry.setdefault("dedup_sources", []):
+                    # Si ce fichier est retiré ou modifié, celui-ci devra être retraité
+                    entry["dedup_sources"].append(source)
+                pending_citations.setdefault(canonical_id, []).append(citation(doc))
+                on_chunk_done(cid)
+            
+            chunk_files = {}
+            # Passages parents (découpage parent-enfant), ajoutés à la docstore avec le lot de leurs enfants
+            pending_parents = {}
+            file_parents = {}
+            
+            def on_parents(pdf_file, parents):
+                for pid in parents:
+                    chunk_files.pop(pid, None)  # Identifiants de parents : pas de segment à vectoriser
+                pending_parents.update(parents)
+                file_parents[pdf_file] = list(parents)
+            
+            def make_id(pdf_file, i):
+                cid = chunk_id(pdf_file, current[pdf_file]["sha256"], i)
+                chunk_files[cid] = pdf_file
+                return cid
+            
+            chunks = iter_chunks(
+                iter_pages(
+                    DATA_PATH, to_extract, max_workers=EXTRACTION_WORKERS, cache_dir=text_cache, hashes=hashes
+                ),
+                text_splitter,
+                make_id,
+                on_file=on_file,
+                on_parents=on_parents
+            )
+            if dedup is not None:
+                chunks = dedup.filter(chunks, on_duplicate)
+            batcher = AdaptiveBatcher(initial_size=INDEX_BATCH_SIZE)
+            
+            # Taille de l'index au dernier point de reprise (ou à la reprise)
+            checkpointed = vector_store.index.ntotal if vector_store is not None else 0
+            
+            with span("index.ingest", files=len(to_extract)) as ingest_span:
+                # Compléter le vector store lot par lot, au fil de l'extraction
+                for batch_num, pairs in enumerate(batcher.timed(chunks), 1):
+                    batch = [doc for doc, _ in pairs]
+                    batch_ids = [cid for _, cid in pairs]
+                    counts["chunks"] += len(batch)
+                    reporter.progress(
+                        counts["files"] / len(to_extract),
+                        f"Fichier {counts['files']}/{len(to_extract)} · lot {batch_num} ({len(batch)} segments) · "
+                        f"{counts['chunks']} segments vectorisés..."
+                    )
+                    
+                    with span("index.embed_batch", batch=batch_num, chunks=len(batch)):
+                        try:
+                            if vector_store is None:
+                                # Premier lot : créer le vector store
+                                vector_store = FAISS.from_documents(batch, embeddings, ids=batch_ids)
+                            else:
+                                # Lots suivants : ajouter au vector store existant
+                                vector_store.add_documents(batch, ids=batch_ids)
+                        except Exception as e:
+                            # En cas d'erreur, réessayer une fois
+                            reporter.warning(f"⚠️ Erreur sur le lot {batch_num}, nouvelle tentative...")
+                            try:
+                                if vector_store is None:
+                                    vector_store = FAISS.from_documents(batch, embeddings, ids=batch_ids)
+                                else:
+                                    vector_store.add_documents(batch, ids=batch_ids)
+                            except Exception as e2:
+                                reporter.error(f"❌ Erreur persistante sur le lot {batch_num}: {str(e2)}")
+                                raise e2
+                    if pending_parents:
+                        store_parents(vector_store, pending_parents)
+                        pending_parents.clear()
+                    for cid in batch_ids:
+                        on_chunk_done(cid)
+                    apply_citations(vector_store.docstore, pending_citations)
+                    
+                    size = vector_store.index.ntotal
+                    if (
+                        INDEX_CHECKPOINT_EVERY and batch_num % INDEX_CHECKPOINT_EVERY == 0
+                        and size - checkpointed >= INDEX_CHECKPOINT_GROWTH * checkpointed
+                    ):
+                        # Point de reprise : index partiel + manifeste des seuls fichiers terminés
+                        checkpointed = size
+                        with span("index.checkpoint", vectors=size):
+                            save_store(vector_store, checkpoint)
+                            if dedup is not None:
+                                dedup.save(checkpoint)
+                            save_manifest(checkpoint, manifest)
+                if vector_store is not None:
+                    apply_citations(vector_store.docstore, pending_citations)
+                ingest_span.update(
+                    pages=counts["pages"], chunks=counts["chunks"], duplicates=counts["duplicates"], failures=len(failures)
+                )
+        
+        reporter.info(f"📝 {counts['chunks']} segments créés et vectorisés.")
+        if copies or counts["duplicates"]:
+            seen = counts["chunks"] + counts["duplicates"]
+            reporter.info(
+                f"🧬 Dédoublonnage : {len(copies)} copie(s) de PDF non réextraite(s), "
+                f"{counts['duplicates']} segment(s) quasi identique(s) fusionné(s)"
+                + (f" ({counts['duplicates'] / seen:.0%} des segments)." if seen else ".")
+            )
         
-        # Sauvegarder l'index
-        os.makedirs(FAISS_PATH, exist_ok=True)
-        vector_store.save_local(FAISS_PATH)
+        if vector_store is None:
+            reporter.error("❌ Aucun segment de texte n'a pu être extrait des fichiers PDF.")
+            return None
+        
+        if duplicates:
+            # Chaque copie est citée aux mêmes pages que son original
+            add_copy_citations((doc for _, doc in stored_documents(vector_store)), duplicates)
         
-        st.success(f"✅ Index créé avec succès ! {len(splits)} segments indexés.")
-        return vector_store
+        # Sauvegarder l'index puis le manifeste (le manifeste n'est écrit qu'une fois l'index à jour)
+        reporter.progress(1.0, "Sauvegarde de l'index...")
+        with span("index.save", vectors=vector_store.index.ntotal):
+            index_path = publish_vector_store(vector_store, manifest, dedup)
+        clear_checkpoint(INDEX_JOB_PATH)
+        if TEXT_CACHE:
+            # Texte des PDFs retirés de data/
+            prune_text_cache(TEXT_CACHE_PATH, {entry["sha256"] for entry in current.values()})
+        
+        total_chunks = sum(len(entry["chunk_ids"]) for entry in manifest["files"].values())
+        reporter.success(f"✅ Index mis à jour avec succès ! {counts['chunks']} segments ajoutés, {len(stale_ids)} retirés, {total_chunks} au total.")
+        if counts["chunks"]:
+            cache_stats = embeddings.cache.stats()
+            reporter.info(f"♻️ Cache d'embeddings : {cache_stats['hit_rate']:.0%} de succès ({cache_stats['entries']} vecteurs en cache)")
+        # Version de recherche (mémoire mappée, lecture paresseuse) plutôt que la copie de travail
+        return load_vector_store(index_path)
         
     except Exception as e:
-        st.error(f"❌ Erreur lors de l'indexation : {str(e)}")
+        reporter.error(f"❌ Erreur lors de l'indexation : {str(e)}")
         return None
 
-# Fonction pour générer une réponse (approche directe avec plus de contexte)
-def generate_answer(vector_store, question, mode="question"):
-    """Génère une réponse développée en utilisant plusieurs segments de documents
+# Indexation en tâche de fond
+def get_indexing_jobs():
+    """Retourne le gestionnaire des indexations en tâche de fond (partagé par toutes les sessions)"""
+    return registry.get_resource("indexing_jobs", lambda: JobManager(INDEX_JOB_PATH))
+
+def start_indexing():
+    """Lance (ou reprend) l'indexation dans un thread ; sans effet si elle est déjà en cours"""
+    def run(job):
+        with trace("index"):
+            vector_store = index_documents(job)
+        if vector_store is None:
+            return False
+        # Les sessions basculeront sur cette version à leur prochaine interaction
+        registry.publish_index(FAISS_PATH, vector_store)
+        return True
     
+    return get_indexing_jobs().start(run)
+
+# Préchargement en arrière-plan
+def prewarm(restart=False):
+    """Précharge en tâche de fond le modèle d'embeddings et l'index
+
+    Lancé à chaque connexion : la page principale s'affiche pendant l'import de
+    PyTorch, de LangChain et d'OpenAI et le chargement du modèle et de l'index.
+    Une connexion relance le préchargement s'il est terminé (nouvelle version de
+    l'index, modèle libéré...) ; ce qui est déjà en mémoire est simplement réutilisé.
+
     Args:
-        vector_store: Le vector store FAISS
-        question: La question de l'utilisateur
-        mode: "question" pour réponses normales, "redaction" pour format mémoire académique
+        restart: True pour relancer un préchargement terminé ; False pour
+            seulement consulter le préchargement en cours ou le dernier
+
+    Returns:
+        Le thread de préchargement (en cours ou terminé)
     """
+    def run():
+        try:
+            with trace("prewarm"):
+                with span("prewarm.embeddings"):
+                    get_embeddings().embed_query("préchargement")
+                if RERANK:
+                    # Hors du budget de latence de la première question
+                    with span("prewarm.reranker"):
+                        get_reranker().load()
+                if index_version(FAISS_PATH) is not None:
+                    with span("prewarm.index"):
+                        lease = registry.acquire_index(FAISS_PATH, load_vector_store)
+                        # La version courante reste en mémoire après le bail : les sessions la réutilisent
+                        if lease is not None:
+                            lease.release()
+                with span("prewarm.imports"):
+                    import openai  # noqa: F401
+        except Exception as e:
+            # Le chargement à la demande réessaiera et affichera l'erreur
+            print(f"⚠️ Préchargement interrompu : {e}", file=sys.stderr)
     
-    # Récupérer plusieurs documents pertinents (10 segments pour maximum de contexte)
-    docs = vector_store.similarity_search(question, k=10)
+    def start():
+        thread = threading.Thread(target=run, name="prewarm", daemon=True)
+        thread.start()
+        return thread
     
-    if not docs:
-        return "Aucun document pertinent trouvé.", []
+    return registry.get_resource("prewarm", start, valid=(lambda thread: thread.is_alive()) if restart else None)
+
+def refresh_index_lease():
+    """Charge l'index s'il existe, ou passe à sa nouvelle version après une réindexation
+
+    L'index est partagé par toutes les sessions du processus (une seule copie en mémoire).
+    """
+    lease = st.session_state.get("index_lease")
+    if lease is not None and lease.version == index_version(FAISS_PATH):
+        return
+    if index_version(FAISS_PATH) is not None:
+        try:
+            new_lease = registry.acquire_index(FAISS_PATH, load_vector_store)
+            if lease is not None:
+                lease.release()
+            st.session_state.index_lease = new_lease
+            st.session_state.vector_store = new_lease.vector_store if new_lease else None
+            # Stocker l'erreur de chargement si elle existe
+            if "index_load_error" in st.session_state:
+                del st.session_state["index_load_error"]
+        except Exception as e:
+            # Stocker l'erreur pour l'afficher dans la sidebar
+            st.session_state["index_load_error"] = str(e)
+    elif lease is not None:
+        # Index retiré
+        lease.release()
+        st.session_state.index_lease = None
+        st.session_state.vector_store = None
+
+# Recherche vectorielle seule
+def select_shards(vector_store, filters):
+    """Positions FAISS retenues par les filtres de recherche, par source
+
+    Args:
+        vector_store: Le vector store FAISS
+        filters: Dict optionnel {"sources": [...], "years": (min, max), "pages": (min, max)}
+
+    Returns:
+        Dict {source: positions} (ShardMap.select), ou None sans filtre (tout l'index)
+    """
+    shards = getattr(vector_store, "shards", None)
+    if not filters or shards is None:
+        return None
+    return shards.select(filters.get("sources"), filters.get("years"), filters.get("pages"))
+
+def dense_search_batch(vector_store, questions, k, shards=None):
+    """Retourne, pour chaque question, les identifiants des k segments les plus proches (FAISS)
+
+    Toutes les questions sont vectorisées en un lot puis cherchées en un seul appel FAISS.
+    Avec des fragments sélectionnés (select_shards), seuls leurs segments sont
+    cherchés, en parallèle, et les résultats fusionnés. Avec FAISS_RESCORE, les
+    k x FAISS_RESCORE premiers candidats de l'index approché sont reclassés par
+    distance exacte.
+    """
+    with span("query.embed", queries=len(questions)):
+        if len(questions) == 1:
+            vectors = np.array([vector_store.embeddings.embed_query(questions[0])], dtype=np.float32)
+        else:
+            vectors = np.array(vector_store.embeddings.embed_documents(list(questions)), dtype=np.float32)
+    exact_index = getattr(vector_store, "exact_index", None)
+    depth = k * FAISS_RESCORE if exact_index is not None else k
+    with span("query.search", k=k, queries=len(questions)) as search_span:
+        if shards is None:
+            _, positions = vector_store.index.search(vectors, depth)
+        else:
+            search_span["shards"] = len(shards)
+            positions = fan_out_search(
+                vector_store.index, vectors, depth, shards, get_search_pool(), SHARD_SEARCH_WORKERS
+            )
+        if exact_index is not None:
+            search_span["rescored"] = depth
+            positions = rescore(exact_index, vectors, positions, k)
+    return [[vector_store.index_to_docstore_id[p] for p in row if p != -1] for row in positions]
+
+def dense_search(vector_store, question, k):
+    """Retourne les identifiants des k segments les plus proches de la question (FAISS)"""
+    return dense_search_batch(vector_store, [question], k)[0]
+
+# Fonction pour récupérer les segments pertinents
+def retrieve_documents(vector_store, question, k=TOP_K, filters=None):
+    """Récupère les segments les plus pertinents pour la question
+
+    Recherche hybride : le classement vectoriel (FAISS) et le classement lexical
+    (BM25, qui retrouve les noms d'auteurs, sigles et termes rares) sont fusionnés
+    par Reciprocal Rank Fusion. Sans index lexical, seule la recherche vectorielle est utilisée.
+    Les filtres (sources, années, pages ; voir select_shards) restreignent la recherche elle-même.
+    """
+    lexical_index = getattr(vector_store, "lexical_index", None)
+    rescoring = getattr(vector_store, "exact_index", None) is not None
+    if not filters and (not HYBRID_SEARCH or lexical_index is None) and not rescoring:
+        # Récupérer plusieurs documents pertinents (10 segments pour maximum de contexte)
+        with span("query.search", k=k):
+            return vector_store.similarity_search(question, k=k)
+    return retrieve_documents_batch(vector_store, [question], k, filters)[0]
+
+def retrieve_documents_batch(vector_store, questions, k=TOP_K, filters=None):
+    """Récupère les segments pertinents de plusieurs questions (une seule recherche FAISS)
+
+    Returns:
+        Liste de listes de Documents, dans l'ordre des questions
+    """
+    shards = select_shards(vector_store, filters)
+    if shards is not None and not shards:
+        return [[] for _ in questions]  # Aucun segment ne correspond aux filtres
+    # BM25 est construit dans l'ordre des positions FAISS : mêmes indices pour le filtre lexical
+    allowed = np.concatenate(list(shards.values())) if shards else None
+    lexical_index = getattr(vector_store, "lexical_index", None)
+    hybrid = HYBRID_SEARCH and lexical_index is not None
+    candidates = k * HYBRID_CANDIDATES_FACTOR if hybrid else k
+    dense_ids = dense_search_batch(vector_store, questions, candidates, shards)
     
+    ranked_ids = []
+    for question, ids in zip(questions, dense_ids):
+        if hybrid:
+            with span("query.lexical", k=candidates) as lexical_span:
+                lexical_ids = [cid for cid, _ in lexical_index.search(question, candidates, allowed=allowed)]
+                lexical_span["hits"] = len(lexical_ids)
+            ids = reciprocal_rank_fusion([ids, lexical_ids], k=RRF_K)
+        ranked_ids.append(ids[:k])
+    
+    with span("query.fetch", chunks=sum(len(ids) for ids in ranked_ids)):
+        unique_ids = list(dict.fromkeys(cid for ids in ranked_ids for cid in ids))
+        if hasattr(vector_store.docstore, "mget"):
+            by_id = dict(zip(unique_ids, vector_store.docstore.mget(unique_ids)))
+        else:
+            by_id = {cid: vector_store.docstore.search(cid) for cid in unique_ids}
+    # La docstore renvoie None ou un message (str) pour un identifiant inconnu
+    return [
+        [by_id[cid] for cid in ids if by_id[cid] is not None and not isinstance(by_id[cid], str)]
+        for ids in ranked_ids
+    ]
+
+# Reclassement des candidats
+def retrieval_depth():
+    """Nombre de segments à récupérer : élargi quand le reclassement est actif"""
+    return max(RERANK_CANDIDATES, TOP_K) if RERANK else TOP_K
+
+def rerank_documents(question, docs, top_n=None):
+    """Garde les top_n segments selon le cross-encoder, ou les top_n premiers de la recherche s'il est trop lent
+
+    Sans reclassement (RERANK=0), les TOP_K segments récupérés sont rendus
+    inchangés et l'assemblage du contexte choisit parmi eux dans la limite de
+    CONTEXT_TOKEN_BUDGET.
+
+    Returns:
+        (segments retenus, rapport ; None si le reclassement est désactivé)
+    """
+    if not RERANK or not docs:
+        return docs, None
+    with span("query.rerank", candidates=len(docs)) as rerank_span:
+        docs, report = get_reranker().rerank(
+            question, docs, top_n or RERANK_TOP_N, budget_s=RERANK_BUDGET_MS / 1000
+        )
+        rerank_span.update(reranked=int(report["reranked"]), cached=report["cached"])
+    return docs, report
+
+# Assemblage du contexte envoyé au modèle
+def fetch_parents(vector_store, docs):
+    """Passages parents des segments (découpage parent-enfant), lus par identifiant dans la docstore
+
+    Returns:
+        Dict {identifiant: Document}, ou None si les segments n'ont pas de parent
+    """
+    ids = list(dict.fromkeys(doc.metadata["parent_id"] for doc in docs if doc.metadata.get("parent_id")))
+    if not ids:
+        return None
+    docstore = vector_store.docstore
+    found = docstore.mget(ids) if hasattr(docstore, "mget") else [docstore.search(pid) for pid in ids]
+    return {pid: doc for pid, doc in zip(ids, found) if doc is not None and not isinstance(doc, str)}
+
+def pack_documents(vector_store, question, docs, question_vector=None):
+    """Recolle les segments qui se chevauchent, ordonne par MMR et applique le budget de tokens
+
+    Les vecteurs des segments viennent du cache d'embeddings (calculés à l'indexation).
+    En découpage parent-enfant, les segments retenus sont remplacés par leurs passages parents.
+
+    Returns:
+        (segments retenus, rapport de tokens ; None si l'assemblage est désactivé)
+    """
+    parents = fetch_parents(vector_store, docs)
+    if not CONTEXT_PACKING or not docs:
+        if parents is not None:
+            docs = [doc for _, doc in expand_to_parents(list(enumerate(docs)), parents)][:PARENT_TOP_N or None]
+        return docs, None
+    with span("context.pack", chunks=len(docs)) as pack_span:
+        embeddings = vector_store.embeddings
+        if question_vector is None:
+            question_vector = embeddings.embed_query(question)
+        doc_vectors = embeddings.embed_documents([doc.page_content for doc in docs])
+        packed, report = pack_context(
+            docs, question_vector, doc_vectors, CONTEXT_TOKEN_BUDGET,
+            lambda_mult=CONTEXT_MMR_LAMBDA, model=LLM_MODEL, parents=parents,
+            max_passages=(PARENT_TOP_N or None) if parents is not None else None
+        )
+        pack_span.update(passages=len(packed), tokens_saved=report["tokens_saved"])
+    return packed, report
+
+# Fonction pour construire le prompt à partir des segments récupérés
+def build_prompt(question, docs, mode="question"):
+    """Construit le message système et le prompt utilisateur
+
+    Returns:
+        (system_content, prompt_text)
+    """
     # Construire le contexte à partir de tous les documents trouvés
     context_parts = []
-    sources_info = []
     
     for i, doc in enumerate(docs, 1):
         source_name = doc.metadata.get("source", "Inconnu")
         page = doc.metadata.get("page", "N/A")
         content = doc.page_content
+        header = f"[Document {i} - Source: {source_name}, Page: {page}]"
+        # Passage dédoublonné à l'indexation : présent aussi dans d'autres sources
+        also_in = doc.metadata.get("also_in")
+        if also_in:
+            header += " (également : " + "; ".join(f"Source: {c['source']}, Page: {c['page']}" for c in also_in) + ")"
         
-        context_parts.append(f"[Document {i} - Source: {source_name}, Page: {page}]\n{content}")
-        sources_info.append((source_name, page))
+        context_parts.append(f"{header}\n{content}")
     
     # Combiner tous les contextes
     full_context = "\n\n---\n\n".join(context_parts)
@@ -346,57 +1143,302 @@ QUESTION: {question}
 
 RÉPONSE DÉVELOPPÉE (minimum 3-4 paragraphes, bien structurée) :"""
     
-    # Utiliser OpenAI directement (plus rapide et fiable, sans LangChain)
-    try:
-        client = OpenAI(api_key=get_secret("OPENAI_API_KEY"))
+    # Déterminer le message système selon le mode
+    if mode == "redaction":
+        system_content = "Vous êtes un chercheur universitaire rédigeant un mémoire académique. Votre style doit être scientifique, précis et prêt à être intégré directement dans un document académique."
+    else:
+        system_content = "Vous êtes un assistant expert en rédaction académique. Vous fournissez des réponses développées, détaillées et bien structurées."
+    
+    return system_content, prompt_text
+
+# Fonction pour générer la réponse token par token
+def stream_answer(question, docs, mode="question", metrics=None):
+    """Génère la réponse en streaming (générateur de fragments de texte)
+
+    Mesure le temps jusqu'au premier token et le débit (tokens/s) de chaque requête,
+    et les enregistre via record_generation().
+
+    Args:
+        question: La question de l'utilisateur
+        docs: Les segments récupérés
+        mode: "question" pour réponses normales, "redaction" pour format mémoire académique
+        metrics: Dictionnaire optionnel complété avec les mesures de la requête
+    """
+    metrics = metrics if metrics is not None else {}
+    with span("prompt.build", chunks=len(docs)) as prompt_span:
+        system_content, prompt_text = build_prompt(question, docs, mode)
+        prompt_span["chars"] = len(system_content) + len(prompt_text)
+    metrics.update({"mode": mode, "model": LLM_MODEL, "prompt_chars": len(system_content) + len(prompt_text)})
+    
+    start = time.perf_counter()
+    first_token_at = None
+    chunk_count = 0
+    usage = None
+    with span("llm.generate") as llm_span:
+        try:
+            from openai import OpenAI
+            
+            # Utiliser OpenAI directement (plus rapide et fiable, sans LangChain)
+            client = OpenAI(api_key=get_secret("OPENAI_API_KEY"))
+            
+            # Appel à l'API OpenAI en streaming avec GPT-4 et plus de tokens pour des réponses développées
+            response = client.chat.completions.create(
+                model=LLM_MODEL,  # GPT-4 Turbo pour meilleure qualité
+                messages=[
+                    {"role": "system", "content": system_content},
+                    {"role": "user", "content": prompt_text}
+                ],
+                temperature=0.3,  # Légèrement augmenté pour plus de variété
+                max_tokens=LLM_MAX_TOKENS,  # 3000 tokens pour des réponses très développées
+                timeout=LLM_TIMEOUT,  # Timeout augmenté pour GPT-4 qui peut être plus lent
+                stream=True,
+                stream_options={"include_usage": True}  # Nombre exact de tokens dans le dernier fragment
+            )
+            
+            for chunk in response:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    chunk_count += 1
+                    yield delta
         
-        # Déterminer le message système selon le mode
-        if mode == "redaction":
-            system_content = "Vous êtes un chercheur universitaire rédigeant un mémoire académique. Votre style doit être scientifique, précis et prêt à être intégré directement dans un document académique."
-        else:
-            system_content = "Vous êtes un assistant expert en rédaction académique. Vous fournissez des réponses développées, détaillées et bien structurées."
-        
-        # Appel direct à l'API OpenAI avec GPT-4 et plus de tokens pour des réponses développées
-        response = client.chat.completions.create(
-            model="gpt-4-turbo-preview",  # GPT-4 Turbo pour meilleure qualité
-            messages=[
-                {"role": "system", "content": system_content},
-                {"role": "user", "content": prompt_text}
-            ],
-            temperature=0.3,  # Légèrement augmenté pour plus de variété
-            max_tokens=3000,  # Augmenté à 3000 tokens pour des réponses très développées
-            timeout=90  # Timeout augmenté pour GPT-4 qui peut être plus lent
+        except Exception as e:
+            metrics["error"] = str(e)
+            yield f"Erreur lors de la génération: {str(e)}"
+        
+        finally:
+            end = time.perf_counter()
+            completion_tokens = usage.completion_tokens if usage is not None else chunk_count
+            generation_time = end - first_token_at if first_token_at is not None else None
+            metrics.update({
+                "ttft_s": round(first_token_at - start, 3) if first_token_at is not None else None,
+                "total_s": round(end - start, 3),
+                "completion_tokens": completion_tokens,
+                "prompt_tokens": usage.prompt_tokens if usage is not None else None,
+                "tokens_per_s": round(completion_tokens / generation_time, 1) if generation_time else None,
+            })
+            record_generation(metrics)
+            llm_span.update(
+                ttft_ms=round((first_token_at - start) * 1000, 1) if first_token_at is not None else None,
+                completion_tokens=completion_tokens,
+            )
+
+# Fonction pour générer une réponse (approche directe avec plus de contexte)
+def generate_answer(vector_store, question, mode="question", filters=None):
+    """Génère une réponse développée en utilisant plusieurs segments de documents
+    
+    Args:
+        vector_store: Le vector store FAISS
+        question: La question de l'utilisateur
+        mode: "question" pour réponses normales, "redaction" pour format mémoire académique
+        filters: Filtres de recherche optionnels (voir select_shards)
+    """
+    docs = retrieve_documents(vector_store, question, k=retrieval_depth(), filters=filters)
+    
+    if not docs:
+        return "Aucun document pertinent trouvé.", []
+    docs, _ = rerank_documents(question, docs)
+    docs, _ = pack_documents(vector_store, question, docs)
+    
+    answer = "".join(stream_answer(question, docs, mode=mode))
+    return answer, docs
+
+# Affichage des sources d'une réponse
+def render_sources(sources, title="📚 Sources", key=None):
+    """Affiche la liste dédoublonnée (source, page) des segments utilisés, doublons fusionnés compris
+
+    Args:
+        sources: Références compactes (history.source_refs) ou Documents
+        title: Titre de l'encadré
+        key: Position du message ; si fournie, les extraits peuvent être relus dans l'index à la demande
+    """
+    refs = source_refs(sources)
+    with st.expander(title):
+        unique_sources = {}
+        for ref in refs:
+            for cited in ref_citations(ref):
+                source_name, page = cited["source"], cited["page"]
+                label = f"{source_name}_{page}"
+                if label not in unique_sources:
+                    unique_sources[label] = (source_name, page)
+        
+        for source_name, page in unique_sources.values():
+            st.text(f"• {source_name} (Page {page})")
+        
+        # Texte des segments relu dans la docstore seulement si demandé
+        vector_store = st.session_state.get("vector_store")
+        if key is not None and vector_store is not None and st.toggle("Afficher les extraits", key=f"excerpts_{key}"):
+            for ref, text in zip(refs, resolve_refs(vector_store.docstore, refs)):
+                st.caption(f"{ref['source']} (Page {ref['page']})")
+                st.text(text if text is not None else "Extrait indisponible (l'index a été mis à jour depuis cette réponse).")
+
+# Affichage de l'historique
+def render_message(message, position):
+    """Affiche un message de l'historique et ses sources"""
+    with st.chat_message(message["role"]):
+        st.markdown(message["content"])
+        if message.get("sources"):
+            render_sources(message["sources"], key=position)
+
+def render_history(history):
+    """Affiche les derniers messages ; les plus anciens sont relus page par page, à la demande"""
+    recent_start = max(0, len(history) - HISTORY_PAGE_SIZE)
+    if recent_start and st.toggle(f"🕘 Afficher les {recent_start} message(s) précédent(s)", key="show_older_messages"):
+        pages = -(-recent_start // HISTORY_PAGE_SIZE)
+        page = 1
+        if pages > 1:
+            page = st.number_input("Page (1 = la plus récente)", min_value=1, max_value=pages, value=1)
+        end = recent_start - (page - 1) * HISTORY_PAGE_SIZE
+        start = max(0, end - HISTORY_PAGE_SIZE)
+        for position, message in enumerate(history.window(start, end), start):
+            render_message(message, position)
+        st.divider()
+    for position, message in enumerate(history.window(recent_start, len(history)), recent_start):
+        render_message(message, position)
+
+# Filtres de recherche (barre latérale)
+def render_search_filters(vector_store):
+    """Affiche le choix des sources, années et pages interrogées ; retourne les filtres actifs"""
+    shards = getattr(vector_store, "shards", None) if vector_store is not None else None
+    if shards is None or not len(shards):
+        return {}
+    filters = {}
+    sizes = shards.sizes()
+    
+    def label(source):
+        if source in shards.aliases:
+            return f"{source} (copie de {shards.aliases[source]})"
+        return f"{source} ({sizes[source]} segments)"
+    
+    with st.expander("🔎 Filtrer les sources"):
+        selected = st.multiselect(
+            "Sources",
+            sorted(set(sizes) | set(shards.aliases)),
+            format_func=label,
+            placeholder="Toutes les sources",
+            help="Limite la recherche aux documents choisis (appliqué avant la recherche). "
+                 "Une copie identique d'un PDF interroge les segments de son original."
         )
+        if selected:
+            filters["sources"] = selected
         
-        answer = response.choices[0].message.content
+        years = sorted({shards.year(source) for source in sizes} - {0})
+        if len(years) > 1:
+            year_range = st.slider("Années", years[0], years[-1], (years[0], years[-1]))
+            if year_range != (years[0], years[-1]):
+                filters["years"] = year_range
         
-    except Exception as e:
-        answer = f"Erreur lors de la génération: {str(e)}"
+        page_range = shards.page_range()
+        if page_range and page_range[1] > page_range[0]:
+            pages = st.slider("Pages", page_range[0], page_range[1], page_range)
+            if pages != page_range:
+                filters["pages"] = pages
+        
+        if filters:
+            selection = shards.select(filters.get("sources"), filters.get("years"), filters.get("pages"))
+            st.caption(
+                f"{sum(len(p) for p in selection.values())} segment(s) de {len(selection)} source(s) "
+                f"interrogé(s) sur {len(shards)}"
+            )
+    return filters
+
+# Suivi de l'indexation en tâche de fond (barre latérale)
+@st.fragment(run_every=2)
+def render_indexing_status():
+    """Affiche la progression de l'indexation en cours ou le bilan de la dernière (actualisé toutes les 2 s)"""
+    state = get_indexing_jobs().state()
+    if state is None:
+        return
     
-    return answer, docs
+    if state["status"] == "running":
+        st.progress(state["progress"], text=state["status_text"])
+    elif state["status"] == "interrupted" or (state["status"] == "failed" and state.get("resumable")):
+        st.warning("⏸️ Indexation interrompue : cliquez sur « Indexer les documents » pour la reprendre.")
+    elif state["status"] == "failed":
+        st.error(f"❌ Échec de l'indexation : {state['error']}")
+    
+    if state["status"] != "running" and st.session_state.get("indexing_seen") != state["id"]:
+        # Indexation terminée depuis le dernier affichage : recharger la page entière
+        # pour basculer sur la nouvelle version de l'index et réactiver le bouton
+        st.session_state.indexing_seen = state["id"]
+        st.rerun(scope="app")
+    
+    if state["messages"]:
+        with st.expander("📋 Journal d'indexation", expanded=state["status"] == "running"):
+            for level, text in state["messages"][-10:]:
+                getattr(st, level, st.info)(text)
+
+# Suivi du préchargement (barre latérale)
+@st.fragment(run_every=1)
+def render_prewarm_status():
+    """Signale le préchargement en cours et recharge la page entière quand il est terminé"""
+    if prewarm().is_alive():
+        st.info("⏳ Chargement du modèle et de l'index en arrière-plan...")
+    else:
+        st.rerun(scope="app")
+
+# Panneau des temps d'exécution (barre latérale)
+def render_timings_panel():
+    """Affiche les dernières mesures par étape et leurs agrégats"""
+    spans = recent_spans(limit=30)
+    if not spans:
+        st.caption("Aucune mesure pour l'instant.")
+        return
+    st.caption("Dernières étapes (ms)")
+    st.dataframe(
+        [{"étape": s["span"], "ms": s["duration_ms"], "trace": s["trace"]} for s in reversed(spans)],
+        hide_index=True,
+        use_container_width=True
+    )
+    with st.expander("📈 Agrégats"):
+        st.dataframe(span_summary(), hide_index=True, use_container_width=True)
+    with st.expander("Export Prometheus"):
+        st.code(prometheus_text(), language="text")
+        if METRICS_PORT:
+            st.caption(f"Aussi servi sur http://127.0.0.1:{METRICS_PORT}/metrics")
 
 # Fonction principale
 def main():
     """Fonction principale de l'application"""
     
+    # Exposition des métriques au format Prometheus (une seule fois par processus)
+    if METRICS_PORT:
+        try:
+            start_metrics_server(METRICS_PORT)
+        except OSError:
+            pass  # Port déjà utilisé par un autre processus
+    
     # Initialiser l'état de session
     if "authenticated" not in st.session_state:
         st.session_state.authenticated = False
     
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
-    
     if "vector_store" not in st.session_state:
         st.session_state.vector_store = None
     
     if "mode" not in st.session_state:
         st.session_state.mode = "question"  # Mode par défaut : question
     
+    if "stream_answers" not in st.session_state:
+        st.session_state.stream_answers = True  # Affichage progressif par défaut
+    
     # Vérifier l'authentification
     if not st.session_state.authenticated:
         if not authenticate():
             return
     
+    if "history" not in st.session_state:
+        st.session_state.history = ChatHistory(
+            st.session_state.get("username"), max_messages=HISTORY_MAX_MESSAGES, history_dir=HISTORY_PATH
+        )
+        # Journaux des sessions terminées depuis plus de HISTORY_RETENTION_DAYS jours
+        prune_history(HISTORY_PATH, HISTORY_RETENTION_DAYS, keep=[st.session_state.history.path])
+    history = st.session_state.history
+    
     # Vérifier que l'API key est disponible
     api_key = get_secret("OPENAI_API_KEY")
     if not api_key:
@@ -438,18 +1480,11 @@ def main():
         
         return
     
-    # Charger automatiquement l'index s'il existe et n'est pas déjà chargé
-    if st.session_state.vector_store is None:
-        if os.path.exists(FAISS_PATH) and os.path.exists(os.path.join(FAISS_PATH, "index.faiss")):
-            try:
-                embeddings = get_embeddings()
-                st.session_state.vector_store = FAISS.load_local(FAISS_PATH, embeddings, allow_dangerous_deserialization=True)
-                # Stocker l'erreur de chargement si elle existe
-                if "index_load_error" in st.session_state:
-                    del st.session_state["index_load_error"]
-            except Exception as e:
-                # Stocker l'erreur pour l'afficher dans la sidebar
-                st.session_state["index_load_error"] = str(e)
+    # Le modèle et l'index se chargent en arrière-plan : la page s'affiche sans les attendre,
+    # l'index est pris en main une fois le préchargement terminé
+    warming = PREWARM and prewarm().is_alive()
+    if not warming:
+        refresh_index_lease()
     
     # Barre latérale
     with st.sidebar:
@@ -472,43 +1507,59 @@ def main():
             st.session_state.mode = "question"
             st.info("❓ Mode **Question** activé : réponses conversationnelles")
         
+        st.session_state.stream_answers = st.checkbox(
+            "Affichage progressif de la réponse",
+            value=st.session_state.stream_answers,
+            help="Affiche la réponse au fur et à mesure de sa génération au lieu d'attendre la réponse complète."
+        )
+        
         st.markdown("---")
         
         # Afficher un message si l'index n'a pas pu être chargé
-        if st.session_state.vector_store is None and os.path.exists(FAISS_PATH) and os.path.exists(os.path.join(FAISS_PATH, "index.faiss")):
+        if not warming and st.session_state.vector_store is None and index_version(FAISS_PATH) is not None:
             st.error("❌ Impossible de charger l'index existant")
             if "index_load_error" in st.session_state:
                 with st.expander("🔍 Détails de l'erreur"):
                     st.text(st.session_state["index_load_error"])
             if st.button("🗑️ Supprimer l'index corrompu"):
-                if os.path.exists(FAISS_PATH):
-                    shutil.rmtree(FAISS_PATH)
+                # Retrait atomique ; les fichiers sont supprimés dès que plus aucune session ne les lit
+                unpublish(FAISS_PATH)
+                registry.forget_index()
                 if "index_load_error" in st.session_state:
                     del st.session_state["index_load_error"]
                 st.rerun()
         
-        # Bouton d'indexation
-        if st.button("📚 Indexer les documents", type="primary"):
-            with st.spinner("Indexation en cours..."):
-                vector_store = index_documents()
-                if vector_store:
-                    st.session_state.vector_store = vector_store
-                    st.rerun()
+        # Bouton d'indexation : l'indexation tourne en tâche de fond, la page reste utilisable
+        indexing_jobs = get_indexing_jobs()
+        if st.button("📚 Indexer les documents", type="primary", disabled=indexing_jobs.running()):
+            start_indexing()
+            st.rerun()
+        render_indexing_status()
         
         # Afficher le statut de l'index
         if st.session_state.vector_store:
             st.success("✅ Index disponible")
+        elif warming:
+            render_prewarm_status()
         else:
             st.warning("⚠️ Index non chargé. Cliquez sur 'Indexer les documents'.")
             # Debug: vérifier si le dossier existe
             if os.path.exists(FAISS_PATH):
-                if os.path.exists(os.path.join(FAISS_PATH, "index.faiss")):
+                if index_version(FAISS_PATH) is not None:
                     st.info("ℹ️ Index FAISS trouvé mais non chargé. Essayez de réindexer.")
                 else:
                     st.info("ℹ️ Dossier index vide. Indexation nécessaire.")
         
+        # Restreindre la recherche à certaines sources, années ou pages
+        search_filters = render_search_filters(st.session_state.vector_store)
+        
         st.markdown("---")
         
+        # Panneau optionnel des temps d'exécution par étape
+        if st.checkbox("⏱️ Afficher les temps d'exécution", value=False):
+            render_timings_panel()
+            st.markdown("---")
+        
         # Bouton de déconnexion
         if st.button("🚪 Se déconnecter"):
             for key in list(st.session_state.keys()):
@@ -522,74 +1573,114 @@ def main():
     
     # Plus besoin d'initialiser la chaîne QA, on utilise une approche directe
     
-    # Afficher l'historique des messages
-    for message in st.session_state.messages:
-        with st.chat_message(message["role"]):
-            st.markdown(message["content"])
-            # Afficher les sources si disponibles
-            if "sources" in message and message["sources"]:
-                with st.expander("📚 Sources"):
-                    for source in message["sources"]:
-                        source_name = source.metadata.get("source", "Inconnu")
-                        page = source.metadata.get("page", "N/A")
-                        st.text(f"• {source_name} (Page {page})")
+    # Afficher l'historique des messages (fenêtre des plus récents)
+    render_history(history)
     
     # Entrée utilisateur
     if prompt := st.chat_input("Posez votre question sur le wokisme..."):
+        # Question posée pendant le préchargement : attendre l'index plutôt que de refuser
+        if st.session_state.vector_store is None and warming:
+            with st.spinner("Chargement de l'index..."):
+                prewarm().join()
+                refresh_index_lease()
+        
         # Vérifier que le vector store est disponible
         if st.session_state.vector_store is None:
             st.error("⚠️ Veuillez d'abord indexer les documents depuis la barre latérale.")
             return
         
         # Ajouter le message utilisateur à l'historique
-        st.session_state.messages.append({"role": "user", "content": prompt})
+        history.append("user", prompt)
         
         # Afficher le message utilisateur
         with st.chat_message("user"):
             st.markdown(prompt)
         
-        # Générer la réponse (approche directe et rapide)
-        with st.chat_message("assistant"):
-            with st.spinner("Réflexion en cours..."):
-                try:
-                    # Appel direct avec le mode sélectionné
-                    answer, sources = generate_answer(
-                        st.session_state.vector_store, 
-                        prompt, 
-                        mode=st.session_state.mode
-                    )
-                    
-                    # Afficher la réponse
+        # Générer la réponse (approche directe et rapide) ; les étapes sont chronométrées sous une même trace
+        with st.chat_message("assistant"), trace("query"):
+            try:
+                # Réponse déjà donnée à une question (quasi) identique sur cette version de l'index ?
+                answer_cache = get_answer_cache()
+                store_version = st.session_state.index_lease.version
+                # Une réponse obtenue avec d'autres filtres de sources n'est pas réutilisée
+                cache_mode = st.session_state.mode
+                if search_filters:
+                    cache_mode += "|" + json.dumps(search_filters, sort_keys=True, ensure_ascii=False)
+                with span("query.cache_lookup") as cache_span:
+                    question_vector = get_embeddings().embed_query(prompt)
+                    cached = answer_cache.lookup(question_vector, cache_mode, store_version)
+                    cache_span["hit"] = int(cached is not None)
+                
+                if cached:
+                    sources = cached["sources"]
+                    answer = cached["answer"]
+                    render_sources(sources, "📚 Sources utilisées", key=len(history))
                     st.markdown(answer)
+                    st.caption(
+                        f"♻️ Réponse issue du cache (question similaire à {cached['similarity']:.0%} : "
+                        f"« {cached['question']} »)"
+                    )
+                else:
+                    with st.spinner("Recherche des documents..."):
+                        sources = retrieve_documents(
+                            st.session_state.vector_store, prompt, k=retrieval_depth(), filters=search_filters
+                        )
+                        sources, rerank_report = rerank_documents(prompt, sources)
+                        sources, pack_report = pack_documents(
+                            st.session_state.vector_store, prompt, sources, question_vector
+                        )
                     
-                    # Afficher les sources
-                    if sources:
-                        with st.expander("📚 Sources utilisées"):
-                            unique_sources = {}
-                            for source in sources:
-                                source_name = source.metadata.get("source", "Inconnu")
-                                page = source.metadata.get("page", "N/A")
-                                key = f"{source_name}_{page}"
-                                if key not in unique_sources:
-                                    unique_sources[key] = (source_name, page)
-                            
-                            for source_name, page in unique_sources.values():
-                                st.text(f"• {source_name} (Page {page})")
-                    
-                    # Ajouter la réponse à l'historique
-                    st.session_state.messages.append({
-                        "role": "assistant",
-                        "content": answer,
-                        "sources": sources
-                    })
-                    
-                except Exception as e:
-                    error_msg = f"❌ Erreur lors de la génération de la réponse : {str(e)}"
-                    st.error(error_msg)
-                    st.session_state.messages.append({
-                        "role": "assistant",
-                        "content": error_msg
-                    })
+                    if not sources:
+                        answer = "Aucun document pertinent trouvé."
+                        st.markdown(answer)
+                    else:
+                        # Afficher les sources dès la fin de la recherche, avant la génération
+                        render_sources(sources, "📚 Sources utilisées", key=len(history))
+                        
+                        metrics = {}
+                        if rerank_report:
+                            metrics["reranked"] = rerank_report["reranked"]
+                        if pack_report:
+                            metrics.update(
+                                context_tokens=pack_report["tokens_after"],
+                                tokens_saved=pack_report["tokens_saved"]
+                            )
+                        if st.session_state.stream_answers:
+                            # Afficher les tokens au fur et à mesure de leur arrivée
+                            placeholder = st.empty()
+                            answer = ""
+                            for token in stream_answer(prompt, sources, mode=st.session_state.mode, metrics=metrics):
+                                answer += token
+                                placeholder.markdown(answer + "▌")
+                            placeholder.markdown(answer)
+                        else:
+                            with st.spinner("Réflexion en cours..."):
+                                answer = "".join(stream_answer(prompt, sources, mode=st.session_state.mode, metrics=metrics))
+                            st.markdown(answer)
+                        
+                        if metrics.get("ttft_s") is not None:
+                            st.caption(
+                                f"⏱️ Premier token : {metrics['ttft_s']:.1f} s · "
+                                f"{metrics['tokens_per_s'] or 0:.0f} tokens/s · total {metrics['total_s']:.1f} s"
+                            )
+                        if pack_report:
+                            st.caption(
+                                f"🧩 Contexte : {pack_report['tokens_after']} tokens "
+                                f"({pack_report['tokens_saved']} économisés sur {pack_report['tokens_before']})"
+                            )
+                        
+                        if "error" not in metrics:
+                            answer_cache.store(
+                                prompt, question_vector, cache_mode, store_version, answer, source_refs(sources)
+                            )
+                
+                # Ajouter la réponse à l'historique (références des sources, pas leur texte)
+                history.append("assistant", answer, sources)
+                
+            except Exception as e:
+                error_msg = f"❌ Erreur lors de la génération de la réponse : {str(e)}"
+                st.error(error_msg)
+                history.append("assistant", error_msg)
 
 # Point d'entrée
 if __name__ == "__main__":
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Traitement par lots (sans interface) d'une liste de questions préparées.
+
+Les questions sont cherchées par lots (un seul appel FAISS pour tout le lot),
+puis les réponses sont générées en parallèle via le client OpenAI asynchrone,
+avec une limite de requêtes simultanées et un limiteur de débit en tokens par
+minute. Chaque réponse est ajoutée au fichier JSONL de sortie dès qu'elle est
+reçue : un arrêt brutal ne perd rien, et une relance reprend là où le
+traitement s'était arrêté (les identifiants déjà présents sont ignorés).
+Sans identifiant explicite, une question est identifiée par l'empreinte de son
+mode et de son texte : modifier le fichier entre deux relances ne décale rien.
+
+Format d'entrée :
+    - .jsonl : une question par ligne, {"question": "...", "mode": "redaction", "id": "..."}
+      ("mode" et "id" sont facultatifs) ;
+    - sinon : une question par ligne, éventuellement préfixée du mode et d'une
+      tabulation ("redaction<TAB>Rédigez une introduction sur...").
+
+Usage :
+    python batch_query.py questions.jsonl --output reponses.jsonl [--concurrency 4] [--tpm 30000]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+
+MODES = ("question", "redaction")
+
+# Estimation grossière pour le limiteur : ~4 caractères par token
+CHARS_PER_TOKEN = 4
+
+
+def question_id(question, mode):
+    """Identifiant stable d'une question : empreinte de son mode et de son texte"""
+    return hashlib.sha1(f"{mode}\x00{question}".encode('utf-8')).hexdigest()[:16]
+
+
+def load_questions(path, default_mode="question"):
+    """Lit le fichier de questions ; retourne une liste de dicts {id, question, mode}"""
+    items = []
+    seen = set()
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if path.endswith(".jsonl"):
+                entry = json.loads(line)
+                question = entry["question"].strip()
+                mode = entry.get("mode", default_mode)
+                item_id = entry.get("id")
+            else:
+                mode, sep, question = line.partition("\t")
+                if not sep or mode not in MODES:
+                    mode, question = default_mode, line
+                item_id = None
+            if mode not in MODES:
+                raise ValueError(f"Ligne {line_no} : mode inconnu « {mode} » (attendu : {', '.join(MODES)})")
+            item_id = str(item_id) if item_id is not None else question_id(question, mode)
+            if item_id in seen:
+                continue  # Question répétée : une seule réponse
+            seen.add(item_id)
+            items.append({"id": item_id, "question": question, "mode": mode})
+    return items
+
+
+def completed_ids(path):
+    """Identifiants déjà traités avec succès dans le fichier de sortie"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Dernière ligne tronquée par un arrêt brutal
+            if not entry.get("error"):
+                done.add(entry["id"])
+    return done
+
+
+class TokenRateLimiter:
+    """Seau à jetons en tokens par minute, partagé par toutes les requêtes
+
+    Chaque requête réserve une estimation (prompt + max_tokens) avant l'appel ;
+    la réservation est corrigée avec l'usage réel renvoyé par l'API.
+    """
+
+    def __init__(self, tokens_per_minute):
+        self.capacity = float(tokens_per_minute)
+        self.rate = self.capacity / 60.0
+        self.available = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens):
+        """Attend que `tokens` soient disponibles ; retourne la quantité réservée"""
+        tokens = min(float(tokens), self.capacity)
+        async with self._lock:
+            self._refill()
+            while self.available < tokens:
+                await asyncio.sleep((tokens - self.available) / self.rate)
+                self._refill()
+            self.available -= tokens
+        return tokens
+
+    def adjust(self, reserved, used):
+        """Rend (ou prélève) l'écart entre la réservation et l'usage réel"""
+        self._refill()
+        self.available = min(self.capacity, self.available + reserved - used)
+
+
+def retrieve_and_pack(vector_store, questions, k):
+    """Recherche groupée, reclassement puis assemblage du contexte de chaque question"""
+    import app
+
+    packed = []
+    for question, docs in zip(questions, app.retrieve_documents_batch(vector_store, questions, k)):
+        docs, _ = app.rerank_documents(question, docs)
+        packed.append(app.pack_documents(vector_store, question, docs))
+    return packed
+
+
+async def answer_one(client, item, docs, semaphore, limiter, args, pack_report=None):
+    """Génère la réponse d'une question ; retourne l'entrée JSONL"""
+    import app
+    from metrics import record_generation
+
+    system_content, prompt_text = app.build_prompt(item["question"], docs, item["mode"])
+    estimate = (len(system_content) + len(prompt_text)) // CHARS_PER_TOKEN + args.max_tokens
+    entry = dict(item, sources=[
+        {"source": doc.metadata.get("source", "Inconnu"), "page": doc.metadata.get("page", "N/A")} for doc in docs
+    ])
+    metrics = {"mode": item["mode"], "model": args.model, "prompt_chars": len(system_content) + len(prompt_text), "batch": True}
+    if pack_report:
+        metrics.update(context_tokens=pack_report["tokens_after"], tokens_saved=pack_report["tokens_saved"])
+
+    async with semaphore:
+        reserved = await limiter.acquire(estimate) if limiter else 0
+        start = time.perf_counter()
+        used = reserved
+        try:
+            response = await client.chat.completions.create(
+                model=args.model,
+                messages=[
+                    {"role": "system", "content": system_content},
+                    {"role": "user", "content": prompt_text}
+                ],
+                temperature=0.3,
+                max_tokens=args.max_tokens,
+                timeout=app.LLM_TIMEOUT,
+            )
+            entry["answer"] = response.choices[0].message.content or ""
+            if response.usage is not None:
+                used = response.usage.total_tokens
+                metrics.update(prompt_tokens=response.usage.prompt_tokens, completion_tokens=response.usage.completion_tokens)
+        except Exception as e:
+            entry["answer"] = None
+            entry["error"] = str(e)
+            metrics["error"] = str(e)
+        finally:
+            if limiter:
+                limiter.adjust(reserved, used)
+    metrics["total_s"] = round(time.perf_counter() - start, 3)
+    entry["metrics"] = record_generation(metrics)
+    return entry
+
+
+async def run(args):
+    import app
+    from openai import AsyncOpenAI
+    from versions import reading
+
+    items = load_questions(args.input, args.mode)
+    done = completed_ids(args.output)
+    pending = [item for item in items if item["id"] not in done]
+    print(f"{len(items)} questions, {len(items) - len(pending)} déjà traitées, {len(pending)} à traiter", file=sys.stderr)
+    if not pending:
+        return 0
+
+    # Version lue protégée de la collecte (réindexation par le serveur) jusqu'à la fin du lot
+    with reading(args.index) as index_path:
+        if app.index_version(args.index) is None:
+            print(f"❌ Aucun index dans {args.index} : lancez d'abord l'indexation", file=sys.stderr)
+            return 1
+        vector_store = app.load_vector_store(index_path)
+
+        client = AsyncOpenAI(api_key=app.get_secret("OPENAI_API_KEY"), max_retries=args.max_retries)
+        semaphore = asyncio.Semaphore(args.concurrency)
+        limiter = TokenRateLimiter(args.tpm) if args.tpm else None
+        failures = 0
+        written = 0
+
+        with open(args.output, 'a', encoding='utf-8') as out:
+            async def write(task):
+                nonlocal failures, written
+                entry = await task
+                out.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                out.flush()
+                os.fsync(out.fileno())
+                written += 1
+                failures += bool(entry.get("error"))
+                print(f"[{written}/{len(pending)}] {entry['id']} {'❌ ' + entry['error'] if entry.get('error') else '✅'}", file=sys.stderr)
+
+            writers = []
+            for i in range(0, len(pending), args.retrieval_batch):
+                batch = pending[i:i + args.retrieval_batch]
+                # Recherche du lot dans un thread : les générations en cours continuent pendant ce temps
+                docs_batch = await asyncio.to_thread(
+                    retrieve_and_pack, vector_store, [item["question"] for item in batch], args.k
+                )
+                for item, (docs, pack_report) in zip(batch, docs_batch):
+                    task = asyncio.create_task(answer_one(client, item, docs, semaphore, limiter, args, pack_report))
+                    writers.append(asyncio.create_task(write(task)))
+            await asyncio.gather(*writers)
+
+        await client.close()
+        print(f"Terminé : {written - failures} réponses, {failures} échecs -> {args.output}", file=sys.stderr)
+        return 1 if failures else 0
+
+
+def main(argv=None):
+    import app
+
+    parser = argparse.ArgumentParser(description="Génère les réponses d'une liste de questions (sans interface)")
+    parser.add_argument("input", help="Fichier de questions (.jsonl ou texte, une par ligne)")
+    parser.add_argument("--output", default="batch_answers.jsonl", help="Fichier JSONL de sortie (complété au fil de l'eau)")
+    parser.add_argument("--mode", choices=MODES, default="question", help="Mode par défaut des questions")
+    parser.add_argument("--index", default=app.FAISS_PATH, help="Dossier de l'index FAISS")
+    parser.add_argument("--k", type=int, default=app.retrieval_depth(), help="Segments récupérés par question")
+    parser.add_argument("--retrieval-batch", type=int, default=64, help="Questions cherchées par appel FAISS")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("BATCH_CONCURRENCY", "4")),
+                        help="Requêtes OpenAI simultanées")
+    parser.add_argument("--tpm", type=int, default=int(os.getenv("BATCH_TOKENS_PER_MINUTE", "30000")),
+                        help="Limite de tokens par minute (0 = sans limite)")
+    parser.add_argument("--model", default=app.LLM_MODEL)
+    parser.add_argument("--max-tokens", type=int, default=app.LLM_MAX_TOKENS)
+    parser.add_argument("--max-retries", type=int, default=5, help="Nouvelles tentatives du client OpenAI (429, 5xx)")
+    args = parser.parse_args(argv)
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+"""
+Banc d'essai hors ligne de la chaîne d'indexation et de recherche.
+
+Mesure le temps de démarrage de app.py (import à froid) puis, sur le corpus
+réel de data/ : pages/s extraites, segments/s découpés et vectorisés, temps de
+construction et de chargement de l'index, latences de recherche p50/p95/p99,
+mémoire résidente maximale, et (option --with-llm) le temps jusqu'au premier
+token via un faux serveur OpenAI local. L'option --compare-chunking compare
+le découpage actuel au découpage parent-enfant (segments, taille de l'index,
+tokens de contexte par question).
+
+Tout fonctionne sans réseau : si les poids MiniLM ne sont pas en cache, un
+modèle d'embeddings aléatoire (hachage des mots) les remplace. Le résultat est
+écrit en JSON pour comparer les exécutions d'un commit à l'autre.
+
+Usage :
+    python bench.py [--max-files 10] [--embeddings auto|minilm|hash] [--backend onnx] [--with-llm] [--output bench.json]
+    python bench.py --startup-only
+    python bench.py --compare-chunking [--max-files 10]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Aucun téléchargement depuis le Hub Hugging Face pendant le banc d'essai
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from embeddings import BACKENDS
+
+# Questions types utilisées pour mesurer la recherche (remplaçables par --queries)
+DEFAULT_QUERIES = [
+    "Qu'est-ce que le wokisme ?",
+    "Origine du terme woke aux États-Unis",
+    "Critiques du wokisme par Pierre Valentin et la Fondapol",
+    "Discrimination positive et méritocratie à Sciences Po",
+    "Le féminisme universaliste de Martine Storti",
+    "Comment l'extrême droite a renouvelé le militantisme féminin",
+    "La République réactionnaire et le racisme libéral",
+    "Égalité des chances dans l'enseignement supérieur",
+    "Walras et l'économie politique",
+    "Mutation sociale et contestation politique en Iran",
+    "De woke au wokisme : anatomie d'un anathème",
+    "Neutralité des sites web publics",
+]
+
+
+class HashingEmbeddings(Embeddings):
+    """Modèle d'embeddings minimal et déterministe (vecteurs aléatoires par mot)
+
+    Remplace MiniLM lorsque ses poids ne sont pas disponibles hors ligne : les
+    débits mesurés sont alors ceux de la chaîne hors modèle.
+    """
+
+    def __init__(self, dim=384):
+        self.dim = dim
+        self._vectors = {}
+
+    def _word_vector(self, word):
+        vector = self._vectors.get(word)
+        if vector is None:
+            seed = int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+            self._vectors[word] = vector
+        return vector
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in text.lower().split():
+            vector += self._word_vector(word)
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def load_embeddings(kind, model_name, backend="torch"):
+    """Retourne (nom, modèle) : MiniLM si ses poids sont en cache local, sinon le modèle aléatoire"""
+    if kind in ("auto", "minilm"):
+        try:
+            from embeddings import create_embeddings
+            model = create_embeddings(backend, model_name)
+            model.embed_query("test")
+            return model_name if backend == "torch" else f"{model_name}@{backend}", model
+        except Exception as e:
+            if kind == "minilm":
+                raise
+            print(f"⚠️ MiniLM indisponible hors ligne ({type(e).__name__}) : modèle aléatoire utilisé", file=sys.stderr)
+    return "hashing-random-384", HashingEmbeddings()
+
+
+class _StubOpenAIHandler(BaseHTTPRequestHandler):
+    """Imite POST /v1/chat/completions (réponse complète ou flux SSE)"""
+
+    tokens = ["Réponse "] * 200
+    token_delay = 0.002
+    first_token_delay = 0.05
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        model = body.get("model", "stub")
+        prompt_tokens = sum(len(m.get("content", "")) for m in body.get("messages", [])) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(self.tokens),
+                 "total_tokens": prompt_tokens + len(self.tokens)}
+        time.sleep(self.first_token_delay)
+
+        if not body.get("stream"):
+            payload = json.dumps({
+                "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "".join(self.tokens)}}],
+                "usage": usage,
+            }).encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+
+        def send(obj):
+            self.wfile.write(b"data: " + json.dumps(obj).encode('utf-8') + b"\n\n")
+            self.wfile.flush()
+
+        base = {"id": "stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+        for token in self.tokens:
+            send(dict(base, choices=[{"index": 0, "delta": {"content": token}, "finish_reason": None}]))
+            time.sleep(self.token_delay)
+        send(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        if body.get("stream_options", {}).get("include_usage"):
+            send(dict(base, choices=[], usage=usage))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def start_stub_openai():
+    """Démarre le faux serveur OpenAI sur un port libre ; retourne (serveur, base_url)"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubOpenAIHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def peak_rss_mb():
+    """Mémoire résidente maximale (Mo) du processus et de ses processus fils terminés"""
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+            return {"self": round(psutil.Process().memory_info().peak_wset / 1e6, 1), "children": None}
+        except Exception:
+            return {"self": None, "children": None}
+    # ru_maxrss : kilo-octets sous Linux, octets sous macOS
+    unit = 1 if sys.platform == "darwin" else 1024
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 1e6, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / 1e6, 1),
+    }
+
+
+def percentiles(values_ms):
+    """p50 / p95 / p99 d'une liste de durées en millisecondes"""
+    if not values_ms:
+        return {"p50": None, "p95": None, "p99": None}
+    return {f"p{p}": round(float(np.percentile(values_ms, p)), 3) for p in (50, 95, 99)}
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+# Dépendances lourdes qui ne doivent pas être importées avant l'écran de connexion
+HEAVY_MODULES = (
+    "torch", "sentence_transformers", "transformers", "onnxruntime",
+    "langchain_core", "langchain_community", "openai", "faiss",
+)
+
+_STARTUP_CODE = """
+import json, sys, time
+start = time.perf_counter()
+import app
+print(json.dumps({"seconds": time.perf_counter() - start, "heavy": [m for m in %r if m in sys.modules]}))
+"""
+
+
+def startup_profile(repeat=3, top=10):
+    """Temps d'import de app.py, c'est-à-dire avant l'affichage de l'écran de connexion
+
+    Chaque mesure lance un nouvel interpréteur (import à froid) avec `python -X importtime`.
+
+    Returns:
+        Dict : durée médiane (ms), modules importés directement par app.py les plus
+        coûteux (ms cumulées, dernière mesure) et dépendances lourdes importées
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    durations, children, heavy = [], [], []
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", _STARTUP_CODE % (HEAVY_MODULES,)],
+            cwd=root, capture_output=True, text=True, check=True,
+        )
+        measure = json.loads(proc.stdout.strip().splitlines()[-1])
+        durations.append(measure["seconds"] * 1000)
+        heavy = measure["heavy"]
+        # « import time: self [us] | cumulative | module » ; l'indentation du nom donne la profondeur,
+        # et les imports d'un module sont listés juste avant lui
+        pending = []
+        for line in proc.stderr.splitlines():
+            parts = line.split("|")
+            if len(parts) != 3 or not parts[1].strip().isdigit():
+                continue
+            depth = len(parts[2]) - len(parts[2].lstrip())
+            name, cumulative_ms = parts[2].strip(), int(parts[1]) / 1000
+            if depth == 1:
+                if name == "app":
+                    children = pending
+                pending = []
+            elif depth == 3:
+                pending.append((name, cumulative_ms))
+    return {
+        "import_app_ms": round(float(np.median(durations)), 1),
+        "slowest_imports_ms": {name: round(ms, 1) for name, ms in sorted(children, key=lambda c: -c[1])[:top]},
+        "heavy_modules_imported": heavy,
+    }
+
+
+def chunking_profile(app, pages, embeddings, queries, batch_size=50):
+    """Segments, taille de l'index et tokens de contexte par question pour le découpage courant (app.CHUNKING)"""
+    from langchain_community.vectorstores import FAISS
+
+    from context import count_tokens
+    from docstore import save_store
+    from ingest import split_file
+
+    chunks, parents = [], {}
+    for name, docs in pages.items():
+        file_chunks, file_parents = split_file(
+            app.create_text_splitter(), name, docs, lambda pdf_file, i: f"{pdf_file}#{i}"
+        )
+        chunks.extend(file_chunks)
+        parents.update(file_parents)
+    texts = [d.page_content for d in chunks]
+    vectors = []
+    for i in range(0, len(texts), batch_size):
+        vectors.extend(embeddings.embed_documents(texts[i:i + batch_size]))
+    vector_store = FAISS.from_embeddings(list(zip(texts, vectors)), embeddings, metadatas=[d.metadata for d in chunks])
+    if parents:
+        vector_store.docstore.add(parents)
+
+    with tempfile.TemporaryDirectory(prefix="rag-bench-chunking-") as index_dir:
+        save_store(vector_store, index_dir)
+        files = {f: os.path.getsize(os.path.join(index_dir, f)) for f in os.listdir(index_dir)}
+
+    retrieved, sent = [], []
+    for query in queries:
+        query_vector = embeddings.embed_query(query)
+        docs = vector_store.similarity_search_by_vector(query_vector, k=app.TOP_K)
+        retrieved.append(sum(count_tokens(d.page_content, app.LLM_MODEL) for d in docs))
+        packed, _ = app.pack_documents(vector_store, query, docs, query_vector)
+        sent.append(sum(count_tokens(d.page_content, app.LLM_MODEL) for d in packed))
+    return {
+        "chunks": len(chunks),
+        "parents": len(parents),
+        "embedded_chars": sum(len(t) for t in texts),
+        "index_bytes": sum(files.values()),
+        "vectors_bytes": files.get("index.faiss", 0),
+        "retrieved_tokens_mean": round(float(np.mean(retrieved)), 1) if retrieved else None,
+        "context_tokens_mean": round(float(np.mean(sent)), 1) if sent else None,
+    }
+
+
+def compare_chunking(app, pages, embeddings, queries, batch_size=50):
+    """Découpage flat (CHUNK_SIZE / CHUNK_OVERLAP) face au découpage parent-enfant"""
+    mode = app.CHUNKING
+    try:
+        results = {}
+        for chunking in ("flat", "parent-child"):
+            app.CHUNKING = chunking
+            results[chunking] = chunking_profile(app, pages, embeddings, queries, batch_size)
+    finally:
+        app.CHUNKING = mode
+    results["settings"] = {
+        "chunk_size": app.CHUNK_SIZE, "chunk_overlap": app.CHUNK_OVERLAP,
+        "child_chunk_size": app.CHILD_CHUNK_SIZE, "parent_chunk_size": app.PARENT_CHUNK_SIZE,
+        "parent_top_n": app.PARENT_TOP_N, "top_k": app.TOP_K, "context_packing": app.CONTEXT_PACKING,
+    }
+    return results
+
+
+def run(args):
+    import app
+    from langchain_community.vectorstores import FAISS
+
+    from bm25 import BM25Index
+    from docstore import load_store, save_store
+    from extraction import extract_pages
+
+    results = {
+        "commit": git_revision(),
+        "timestamp": time.time(),
+        "config": {
+            "data_path": args.data, "max_files": args.max_files, "workers": args.workers,
+            "chunk_size": app.CHUNK_SIZE, "chunk_overlap": app.CHUNK_OVERLAP, "batch_size": args.batch_size,
+        },
+    }
+
+    # 0. Démarrage : import de app.py jusqu'à l'écran de connexion
+    results["startup"] = startup_profile()
+    if args.startup_only:
+        return results
+
+    pdf_files = sorted(f for f in os.listdir(args.data) if f.endswith('.pdf'))
+    if args.max_files:
+        pdf_files = pdf_files[:args.max_files]
+
+    # 1. Extraction
+    start = time.perf_counter()
+    pages, failures = extract_pages(args.data, pdf_files, max_workers=args.workers or None)
+    extract_s = time.perf_counter() - start
+    page_count = sum(len(docs) for docs in pages.values())
+    results["extract"] = {
+        "files": len(pdf_files), "failures": len(failures), "pages": page_count,
+        "seconds": round(extract_s, 3), "pages_per_s": round(page_count / extract_s, 1) if extract_s else None,
+    }
+
+    # 2. Découpage
+    splitter = app.create_text_splitter()
+    start = time.perf_counter()
+    splits = [chunk for docs in pages.values() for chunk in splitter.split_documents(docs)]
+    split_s = time.perf_counter() - start
+    results["split"] = {
+        "chunks": len(splits), "seconds": round(split_s, 3),
+        "chunks_per_s": round(len(splits) / split_s, 1) if split_s else None,
+    }
+
+    # 3. Embeddings (modèle brut, sans le cache disque)
+    model_name, embeddings = load_embeddings(args.embeddings, app.EMBEDDING_MODEL, args.backend)
+    texts = [d.page_content for d in splits]
+    start = time.perf_counter()
+    vectors = []
+    for i in range(0, len(texts), args.batch_size):
+        vectors.extend(embeddings.embed_documents(texts[i:i + args.batch_size]))
+    embed_s = time.perf_counter() - start
+    results["embed"] = {
+        "model": model_name, "chunks": len(texts), "seconds": round(embed_s, 3),
+        "chunks_per_s": round(len(texts) / embed_s, 1) if embed_s else None,
+    }
+
+    with tempfile.TemporaryDirectory(prefix="rag-bench-") as index_dir:
+        # 4. Construction et sauvegarde de l'index (FAISS + SQLite + BM25)
+        start = time.perf_counter()
+        vector_store = FAISS.from_embeddings(
+            list(zip(texts, vectors)), embeddings, metadatas=[d.metadata for d in splits]
+        )
+        save_store(vector_store, index_dir)
+        app.build_lexical_index(vector_store).save(index_dir)
+        build_s = time.perf_counter() - start
+        results["index_build"] = {
+            "seconds": round(build_s, 3),
+            "size_bytes": sum(os.path.getsize(os.path.join(index_dir, f)) for f in os.listdir(index_dir)),
+        }
+        del vector_store
+
+        # 5. Chargement (format de recherche : mémoire mappée, lecture paresseuse)
+        start = time.perf_counter()
+        vector_store = load_store(index_dir, embeddings)
+        vector_store.lexical_index = BM25Index.load(index_dir)
+        results["index_load"] = {"seconds": round(time.perf_counter() - start, 3)}
+
+        # 6. Recherche
+        queries = DEFAULT_QUERIES
+        if args.queries:
+            with open(args.queries, 'r', encoding='utf-8') as f:
+                queries = [line.strip() for line in f if line.strip()]
+        app.retrieve_documents(vector_store, queries[0])  # échauffement
+        latencies = []
+        for _ in range(args.repeat):
+            for query in queries:
+                start = time.perf_counter()
+                app.retrieve_documents(vector_store, query)
+                latencies.append((time.perf_counter() - start) * 1000)
+        results["retrieval"] = dict(
+            {"queries": len(latencies), "hybrid": app.HYBRID_SEARCH}, **{f"{k}_ms": v for k, v in percentiles(latencies).items()}
+        )
+
+        # 7. Découpage flat / parent-enfant (optionnel)
+        if args.compare_chunking:
+            results["chunking"] = compare_chunking(app, pages, embeddings, queries, args.batch_size)
+
+        # 8. Génération via le faux serveur OpenAI (optionnel)
+        if args.with_llm:
+            server, base_url = start_stub_openai()
+            os.environ["OPENAI_BASE_URL"] = base_url
+            os.environ["OPENAI_API_KEY"] = "stub"
+            try:
+                ttfts = []
+                totals = []
+                for query in queries[:args.llm_queries]:
+                    metrics = {}
+                    docs = app.retrieve_documents(vector_store, query)
+                    for _ in app.stream_answer(query, docs, metrics=metrics):
+                        pass
+                    if metrics.get("ttft_s") is not None:
+                        ttfts.append(metrics["ttft_s"] * 1000)
+                        totals.append(metrics["total_s"] * 1000)
+                results["generation_stub"] = {
+                    "requests": len(ttfts),
+                    "ttft_ms": percentiles(ttfts),
+                    "total_ms": percentiles(totals),
+                }
+            finally:
+                server.shutdown()
+
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Banc d'essai hors ligne de l'indexation et de la recherche")
+    parser.add_argument("--data", default="data/", help="Dossier des PDFs")
+    parser.add_argument("--max-files", type=int, default=0, help="Limiter le nombre de PDFs (0 = tous)")
+    parser.add_argument("--workers", type=int, default=0, help="Processus d'extraction (0 = un par cœur)")
+    parser.add_argument("--batch-size", type=int, default=50, help="Taille des lots d'embeddings")
+    parser.add_argument("--embeddings", choices=["auto", "minilm", "hash"], default="auto")
+    parser.add_argument("--backend", choices=BACKENDS, default="torch",
+                        help="Moteur d'embeddings de MiniLM (voir embeddings.py)")
+    parser.add_argument("--queries", help="Fichier texte de questions (une par ligne)")
+    parser.add_argument("--repeat", type=int, default=5, help="Répétitions de la liste de questions")
+    parser.add_argument("--with-llm", action="store_true", help="Mesurer aussi la génération via le faux serveur OpenAI")
+    parser.add_argument("--llm-queries", type=int, default=5)
+    parser.add_argument("--compare-chunking", action="store_true",
+                        help="Comparer le découpage actuel au découpage parent-enfant")
+    parser.add_argument("--startup-only", action="store_true", help="Ne mesurer que le temps de démarrage de app.py")
+    parser.add_argument("--output", help="Fichier JSON de sortie (sinon sortie standard)")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    payload = json.dumps(results, ensure_ascii=False, indent=1)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(payload + "\n")
+    print(payload)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
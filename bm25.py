@@ -0,0 +1,157 @@
+"""
+Index lexical BM25 en mémoire, construit sur les mêmes segments que FAISS.
+
+Les listes de postings sont stockées « à plat » dans des tableaux NumPy (format
+CSR : pour le terme t, ses documents sont doc_ids[indptr[t]:indptr[t+1]] et
+leurs fréquences tfs[...]), ce qui garde l'index compact et permet de scorer
+une requête en quelques millisecondes par opérations vectorisées.
+"""
+
+import os
+import re
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+BM25_FILE = "bm25.npz"
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Mots vides français et anglais les plus fréquents (sans intérêt pour le classement)
+STOPWORDS = frozenset("""
+a au aux avec ce ces cet cette dans de des du elle en et il ils je la le les leur leurs lui mais me
+ne nous on ou par pas pour qu que qui sa se ses son sur ta te tes ton tu un une vos votre vous y
+est sont ete etre a ont avoir fait plus comme aussi si tout tous toute toutes entre dont ainsi
+the of and to in is that for on are with as by be this from or an it at which
+""".split())
+
+
+def tokenize(text):
+    """Découpe un texte en termes normalisés (minuscules, sans accents, sans mots vides)"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [t for t in _TOKEN_RE.findall(text) if len(t) > 1 and t not in STOPWORDS]
+
+
+class BM25Index:
+    """Index inversé BM25 à postings en tableaux"""
+
+    def __init__(self, vocabulary, indptr, doc_ids, tfs, doc_len, chunk_ids, k1=1.5, b=0.75):
+        self.vocabulary = vocabulary
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.chunk_ids = chunk_ids
+        self.k1 = k1
+        self.b = b
+        n_docs = len(chunk_ids)
+        self.avg_len = float(doc_len.mean()) if n_docs else 0.0
+        df = np.diff(indptr).astype(np.float32)
+        self.idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        # Partie du dénominateur BM25 qui ne dépend que du document
+        self._norm = (k1 * (1.0 - b + b * doc_len / (self.avg_len or 1.0))).astype(np.float32)
+
+    @classmethod
+    def build(cls, chunks, k1=1.5, b=0.75):
+        """Construit l'index à partir d'une liste de (chunk_id, texte)"""
+        chunk_ids = []
+        doc_len = []
+        postings = {}
+        for doc_id, (cid, text) in enumerate(chunks):
+            counts = Counter(tokenize(text))
+            chunk_ids.append(cid)
+            doc_len.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc_id, tf))
+
+        terms = sorted(postings)
+        vocabulary = {term: i for i, term in enumerate(terms)}
+        lengths = np.array([len(postings[t]) for t in terms], dtype=np.int64)
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        doc_ids = np.empty(indptr[-1], dtype=np.int32)
+        tfs = np.empty(indptr[-1], dtype=np.float32)
+        for i, term in enumerate(terms):
+            plist = postings[term]
+            doc_ids[indptr[i]:indptr[i + 1]] = [d for d, _ in plist]
+            tfs[indptr[i]:indptr[i + 1]] = [tf for _, tf in plist]
+        return cls(vocabulary, indptr, doc_ids, tfs, np.array(doc_len, dtype=np.float32), chunk_ids, k1, b)
+
+    def search(self, query, k=10, allowed=None):
+        """Retourne [(chunk_id, score)] des k segments les mieux classés
+
+        Args:
+            query: Texte de la requête
+            k: Nombre de résultats
+            allowed: Indices des segments autorisés (None = tous) ; l'index étant
+                construit dans l'ordre de FAISS, ce sont aussi les positions FAISS
+        """
+        term_ids = [self.vocabulary[t] for t in set(tokenize(query)) if t in self.vocabulary]
+        if not term_ids or not self.chunk_ids:
+            return []
+        scores = np.zeros(len(self.chunk_ids), dtype=np.float32)
+        for t in term_ids:
+            start, end = self.indptr[t], self.indptr[t + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.tfs[start:end]
+            # Chaque document n'apparaît qu'une fois par liste : l'indexation avancée suffit
+            scores[docs] += self.idf[t] * tf * (self.k1 + 1.0) / (tf + self._norm[docs])
+        if allowed is not None:
+            mask = np.zeros(len(scores), dtype=bool)
+            mask[allowed] = True
+            scores[~mask] = 0.0
+        k = min(k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.chunk_ids[i], float(scores[i])) for i in top]
+
+    def save(self, index_path):
+        """Sauvegarde l'index dans index_path/bm25.npz"""
+        terms = np.array(sorted(self.vocabulary, key=self.vocabulary.get), dtype=str)
+        tmp_path = os.path.join(index_path, BM25_FILE + ".tmp.npz")
+        np.savez(
+            tmp_path,
+            terms=terms,
+            indptr=self.indptr,
+            doc_ids=self.doc_ids,
+            tfs=self.tfs,
+            doc_len=self.doc_len,
+            chunk_ids=np.array(self.chunk_ids, dtype=str),
+            params=np.array([self.k1, self.b], dtype=np.float32),
+        )
+        os.replace(tmp_path, os.path.join(index_path, BM25_FILE))
+
+    @classmethod
+    def load(cls, index_path):
+        """Charge l'index sauvegardé, ou None s'il n'existe pas"""
+        path = os.path.join(index_path, BM25_FILE)
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            vocabulary = {term: i for i, term in enumerate(data["terms"].tolist())}
+            k1, b = data["params"].tolist()
+            return cls(
+                vocabulary, data["indptr"], data["doc_ids"], data["tfs"], data["doc_len"],
+                data["chunk_ids"].tolist(), k1, b,
+            )
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fusionne plusieurs classements d'identifiants par Reciprocal Rank Fusion
+
+    Args:
+        rankings: Listes d'identifiants, chacune triée du plus au moins pertinent
+        k: Constante d'amortissement RRF (60 dans l'article d'origine)
+
+    Returns:
+        Liste des identifiants triés par score fusionné décroissant
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, 1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda item: -scores[item])
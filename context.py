@@ -0,0 +1,282 @@
+"""
+Assemblage du contexte envoyé au modèle : fusion des segments qui se
+chevauchent, diversité par MMR et remplissage d'un budget de tokens.
+
+Le découpage utilise un chevauchement de 200 caractères : deux segments
+consécutifs d'une même page retrouvés ensemble répètent donc le même texte.
+Ils sont recollés en un seul passage avant d'être comptés.
+
+En découpage parent-enfant, les segments retrouvés sont de petits enfants :
+chacun est remplacé par son passage parent, envoyé une seule fois même si
+plusieurs de ses enfants sont retenus.
+"""
+
+import math
+
+import numpy as np
+
+# Longueur minimale (caractères) d'un chevauchement pour recoller deux segments
+MIN_OVERLAP_CHARS = 20
+
+_encodings = {}
+
+
+def _encoding(model):
+    if model not in _encodings:
+        try:
+            import tiktoken
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding("cl100k_base")
+        except ImportError:
+            _encodings[model] = None
+    return _encodings[model]
+
+
+def count_tokens(text, model="gpt-4"):
+    """Nombre de tokens du texte (tiktoken, sinon estimation à 4 caractères par token)"""
+    encoding = _encoding(model)
+    if encoding is None:
+        return math.ceil(len(text) / 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text, max_tokens, model="gpt-4"):
+    """Début du texte limité à max_tokens tokens"""
+    encoding = _encoding(model)
+    if encoding is None:
+        return text[:max(0, max_tokens) * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max(0, max_tokens)])
+
+
+def _overlap(a, b, min_overlap=MIN_OVERLAP_CHARS):
+    """Longueur du plus long début de b qui termine a (0 si inférieur à min_overlap)"""
+    for size in range(min(len(a), len(b)), min_overlap - 1, -1):
+        if a.endswith(b[:size]):
+            return size
+    return 0
+
+
+def _join(a, b, min_overlap=MIN_OVERLAP_CHARS):
+    """Texte recollé de a et b, ou None s'ils ne se chevauchent pas"""
+    if b in a:
+        return a
+    if a in b:
+        return b
+    size = _overlap(a, b, min_overlap)
+    if size:
+        return a + b[size:]
+    size = _overlap(b, a, min_overlap)
+    if size:
+        return b + a[size:]
+    return None
+
+
+def merge_overlapping(passages, min_overlap=MIN_OVERLAP_CHARS):
+    """Recolle les passages d'une même source et page dont les textes se chevauchent
+
+    Args:
+        passages: Liste de (rang, Document), dans l'ordre de préférence
+
+    Returns:
+        Liste de (rang, Document, nombre de segments recollés) ; un passage
+        recollé prend le meilleur rang de ses segments et garde leurs
+        identifiants dans metadata["chunk_ids"]
+    """
+    from langchain_core.documents import Document
+
+    merged = [(rank, doc.page_content, doc.metadata, [getattr(doc, "id", None)]) for rank, doc in passages]
+    changed = True
+    while changed:
+        changed = False
+        for i in range(len(merged)):
+            for j in range(i + 1, len(merged)):
+                rank_i, text_i, meta_i, ids_i = merged[i]
+                rank_j, text_j, meta_j, ids_j = merged[j]
+                if (meta_i.get("source"), meta_i.get("page")) != (meta_j.get("source"), meta_j.get("page")):
+                    continue
+                text = _join(text_i, text_j, min_overlap)
+                if text is not None:
+                    merged[i] = (min(rank_i, rank_j), text, meta_i, ids_i + ids_j)
+                    del merged[j]
+                    changed = True
+                    break
+            if changed:
+                break
+    return [
+        (
+            rank,
+            Document(page_content=text, metadata=dict(meta, merged_chunks=len(ids), chunk_ids=[i for i in ids if i]))
+            if len(ids) > 1 else Document(id=ids[0], page_content=text, metadata=meta),
+            len(ids),
+        )
+        for rank, text, meta, ids in merged
+    ]
+
+
+def expand_to_parents(passages, parents):
+    """Remplace chaque segment enfant par son passage parent, une seule fois par parent
+
+    Args:
+        passages: Liste de (rang, Document), dans l'ordre de préférence
+        parents: Dict {identifiant parent: Document parent}
+
+    Returns:
+        Liste de (rang, Document) ; un parent prend le rang de son meilleur enfant
+        et cite les doublons fusionnés de tous ses enfants (metadata["also_in"]).
+        Les segments sans parent connu sont gardés tels quels.
+    """
+    from langchain_core.documents import Document
+
+    expanded = []
+    position = {}
+    for rank, doc in passages:
+        parent_id = doc.metadata.get("parent_id")
+        parent = parents.get(parent_id)
+        if parent is None:
+            expanded.append((rank, doc))
+            continue
+        if parent_id not in position:
+            position[parent_id] = len(expanded)
+            metadata = dict(parent.metadata)
+            if "also_in" in metadata:
+                # Liste copiée : le parent de la docstore n'est jamais modifié
+                metadata["also_in"] = list(metadata["also_in"])
+            expanded.append((rank, Document(id=parent_id, page_content=parent.page_content, metadata=metadata)))
+        metadata = expanded[position[parent_id]][1].metadata
+        for cited in doc.metadata.get("also_in", ()):
+            if cited not in metadata.setdefault("also_in", []):
+                metadata["also_in"].append(cited)
+    return expanded
+
+
+def mmr_order(query_vector, doc_vectors, lambda_mult=0.7):
+    """Ordonne les segments par pertinence marginale maximale (MMR)
+
+    Chaque étape retient le segment qui maximise
+    lambda · sim(question, segment) - (1 - lambda) · max sim(segment, déjà retenus).
+
+    Returns:
+        (ordre des indices, similarité maximale de chaque segment avec ceux retenus avant lui)
+    """
+    query = np.asarray(query_vector, dtype=np.float32)
+    vectors = np.asarray(doc_vectors, dtype=np.float32)
+    query = query / (np.linalg.norm(query) or 1.0)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    relevance = vectors @ query
+    pairwise = vectors @ vectors.T
+
+    order = []
+    redundancy = np.full(len(vectors), -np.inf, dtype=np.float32)
+    max_sim = {}
+    remaining = list(range(len(vectors)))
+    while remaining:
+        penalty = np.where(np.isinf(redundancy[remaining]), 0.0, redundancy[remaining])
+        scores = lambda_mult * relevance[remaining] - (1 - lambda_mult) * penalty
+        best = remaining.pop(int(np.argmax(scores)))
+        max_sim[best] = float(redundancy[best]) if order else None
+        order.append(best)
+        redundancy = np.maximum(redundancy, pairwise[best])
+    return order, max_sim
+
+
+def pack_context(docs, query_vector, doc_vectors, token_budget, lambda_mult=0.7,
+                 duplicate_threshold=0.97, model="gpt-4", parents=None, max_passages=None):
+    """Choisit les passages à envoyer au modèle dans la limite du budget de tokens
+
+    Args:
+        docs: Segments récupérés (Documents), du plus au moins pertinent
+        query_vector: Vecteur de la question
+        doc_vectors: Vecteurs des segments (même ordre que docs)
+        token_budget: Nombre maximal de tokens de texte de contexte
+        lambda_mult: Compromis pertinence / diversité de la MMR (1 = pertinence seule)
+        duplicate_threshold: Similarité au-delà de laquelle un segment est un doublon
+        model: Modèle dont le tokenizer sert au comptage
+        parents: Passages parents {identifiant: Document} en découpage parent-enfant :
+            MMR et doublons portent sur les segments, le budget sur leurs parents
+        max_passages: Nombre maximal de passages envoyés (None = budget de tokens seul)
+
+    Returns:
+        (passages retenus, rapport {tokens avant / après / économisés, ...})
+    """
+    # Sans assemblage, chaque segment enverrait son propre parent
+    sent = docs if parents is None else [parents.get(d.metadata.get("parent_id"), d) for d in docs]
+    report = {"chunks_in": len(docs), "tokens_before": sum(count_tokens(d.page_content, model) for d in sent)}
+    if not docs:
+        return [], dict(
+            report, passages=0, merged=0, duplicates=0, over_budget=0, truncated=0, tokens_after=0, tokens_saved=0
+        )
+
+    from dedup import add_citation, citations
+    from langchain_core.documents import Document
+
+    order, max_sim = mmr_order(query_vector, doc_vectors, lambda_mult)
+    vectors = np.asarray(doc_vectors, dtype=np.float32)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    kept = []
+    # Citations des quasi-doublons écartés, reportées sur le segment retenu le plus proche
+    cited = {}
+    duplicates = 0
+    for rank, i in enumerate(order):
+        # Quasi-doublon d'un segment déjà retenu (même passage dans deux PDFs, par exemple)
+        same_page = any(
+            (docs[i].metadata.get("source"), docs[i].metadata.get("page"))
+            == (docs[j].metadata.get("source"), docs[j].metadata.get("page"))
+            for _, j in kept
+        )
+        if max_sim[i] is not None and max_sim[i] >= duplicate_threshold and not same_page:
+            duplicates += 1
+            closest = max((j for _, j in kept), key=lambda j: float(vectors[i] @ vectors[j]), default=None)
+            if closest is not None:
+                cited.setdefault(closest, []).extend(citations(docs[i]))
+            continue
+        kept.append((rank, i))
+
+    passages = []
+    for rank, i in kept:
+        doc = docs[i]
+        if i in cited:
+            # Copie : le Document d'origine peut être partagé (docstore en mémoire)
+            doc = Document(
+                id=getattr(doc, "id", None), page_content=doc.page_content,
+                metadata=dict(doc.metadata, also_in=list(doc.metadata.get("also_in", ()))),
+            )
+            for citation in cited[i]:
+                add_citation(doc, citation)
+        passages.append((rank, doc))
+    if parents is not None:
+        passages = expand_to_parents(passages, parents)
+    passages = merge_overlapping(passages)
+    passages.sort(key=lambda p: p[0])
+
+    packed = []
+    used = 0
+    over_budget = 0
+    truncated = 0
+    for _, doc, _ in passages:
+        tokens = count_tokens(doc.page_content, model)
+        full = max_passages is not None and len(packed) >= max_passages
+        if packed and (used + tokens > token_budget or full):
+            over_budget += 1
+            continue
+        if not packed and tokens > token_budget:
+            # Premier passage plus long que tout le budget : seul son début est envoyé
+            text = truncate_tokens(doc.page_content, token_budget, model)
+            doc = Document(id=getattr(doc, "id", None), page_content=text, metadata=dict(doc.metadata, truncated=True))
+            tokens = count_tokens(text, model)
+            truncated += 1
+        packed.append(doc)
+        used += tokens
+
+    report.update(
+        passages=len(packed),
+        merged=len(kept) - len(passages),
+        duplicates=duplicates,
+        over_budget=over_budget,
+        truncated=truncated,
+        tokens_after=used,
+        tokens_saved=report["tokens_before"] - used,
+    )
+    return packed, report
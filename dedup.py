@@ -0,0 +1,338 @@
+"""
+Dédoublonnage à l'indexation : fichiers identiques et segments quasi identiques.
+
+- Fichiers : les PDFs de même contenu (SHA-256 du manifeste), par exemple
+  « article (1).pdf » ou les copies « .crdownload » d'un téléchargement relancé,
+  ne sont extraits et vectorisés qu'une fois ; les copies sont inscrites au
+  manifeste avec duplicate_of.
+- Segments : chaque segment reçoit une signature MinHash (128 permutations sur
+  ses 5-grammes de mots). Un index LSH (16 bandes de 8 valeurs) propose des
+  candidats, retenus si la similarité de Jaccard estimée atteint le seuil : le
+  segment déjà indexé est conservé, le nouveau n'est pas vectorisé.
+
+Aucune citation n'est perdue : le segment conservé garde dans
+metadata["also_in"] la liste des (source, page) de ses doublons.
+
+Fichier du dossier d'index :
+    minhash.npz   signatures MinHash des segments indexés (et leur source)
+"""
+
+import os
+import re
+import zlib
+
+import numpy as np
+
+MINHASH_FILE = "minhash.npz"
+
+# Nombre premier de Mersenne 2^31 - 1 : a * x + b tient dans un entier 64 bits
+_PRIME = (1 << 31) - 1
+_SEED = 1
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Marques de copie dans un nom de fichier : « (1) », « .crdownload », « - Copie »
+_COPY_RE = re.compile(r"\s\(\d+\)|\.crdownload|\s-\s(copie|copy)\b", re.IGNORECASE)
+
+
+def duplicate_files(fingerprints, preferred=()):
+    """Regroupe les fichiers de même contenu et désigne l'original de chaque groupe
+
+    L'original est de préférence un fichier déjà indexé (preferred), sinon le
+    nom sans marque de copie le plus court.
+
+    Args:
+        fingerprints: Dict {nom: {sha256, ...}} (manifest.fingerprint_files)
+        preferred: Noms à garder comme originaux si possible
+
+    Returns:
+        Dict {copie: original}
+    """
+    groups = {}
+    for name, fingerprint in fingerprints.items():
+        groups.setdefault(fingerprint["sha256"], []).append(name)
+    duplicates = {}
+    for names in groups.values():
+        if len(names) < 2:
+            continue
+        original = min(names, key=lambda n: (n not in preferred, bool(_COPY_RE.search(n)), len(n), n))
+        for name in names:
+            if name != original:
+                duplicates[name] = original
+    return duplicates
+
+
+def indexed_copies(manifest):
+    """Copies identiques enregistrées dans le manifeste : dict {copie: original}"""
+    files = (manifest or {}).get("files", {})
+    return {name: entry["duplicate_of"] for name, entry in files.items() if entry.get("duplicate_of")}
+
+
+def files_to_requeue(previous, unchanged, duplicates, changed):
+    """Fichiers inchangés qui doivent pourtant être retraités
+
+    Un fichier est retraité si son statut de copie change (son original a été
+    supprimé, par exemple) ou si certains de ses segments avaient été fusionnés
+    avec ceux d'un fichier supprimé, modifié ou lui-même retraité.
+
+    Args:
+        previous: Fichiers du manifeste précédent
+        unchanged: Noms des fichiers inchangés
+        duplicates: Dict {copie: original} actuel
+        changed: Noms des fichiers ajoutés, modifiés ou supprimés
+
+    Returns:
+        Liste triée des fichiers à retraiter
+    """
+    requeue = {name for name in unchanged if previous[name].get("duplicate_of") != duplicates.get(name)}
+    affected = set(changed) | requeue
+    grown = True
+    while grown:
+        grown = False
+        for name in unchanged:
+            if name in requeue:
+                continue
+            entry = previous[name]
+            sources = set(entry.get("dedup_sources", ()))
+            if entry.get("duplicate_of"):
+                sources.add(entry["duplicate_of"])
+            if sources & affected:
+                requeue.add(name)
+                affected.add(name)
+                grown = True
+    return sorted(requeue)
+
+
+def citation(doc):
+    """(source, page) d'un segment, au format de metadata["also_in"]"""
+    return {"source": doc.metadata.get("source", "Inconnu"), "page": doc.metadata.get("page", "N/A")}
+
+
+def citations(doc):
+    """Toutes les (source, page) d'un segment : la sienne puis celles de ses doublons"""
+    return [citation(doc)] + list(doc.metadata.get("also_in", ()))
+
+
+def add_citation(doc, cited):
+    """Ajoute une (source, page) aux citations du segment si elle n'y est pas déjà"""
+    if cited == citation(doc):
+        return False
+    also_in = doc.metadata.setdefault("also_in", [])
+    if cited in also_in:
+        return False
+    also_in.append(cited)
+    return True
+
+
+def strip_citations(docs, sources):
+    """Retire des segments les citations des fichiers donnés (supprimés ou à retraiter)
+
+    Returns:
+        Nombre de citations retirées
+    """
+    sources = set(sources)
+    removed = 0
+    for doc in docs:
+        also_in = doc.metadata.get("also_in")
+        if not also_in:
+            continue
+        kept = [c for c in also_in if c["source"] not in sources]
+        removed += len(also_in) - len(kept)
+        if kept:
+            doc.metadata["also_in"] = kept
+        else:
+            del doc.metadata["also_in"]
+    return removed
+
+
+def add_copy_citations(docs, duplicates):
+    """Cite chaque copie d'un fichier aux mêmes pages que son original
+
+    Idempotent : peut être appliqué à tout l'index à chaque indexation.
+    """
+    copies = {}
+    for name, original in duplicates.items():
+        copies.setdefault(original, []).append(name)
+    added = 0
+    for doc in docs:
+        for cited in citations(doc):
+            for name in copies.get(cited["source"], ()):
+                added += add_citation(doc, {"source": name, "page": cited["page"]})
+    return added
+
+
+def apply_citations(docstore, pending):
+    """Reporte les citations en attente sur les segments canoniques déjà dans le docstore
+
+    Args:
+        docstore: Docstore du vector store en cours de construction
+        pending: Dict {identifiant canonique: [citations]}, vidé au fur et à mesure
+    """
+    for cid in list(pending):
+        doc = docstore.search(cid)
+        if isinstance(doc, str):
+            continue  # Segment canonique pas encore ajouté (lot en cours)
+        for cited in pending.pop(cid):
+            add_citation(doc, cited)
+
+
+class MinHasher:
+    """Signatures MinHash des 5-grammes de mots d'un texte"""
+
+    def __init__(self, num_perm=128, shingle_size=5, seed=_SEED):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, _PRIME, size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, _PRIME, size=num_perm).astype(np.uint64)
+
+    def signature(self, text):
+        """Signature (uint32, num_perm valeurs) du texte, ou None s'il ne contient aucun mot"""
+        words = _WORD_RE.findall(text.lower())
+        if not words:
+            return None
+        n = self.shingle_size
+        shingles = {" ".join(words[i:i + n]) for i in range(max(1, len(words) - n + 1))}
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode('utf-8')) for s in shingles), dtype=np.uint64, count=len(shingles)
+        ) % _PRIME
+        return ((np.outer(self._a, hashes) + self._b[:, None]) % _PRIME).min(axis=1).astype(np.uint32)
+
+
+class ChunkDeduplicator:
+    """Index LSH des signatures MinHash des segments indexés"""
+
+    def __init__(self, threshold=0.85, num_perm=128, bands=16, shingle_size=5):
+        if num_perm % bands:
+            raise ValueError("num_perm doit être un multiple de bands")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm, shingle_size)
+        # Multiplicateurs impairs pour réduire chaque bande à un entier
+        self._mix = np.random.RandomState(_SEED + 1).randint(1, 1 << 31, size=self.rows).astype(np.uint64) * 2 + 1
+        self.ids = []
+        self.sources = []
+        self.signatures = []
+        self._positions = {}
+        self._buckets = [{} for _ in range(bands)]
+
+    def __len__(self):
+        return len(self._positions)
+
+    def _band_keys(self, signature):
+        bands = signature.reshape(self.bands, self.rows).astype(np.uint64)
+        return (bands * self._mix).sum(axis=1).tolist()
+
+    def add(self, cid, source, signature):
+        """Inscrit la signature d'un segment indexé"""
+        if signature is None or cid in self._positions:
+            return
+        pos = len(self.ids)
+        self.ids.append(cid)
+        self.sources.append(source)
+        self.signatures.append(signature)
+        self._positions[cid] = pos
+        for bucket, key in zip(self._buckets, self._band_keys(signature)):
+            bucket.setdefault(key, []).append(pos)
+
+    def find(self, signature):
+        """Identifiant du segment indexé le plus semblable au-delà du seuil, ou None"""
+        candidates = set()
+        for bucket, key in zip(self._buckets, self._band_keys(signature)):
+            candidates.update(bucket.get(key, ()))
+        best, best_similarity = None, self.threshold
+        for pos in candidates:
+            if self.ids[pos] is None:
+                continue
+            similarity = float(np.count_nonzero(self.signatures[pos] == signature)) / signature.size
+            if similarity >= best_similarity:
+                best, best_similarity = self.ids[pos], similarity
+        return best
+
+    def source(self, cid):
+        """Fichier d'origine d'un segment indexé"""
+        pos = self._positions.get(cid)
+        return None if pos is None else self.sources[pos]
+
+    def check(self, cid, doc):
+        """Retourne l'identifiant du segment canonique si doc est un quasi-doublon,
+        sinon inscrit doc comme nouveau segment et retourne None"""
+        signature = self.hasher.signature(doc.page_content)
+        if signature is None:
+            return None
+        canonical = self.find(signature)
+        if canonical is None:
+            self.add(cid, doc.metadata.get("source"), signature)
+        return canonical
+
+    def filter(self, chunks, on_duplicate):
+        """Ne laisse passer que les segments qui ne sont pas des quasi-doublons
+
+        Args:
+            chunks: Itérable de (Document, identifiant), comme ingest.iter_chunks
+            on_duplicate: Callback (Document, identifiant, identifiant canonique)
+                appelé pour chaque segment écarté
+
+        Yields:
+            (Document, identifiant) des segments à vectoriser
+        """
+        for doc, cid in chunks:
+            canonical = self.check(cid, doc)
+            if canonical is None:
+                yield doc, cid
+            else:
+                on_duplicate(doc, cid, canonical)
+
+    def remove(self, cids):
+        """Retire des segments de l'index (les compartiments LSH sont filtrés à la lecture)"""
+        for cid in cids:
+            pos = self._positions.pop(cid, None)
+            if pos is not None:
+                self.ids[pos] = None
+                self.signatures[pos] = None
+
+    def retain(self, cids):
+        """Ne garde que les segments donnés (ceux réellement présents dans l'index)"""
+        cids = set(cids)
+        self.remove([cid for cid in self._positions if cid not in cids])
+
+    @classmethod
+    def build(cls, documents, **params):
+        """Construit l'index à partir de (identifiant, Document) déjà indexés, sans dédoublonner"""
+        dedup = cls(**params)
+        for cid, doc in documents:
+            dedup.add(cid, doc.metadata.get("source"), dedup.hasher.signature(doc.page_content))
+        return dedup
+
+    def save(self, index_path):
+        """Sauvegarde les signatures dans index_path/minhash.npz"""
+        live = list(self._positions.values())
+        signatures = (
+            np.stack([self.signatures[pos] for pos in live])
+            if live else np.zeros((0, self.bands * self.rows), dtype=np.uint32)
+        )
+        os.makedirs(index_path, exist_ok=True)
+        tmp_path = os.path.join(index_path, MINHASH_FILE + ".tmp.npz")
+        np.savez(
+            tmp_path,
+            ids=np.array([self.ids[pos] for pos in live], dtype=str),
+            sources=np.array([self.sources[pos] or "" for pos in live], dtype=str),
+            signatures=signatures,
+            params=np.array([self.bands * self.rows, self.bands, self.hasher.shingle_size], dtype=np.int64),
+        )
+        os.replace(tmp_path, os.path.join(index_path, MINHASH_FILE))
+
+    @classmethod
+    def load(cls, index_path, threshold=0.85, num_perm=128, bands=16, shingle_size=5):
+        """Charge les signatures sauvegardées, ou None si absentes ou calculées autrement"""
+        path = os.path.join(index_path, MINHASH_FILE)
+        if not os.path.exists(path):
+            return None
+        dedup = cls(threshold, num_perm, bands, shingle_size)
+        with np.load(path, allow_pickle=False) as data:
+            if data["params"].tolist() != [num_perm, bands, shingle_size]:
+                return None
+            for cid, source, signature in zip(data["ids"].tolist(), data["sources"].tolist(), data["signatures"]):
+                dedup.add(cid, source or None, signature)
+        return dedup
@@ -0,0 +1,202 @@
+"""
+Stockage de l'index sans pickle : vecteurs FAISS en mémoire mappée et segments
+(texte + métadonnées) dans une base SQLite lue à la demande.
+
+Au chargement, seuls la correspondance position FAISS -> identifiant de segment
+et les vecteurs (mappés, donc paginés par l'OS) sont en mémoire ; le texte d'un
+segment n'est lu que lorsqu'il fait partie des résultats d'une recherche.
+
+Fichiers du dossier d'index :
+    index.faiss       vecteurs FAISS
+    docstore.sqlite   segments (id, texte, métadonnées JSON) et positions FAISS
+"""
+
+import json
+import os
+import sqlite3
+import threading
+
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+
+DOCSTORE_FILE = "docstore.sqlite"
+INDEX_FILE = "index.faiss"
+LEGACY_DOCSTORE_FILE = "index.pkl"
+
+
+class SqliteDocstore(Docstore, AddableMixin):
+    """Docstore LangChain adossée à SQLite, en lecture paresseuse"""
+
+    def __init__(self, path, read_only=True):
+        self.path = path
+        self.read_only = read_only
+        self._local = threading.local()
+
+    def _connection(self):
+        # Une connexion par thread : les sessions Streamlit lisent en parallèle
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self.read_only:
+                uri = "file:" + os.path.abspath(self.path).replace("\\", "/") + "?mode=ro"
+                conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            else:
+                conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    def search(self, search):
+        row = self._connection().execute(
+            "SELECT content, metadata FROM chunks WHERE id = ?", (search,)
+        ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(id=search, page_content=row[0], metadata=json.loads(row[1]))
+
+    def mget(self, ids):
+        """Lit plusieurs segments en une requête (None pour les identifiants inconnus)"""
+        ids = list(ids)
+        found = {}
+        conn = self._connection()
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            for cid, content, metadata in conn.execute(
+                f"SELECT id, content, metadata FROM chunks WHERE id IN ({placeholders})", batch
+            ):
+                found[cid] = Document(id=cid, page_content=content, metadata=json.loads(metadata))
+        return [found.get(cid) for cid in ids]
+
+    def add(self, texts):
+        if self.read_only:
+            raise ValueError("Docstore ouverte en lecture seule")
+        conn = self._connection()
+        conn.executemany(
+            "INSERT OR REPLACE INTO chunks (id, content, metadata) VALUES (?, ?, ?)",
+            [(cid, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False)) for cid, doc in texts.items()],
+        )
+        conn.commit()
+
+    def delete(self, ids):
+        if self.read_only:
+            raise ValueError("Docstore ouverte en lecture seule")
+        conn = self._connection()
+        conn.executemany("DELETE FROM chunks WHERE id = ?", [(cid,) for cid in ids])
+        conn.commit()
+
+    def iter_documents(self):
+        """Parcourt tous les segments (id, Document) sans les charger tous en mémoire"""
+        cursor = self._connection().execute("SELECT id, content, metadata FROM chunks")
+        for cid, content, metadata in cursor:
+            yield cid, Document(id=cid, page_content=content, metadata=json.loads(metadata))
+
+    def positions(self):
+        """Correspondance position FAISS -> identifiant de segment"""
+        rows = self._connection().execute("SELECT pos, id FROM positions ORDER BY pos")
+        return {pos: cid for pos, cid in rows}
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def _create_schema(conn):
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, content TEXT NOT NULL, metadata TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS positions (pos INTEGER PRIMARY KEY, id TEXT NOT NULL);
+    """)
+
+
+def write_docstore(path, documents, index_to_docstore_id):
+    """Écrit une base SQLite complète (segments + positions) de manière atomique
+
+    Args:
+        path: Chemin de docstore.sqlite
+        documents: Itérable de (id, Document)
+        index_to_docstore_id: Dict position FAISS -> identifiant
+    """
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        _create_schema(conn)
+        conn.executemany(
+            "INSERT OR REPLACE INTO chunks (id, content, metadata) VALUES (?, ?, ?)",
+            ((cid, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False)) for cid, doc in documents),
+        )
+        conn.executemany("INSERT INTO positions (pos, id) VALUES (?, ?)", index_to_docstore_id.items())
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, path)
+
+
+def _all_documents(vector_store):
+    docstore = vector_store.docstore
+    if isinstance(docstore, SqliteDocstore):
+        return docstore.iter_documents()
+    if hasattr(docstore, "_dict"):
+        # InMemoryDocstore : tous les documents, y compris ceux hors de l'index FAISS (passages parents)
+        return iter(list(docstore._dict.items()))
+    return ((cid, docstore.search(cid)) for cid in vector_store.index_to_docstore_id.values())
+
+
+def save_store(vector_store, index_path):
+    """Sauvegarde un vector store FAISS LangChain au format sans pickle"""
+    import faiss
+
+    os.makedirs(index_path, exist_ok=True)
+    tmp_index = os.path.join(index_path, INDEX_FILE + ".tmp")
+    faiss.write_index(vector_store.index, tmp_index)
+    write_docstore(
+        os.path.join(index_path, DOCSTORE_FILE),
+        _all_documents(vector_store),
+        vector_store.index_to_docstore_id,
+    )
+    os.replace(tmp_index, os.path.join(index_path, INDEX_FILE))
+    # Ancien format (pickle) devenu inutile
+    legacy = os.path.join(index_path, LEGACY_DOCSTORE_FILE)
+    if os.path.exists(legacy):
+        os.remove(legacy)
+
+
+def read_faiss_index(path, mmap=True):
+    """Lit un index FAISS, en mémoire mappée si possible"""
+    import faiss
+
+    if mmap:
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+        try:
+            return faiss.read_index(path, flags)
+        except RuntimeError:
+            pass  # Type d'index non mappable : lecture classique
+    return faiss.read_index(path)
+
+
+def has_store(index_path):
+    """Indique si index_path contient un index au format sans pickle"""
+    return os.path.exists(os.path.join(index_path, DOCSTORE_FILE)) and os.path.exists(os.path.join(index_path, INDEX_FILE))
+
+
+def load_store(index_path, embeddings, writable=False):
+    """Charge un vector store FAISS LangChain au format sans pickle
+
+    Args:
+        index_path: Dossier de l'index
+        embeddings: Modèle d'embeddings pour les requêtes
+        writable: False (lecture) : vecteurs mappés et texte lu à la demande ;
+            True (réindexation) : vecteurs et segments chargés en mémoire pour être modifiés
+    """
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+
+    docstore = SqliteDocstore(os.path.join(index_path, DOCSTORE_FILE))
+    index_to_docstore_id = docstore.positions()
+    index = read_faiss_index(os.path.join(index_path, INDEX_FILE), mmap=not writable)
+    if writable:
+        in_memory = InMemoryDocstore(dict(docstore.iter_documents()))
+        docstore.close()
+        docstore = in_memory
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
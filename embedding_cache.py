@@ -0,0 +1,270 @@
+"""
+Cache persistant des embeddings, adressé par le contenu des segments.
+
+Chaque vecteur est identifié par (modèle, normalisation, hash SHA-256 du texte).
+Les vecteurs float32 sont stockés dans un fichier binaire à lignes de taille
+fixe (lu en mémoire mappée via NumPy) et un index SQLite associe chaque clé à
+sa ligne. Au-delà de la taille maximale, les entrées les moins récemment
+utilisées sont évincées et leurs lignes réutilisées ; si la taille maximale
+diminue, le fichier est compacté puis tronqué à l'ouverture du cache.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Nombre maximal de paramètres dans une requête SQLite "IN (...)"
+_SQL_BATCH = 500
+
+
+def text_key(text):
+    """Clé de cache d'un texte (hash SHA-256 de son contenu)"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """Stockage clé -> vecteur float32 sur disque avec éviction LRU par taille
+
+    Le cache peut être partagé par plusieurs processus (application, scripts en
+    ligne de commande) : toute lecture ou écriture du fichier de vecteurs se fait
+    dans une transaction SQLite BEGIN IMMEDIATE, qui attribue les lignes et
+    sérialise les accès entre processus.
+    """
+
+    def __init__(self, cache_dir, model_name, normalize, max_bytes=512 * 1024 * 1024):
+        # Un espace de noms par (modèle, normalisation) : dimension fixe dans chaque fichier
+        namespace = hashlib.sha256(f"{model_name}\x00{bool(normalize)}".encode('utf-8')).hexdigest()[:16]
+        self.path = os.path.join(cache_dir, namespace)
+        os.makedirs(self.path, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._blob_path = os.path.join(self.path, "vectors.f32")
+        self._mmap = None
+
+        # Transactions explicites (isolation_level=None) ; attente du verrou d'un autre processus
+        self._db = sqlite3.connect(
+            os.path.join(self.path, "index.sqlite"), check_same_thread=False, isolation_level=None, timeout=60
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, slot INTEGER NOT NULL, last_used REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+            CREATE TABLE IF NOT EXISTS free_slots (slot INTEGER PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+        """)
+        with self._lock, self._transaction():
+            self._db.executemany(
+                "INSERT OR IGNORE INTO meta (name, value) VALUES (?, ?)",
+                [("model_name", model_name), ("normalize", str(bool(normalize)))],
+            )
+            self.dim = self._meta_int("dim")
+            if self.dim is not None and self._slot_count() * self._row_bytes > self.max_bytes:
+                # Taille maximale réduite depuis la dernière exécution : le fichier est rétréci
+                self._evict(max(1, self.max_bytes // self._row_bytes))
+                self._compact()
+
+    @property
+    def _row_bytes(self):
+        return self.dim * 4
+
+    @contextmanager
+    def _transaction(self):
+        # Verrou d'écriture SQLite : un seul processus à la fois lit ou modifie le fichier de vecteurs
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def _meta_int(self, name):
+        row = self._db.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return int(row[0]) if row else None
+
+    def _slot_count(self):
+        if self.dim is None or not os.path.exists(self._blob_path):
+            return 0
+        return os.path.getsize(self._blob_path) // self._row_bytes
+
+    def _next_slot(self):
+        # Première ligne jamais attribuée (taille du fichier pour un cache d'une version antérieure)
+        next_slot = self._meta_int("next_slot")
+        return self._slot_count() if next_slot is None else next_slot
+
+    def _vectors(self, min_slots):
+        # Mémoire mappée en lecture seule, recréée quand le fichier a grandi
+        if self._mmap is None or self._mmap.shape[0] < min_slots:
+            count = self._slot_count()
+            self._mmap = np.memmap(self._blob_path, dtype=np.float32, mode='r', shape=(count, self.dim)) if count else None
+        return self._mmap
+
+    def get_many(self, texts):
+        """Retourne la liste des vecteurs en cache (None pour les absents)"""
+        keys = [text_key(t) for t in texts]
+        found = {}
+        results = [None] * len(keys)
+        with self._lock, self._transaction():
+            if self.dim is None:
+                self.dim = self._meta_int("dim")
+            if self.dim is not None:
+                unique_keys = list(dict.fromkeys(keys))
+                for i in range(0, len(unique_keys), _SQL_BATCH):
+                    batch = unique_keys[i:i + _SQL_BATCH]
+                    placeholders = ",".join("?" * len(batch))
+                    found.update(self._db.execute(
+                        f"SELECT key, slot FROM entries WHERE key IN ({placeholders})", batch
+                    ).fetchall())
+            if found:
+                # Lu dans la transaction : aucune ligne ne peut être réattribuée entre-temps
+                vectors = self._vectors(max(found.values()) + 1)
+                for i, key in enumerate(keys):
+                    if key in found:
+                        results[i] = np.array(vectors[found[key]])
+                now = time.time()
+                self._db.executemany("UPDATE entries SET last_used = ? WHERE key = ?", [(now, k) for k in found])
+            hit_count = sum(1 for r in results if r is not None)
+            self.hits += hit_count
+            self.misses += len(keys) - hit_count
+        return results
+
+    def put_many(self, texts, vectors):
+        """Ajoute des vecteurs au cache (les clés déjà présentes sont ignorées)"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(texts) == 0:
+            return
+        with self._lock, self._transaction():
+            if self.dim is None:
+                self.dim = self._meta_int("dim")
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                self._db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('dim', ?)", (str(self.dim),))
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Dimension {vectors.shape[1]} incompatible avec le cache ({self.dim})")
+
+            new = {}
+            for text, vector in zip(texts, vectors):
+                new.setdefault(text_key(text), vector)
+            keys = list(new)
+            existing = set()
+            for i in range(0, len(keys), _SQL_BATCH):
+                batch = keys[i:i + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                existing.update(k for (k,) in self._db.execute(
+                    f"SELECT key FROM entries WHERE key IN ({placeholders})", batch
+                ))
+            keys = [k for k in keys if k not in existing]
+            capacity = max(1, self.max_bytes // self._row_bytes)
+            keys = keys[:capacity]
+            if not keys:
+                return
+            self._evict(capacity - len(keys))
+
+            # Lignes attribuées dans la transaction : jamais la même à deux processus
+            free = [s for (s,) in self._db.execute("SELECT slot FROM free_slots ORDER BY slot LIMIT ?", (len(keys),))]
+            self._db.executemany("DELETE FROM free_slots WHERE slot = ?", [(s,) for s in free])
+            next_slot = self._next_slot()
+            slots = free + list(range(next_slot, next_slot + len(keys) - len(free)))
+            self._db.execute(
+                "INSERT OR REPLACE INTO meta (name, value) VALUES ('next_slot', ?)",
+                (str(max(next_slot, slots[-1] + 1)),),
+            )
+
+            with open(self._blob_path, 'r+b' if os.path.exists(self._blob_path) else 'w+b') as f:
+                for key, slot in zip(keys, slots):
+                    f.seek(slot * self._row_bytes)
+                    f.write(new[key].tobytes())
+            now = time.time()
+            self._db.executemany(
+                "INSERT INTO entries (key, slot, last_used) VALUES (?, ?, ?)",
+                [(key, slot, now) for key, slot in zip(keys, slots)],
+            )
+            self._mmap = None
+
+    def _evict(self, keep):
+        # Appelé dans une transaction : ne garde que les `keep` entrées les plus récemment utilisées
+        count = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        if count <= keep:
+            return
+        victims = self._db.execute(
+            "SELECT key, slot FROM entries ORDER BY last_used LIMIT ?", (count - keep,)
+        ).fetchall()
+        self._db.executemany("DELETE FROM entries WHERE key = ?", [(k,) for k, _ in victims])
+        self._db.executemany("INSERT OR IGNORE INTO free_slots (slot) VALUES (?)", [(s,) for _, s in victims])
+
+    def _compact(self):
+        # Appelé dans une transaction : déplace les dernières lignes dans les lignes libres,
+        # puis tronque le fichier au nombre d'entrées
+        count = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        moves = self._db.execute(
+            "SELECT key, slot FROM entries WHERE slot >= ? ORDER BY slot", (count,)
+        ).fetchall()
+        holes = [s for (s,) in self._db.execute(
+            "SELECT slot FROM free_slots WHERE slot < ? ORDER BY slot LIMIT ?", (count, len(moves))
+        )]
+        if moves:
+            with open(self._blob_path, 'r+b') as f:
+                for (key, slot), hole in zip(moves, holes):
+                    f.seek(slot * self._row_bytes)
+                    row = f.read(self._row_bytes)
+                    f.seek(hole * self._row_bytes)
+                    f.write(row)
+            self._db.executemany("UPDATE entries SET slot = ? WHERE key = ?", [(h, k) for (k, _), h in zip(moves, holes)])
+        self._db.execute("DELETE FROM free_slots")
+        self._db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('next_slot', ?)", (str(count),))
+        if os.path.exists(self._blob_path):
+            os.truncate(self._blob_path, count * self._row_bytes)
+        self._mmap = None
+
+    def compact(self):
+        """Rétrécit le fichier de vecteurs aux seules entrées présentes (lignes libérées récupérées)"""
+        with self._lock, self._transaction():
+            if self.dim is not None:
+                self._compact()
+
+    def stats(self):
+        """Statistiques du cache : entrées, taille sur disque, taux de succès"""
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "bytes": os.path.getsize(self._blob_path) if os.path.exists(self._blob_path) else 0,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """Enveloppe un modèle d'embeddings LangChain avec le cache persistant"""
+
+    def __init__(self, embeddings, cache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts):
+        cached = self.cache.get_many(texts)
+        missing = list(dict.fromkeys(t for t, v in zip(texts, cached) if v is None))
+        if missing:
+            computed = self.embeddings.embed_documents(missing)
+            self.cache.put_many(missing, computed)
+            by_text = dict(zip(missing, computed))
+            cached = [v if v is not None else by_text[t] for t, v in zip(texts, cached)]
+        return [v.tolist() if isinstance(v, np.ndarray) else v for v in cached]
+
+    def embed_query(self, text):
+        cached = self.cache.get_many([text])[0]
+        if cached is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.put_many([text], [vector])
+            return vector
+        return cached.tolist()
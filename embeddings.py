@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Moteurs d'embeddings interchangeables pour le même modèle Sentence Transformers.
+
+    torch        HuggingFaceEmbeddings (PyTorch float32) : la référence
+    torch-int8   même modèle, couches linéaires quantifiées en int8 (quantification dynamique PyTorch)
+    onnx         modèle exporté en ONNX, exécuté par ONNX Runtime (ni PyTorch ni transformers à l'exécution)
+    onnx-int8    export ONNX quantifié en int8 (onnxruntime.quantization)
+
+Les moteurs autres que torch tokenisent tous les textes, les trient par nombre
+de tokens et forment des lots de longueurs voisines : le remplissage (padding)
+est minimal. Le pooling (moyenne ou CLS) et la longueur maximale sont ceux de
+la configuration Sentence Transformers du modèle.
+
+L'export ONNX est fait une seule fois (PyTorch requis à ce moment-là) et
+conservé dans le dossier des modèles.
+
+Seul torch est validé, et c'est le seul moteur utilisé par l'application. Le
+gain de débit et l'accord avec la référence des autres moteurs n'ont pas été
+mesurés sur ce projet : ils ne servent qu'au rapport ci-dessous et au banc
+d'essai (bench.py --backend).
+
+Rapport d'accord avec la référence PyTorch et de débit :
+    python embeddings.py report --index faiss_index/ [--backends torch,torch-int8,onnx,onnx-int8] [--sample 500]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+# Débit et accord avec torch non mesurés : à valider par le rapport avant usage
+UNVALIDATED_BACKENDS = ("torch-int8", "onnx", "onnx-int8")
+
+MODEL_DIR = os.path.join("embedding_cache", "models")
+BACKEND_CONFIG = "backend.json"
+
+
+def _st_config(model_name):
+    """Longueur maximale et pooling définis par la configuration Sentence Transformers du modèle"""
+    config = {"max_length": 128, "pooling": "mean"}
+    try:
+        from huggingface_hub import hf_hub_download
+        with open(hf_hub_download(model_name, "sentence_bert_config.json"), 'r', encoding='utf-8') as f:
+            config["max_length"] = json.load(f).get("max_seq_length", config["max_length"])
+        with open(hf_hub_download(model_name, "1_Pooling/config.json"), 'r', encoding='utf-8') as f:
+            if json.load(f).get("pooling_mode_cls_token"):
+                config["pooling"] = "cls"
+    except Exception:
+        pass  # Modèle sans configuration Sentence Transformers : valeurs par défaut
+    return config
+
+
+class TransformerEmbeddings(Embeddings):
+    """Base des moteurs hors PyTorch float32 : lots triés par longueur, pooling et normalisation"""
+
+    def __init__(self, max_length=128, pooling="mean", pad_id=0, batch_size=32, normalize=True):
+        self.max_length = max_length
+        self.pooling = pooling
+        self.pad_id = pad_id
+        self.batch_size = batch_size
+        self.normalize = normalize
+
+    def _tokenize(self, texts):
+        """Identifiants de tokens (tronqués à max_length) de chaque texte"""
+        raise NotImplementedError
+
+    def _forward(self, input_ids, attention_mask):
+        """États cachés de la dernière couche (lot x séquence x dimension)"""
+        raise NotImplementedError
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        token_ids = self._tokenize(texts)
+        # Lots de longueurs voisines : chaque lot n'est complété que jusqu'à son plus long texte
+        order = sorted(range(len(texts)), key=lambda i: len(token_ids[i]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            width = max(len(token_ids[i]) for i in batch)
+            input_ids = np.full((len(batch), width), self.pad_id, dtype=np.int64)
+            attention_mask = np.zeros((len(batch), width), dtype=np.int64)
+            for row, i in enumerate(batch):
+                input_ids[row, :len(token_ids[i])] = token_ids[i]
+                attention_mask[row, :len(token_ids[i])] = 1
+            hidden = self._forward(input_ids, attention_mask)
+            if self.pooling == "cls":
+                pooled = hidden[:, 0]
+            else:
+                mask = attention_mask[..., None].astype(np.float32)
+                pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            if self.normalize:
+                pooled = pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+            for row, i in enumerate(batch):
+                vectors[i] = pooled[row].astype(np.float32).tolist()
+        return vectors
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class QuantizedTorchEmbeddings(TransformerEmbeddings):
+    """Modèle PyTorch dont les couches linéaires sont quantifiées dynamiquement en int8"""
+
+    def __init__(self, model_name, **kwargs):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        config = _st_config(model_name)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name).eval()
+        self.model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self._torch = torch
+        super().__init__(
+            max_length=config["max_length"], pooling=config["pooling"],
+            pad_id=self.tokenizer.pad_token_id or 0, **kwargs
+        )
+
+    def _tokenize(self, texts):
+        return self.tokenizer(list(texts), truncation=True, max_length=self.max_length)["input_ids"]
+
+    def _forward(self, input_ids, attention_mask):
+        with self._torch.inference_mode():
+            output = self.model(
+                input_ids=self._torch.from_numpy(input_ids),
+                attention_mask=self._torch.from_numpy(attention_mask),
+            )
+        return output.last_hidden_state.numpy()
+
+
+def export_onnx(model_name, model_dir=MODEL_DIR, quantize=False):
+    """Exporte (une seule fois) le modèle en ONNX ; retourne le dossier d'export
+
+    Le dossier contient model.onnx (et model.int8.onnx si quantize), tokenizer.json
+    et backend.json (longueur maximale, pooling, token de remplissage).
+    """
+    export_dir = os.path.join(model_dir, model_name.replace("/", "__"))
+    onnx_path = os.path.join(export_dir, "model.onnx")
+    if not os.path.exists(onnx_path):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        os.makedirs(export_dir, exist_ok=True)
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name).eval()
+        sample = tokenizer(["exemple de texte"], return_tensors="pt")
+        input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+        axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+        tmp_path = onnx_path + ".tmp"
+        torch.onnx.export(
+            model, tuple(sample[name] for name in input_names), tmp_path,
+            input_names=input_names, output_names=["last_hidden_state"],
+            dynamic_axes=axes, opset_version=14,
+        )
+        tokenizer.save_pretrained(export_dir)
+        config = _st_config(model_name)
+        config.update(pad_id=tokenizer.pad_token_id or 0, inputs=input_names)
+        with open(os.path.join(export_dir, BACKEND_CONFIG), 'w', encoding='utf-8') as f:
+            json.dump(config, f)
+        os.replace(tmp_path, onnx_path)
+
+    int8_path = os.path.join(export_dir, "model.int8.onnx")
+    if quantize and not os.path.exists(int8_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(onnx_path, int8_path + ".tmp", weight_type=QuantType.QInt8)
+        os.replace(int8_path + ".tmp", int8_path)
+    return export_dir
+
+
+class OnnxEmbeddings(TransformerEmbeddings):
+    """Modèle exporté en ONNX exécuté par ONNX Runtime (CPU)"""
+
+    def __init__(self, model_name, model_dir=MODEL_DIR, quantized=False, **kwargs):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        export_dir = export_onnx(model_name, model_dir, quantize=quantized)
+        with open(os.path.join(export_dir, BACKEND_CONFIG), 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        self.tokenizer = Tokenizer.from_file(os.path.join(export_dir, "tokenizer.json"))
+        self.tokenizer.no_padding()
+        self.tokenizer.enable_truncation(config["max_length"])
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            os.path.join(export_dir, "model.int8.onnx" if quantized else "model.onnx"),
+            options, providers=["CPUExecutionProvider"],
+        )
+        self.inputs = config.get("inputs", ["input_ids", "attention_mask"])
+        super().__init__(max_length=config["max_length"], pooling=config["pooling"], pad_id=config["pad_id"], **kwargs)
+
+    def _tokenize(self, texts):
+        return [encoding.ids for encoding in self.tokenizer.encode_batch(list(texts))]
+
+    def _forward(self, input_ids, attention_mask):
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask, "token_type_ids": np.zeros_like(input_ids)}
+        return self.session.run(["last_hidden_state"], {name: feeds[name] for name in self.inputs})[0]
+
+
+def create_embeddings(backend, model_name, model_dir=MODEL_DIR, batch_size=32):
+    """Instancie le moteur d'embeddings demandé (vecteurs normalisés)
+
+    Args:
+        backend: Un des BACKENDS
+        model_name: Modèle Sentence Transformers (Hugging Face)
+        model_dir: Dossier des exports ONNX
+        batch_size: Taille des lots (moteurs hors torch)
+    """
+    if backend == "torch":
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(
+            model_name=model_name,
+            model_kwargs={'device': 'cpu'},  # Utiliser CPU (plus compatible)
+            encode_kwargs={'normalize_embeddings': True}
+        )
+    if backend in UNVALIDATED_BACKENDS:
+        print(
+            f"⚠️ Moteur d'embeddings {backend} non validé : vérifier son accord avec torch "
+            "(python embeddings.py report) avant de l'utiliser en production",
+            file=sys.stderr,
+        )
+    if backend == "torch-int8":
+        return QuantizedTorchEmbeddings(model_name, batch_size=batch_size)
+    if backend in ("onnx", "onnx-int8"):
+        return OnnxEmbeddings(model_name, model_dir, quantized=backend == "onnx-int8", batch_size=batch_size)
+    raise ValueError(f"Moteur d'embeddings inconnu : {backend} (attendu : {', '.join(BACKENDS)})")
+
+
+def agreement_report(texts, backends, model_name, model_dir=MODEL_DIR, batch_size=32):
+    """Compare chaque moteur à la référence PyTorch : accord cosinus et débit
+
+    Returns:
+        Liste de dicts (un par moteur) : segments/s, temps de chargement, cosinus moyen / minimal / 1er centile
+    """
+    rows = []
+    reference = None
+    for backend in ["torch"] + [b for b in backends if b != "torch"]:
+        start = time.perf_counter()
+        model = create_embeddings(backend, model_name, model_dir, batch_size)
+        load_s = time.perf_counter() - start
+        model.embed_documents(texts[:8])  # échauffement
+        start = time.perf_counter()
+        vectors = np.array(model.embed_documents(texts), dtype=np.float32)
+        elapsed = time.perf_counter() - start
+        if reference is None:
+            reference = vectors
+        cosines = np.sum(vectors * reference, axis=1) / np.maximum(
+            np.linalg.norm(vectors, axis=1) * np.linalg.norm(reference, axis=1), 1e-12
+        )
+        if backend in backends:
+            rows.append({
+                "backend": backend,
+                "load_s": round(load_s, 2),
+                "chunks_per_s": round(len(texts) / elapsed, 1),
+                "cosine_mean": round(float(cosines.mean()), 5),
+                "cosine_min": round(float(cosines.min()), 5),
+                "cosine_p1": round(float(np.percentile(cosines, 1)), 5),
+            })
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Accord et débit des moteurs d'embeddings")
+    sub = parser.add_subparsers(dest="command", required=True)
+    report = sub.add_parser("report", help="Compare les moteurs à la référence PyTorch")
+    report.add_argument("--index", default="faiss_index/", help="Index dont les segments servent d'échantillon")
+    report.add_argument("--texts", help="Fichier texte (un segment par ligne) à la place de l'index")
+    report.add_argument("--model", default="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+    report.add_argument("--backends", default=",".join(BACKENDS))
+    report.add_argument("--sample", type=int, default=500)
+    report.add_argument("--batch-size", type=int, default=32)
+    report.add_argument("--json", help="Écrit aussi le rapport dans ce fichier JSON")
+    args = parser.parse_args(argv)
+
+    if args.texts:
+        with open(args.texts, 'r', encoding='utf-8') as f:
+            texts = [line.strip() for line in f if line.strip()]
+    else:
+        from docstore import DOCSTORE_FILE, SqliteDocstore
+        from versions import reading
+
+        with reading(args.index) as index_path:
+            docstore = SqliteDocstore(os.path.join(index_path, DOCSTORE_FILE))
+            texts = [doc.page_content for _, doc in docstore.iter_documents()]
+            docstore.close()
+    texts = texts[:args.sample]
+    if not texts:
+        print("❌ Aucun segment à comparer", file=sys.stderr)
+        return 1
+
+    rows = agreement_report(texts, [b.strip() for b in args.backends.split(",")], args.model, batch_size=args.batch_size)
+    print(f"{len(texts)} segments, modèle {args.model}\n")
+    header = f"{'moteur':<12} {'chargement s':>12} {'segments/s':>11} {'cos moyen':>10} {'cos min':>9} {'cos p1':>9}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(
+            f"{row['backend']:<12} {row['load_s']:>12.2f} {row['chunks_per_s']:>11.1f} "
+            f"{row['cosine_mean']:>10.5f} {row['cosine_min']:>9.5f} {row['cosine_p1']:>9.5f}"
+        )
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""
+Extraction du texte des PDFs en parallèle sur un pool de processus.
+
+Les fonctions exécutées dans les processus fils sont définies ici (et non dans
+app.py) pour que les workers n'aient pas à importer Streamlit.
+"""
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from text_cache import is_cached, load_pages, save_pages
+
+
+def load_pdf(data_path, pdf_file, cache_dir=None, sha256=None):
+    """Charge les pages d'un PDF ; retourne (nom, pages, erreur)
+
+    Avec cache_dir et sha256, les pages sont relues dans le cache du texte
+    extrait (text_cache.py) si ce contenu y est déjà, et y sont ajoutées sinon.
+    """
+    from langchain_community.document_loaders import PyPDFLoader
+
+    if cache_dir and sha256:
+        docs = load_pages(cache_dir, sha256, pdf_file)
+        if docs is not None:
+            return pdf_file, docs, None
+    try:
+        docs = PyPDFLoader(os.path.join(data_path, pdf_file)).load()
+    except Exception as e:
+        return pdf_file, [], f"{type(e).__name__}: {e}"
+    # Ajouter le nom du fichier comme métadonnée
+    for doc in docs:
+        doc.metadata['source'] = pdf_file
+    if cache_dir and sha256:
+        try:
+            save_pages(cache_dir, sha256, docs)
+        except OSError:
+            pass  # Cache facultatif : l'extraction a réussi
+    return pdf_file, docs, None
+
+
+def iter_pages(data_path, pdf_files, max_workers=None, prefetch=None, cache_dir=None, hashes=None):
+    """Extrait les pages des PDFs en flux, dans l'ordre de pdf_files
+
+    Au plus `prefetch` fichiers sont extraits en avance (2 par processus par
+    défaut) : la mémoire occupée ne dépend pas du nombre de PDFs, et un
+    consommateur plus lent que l'extraction la freine au lieu d'accumuler les pages.
+
+    Args:
+        data_path: Dossier contenant les PDFs
+        pdf_files: Noms des fichiers à extraire
+        max_workers: Taille du pool (None = nombre de cœurs, 1 = sans pool)
+        prefetch: Nombre maximal de fichiers extraits en avance
+        cache_dir: Dossier du cache du texte extrait (None = sans cache)
+        hashes: Dict {nom: sha256} des fichiers, clés du cache
+
+    Yields:
+        (nom, pages, erreur) ; un fichier en échec n'interrompt pas les autres
+    """
+    if not pdf_files:
+        return
+    hashes = (hashes or {}) if cache_dir else {}
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(pdf_files)))
+    if cache_dir and all(is_cached(cache_dir, hashes.get(f)) for f in pdf_files):
+        max_workers = 1  # Tout est en cache : aucun PDF à analyser, pas de pool à démarrer
+
+    if max_workers == 1:
+        for pdf_file in pdf_files:
+            yield load_pdf(data_path, pdf_file, cache_dir, hashes.get(pdf_file))
+        return
+
+    prefetch = max(1, prefetch or 2 * max_workers)
+    remaining = iter(pdf_files)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        def submit(pdf_file):
+            return executor.submit(load_pdf, data_path, pdf_file, cache_dir, hashes.get(pdf_file))
+
+        pending = deque((f, submit(f)) for f in islice(remaining, prefetch))
+        while pending:
+            pdf_file, future = pending.popleft()
+            try:
+                result = future.result()
+            except Exception as e:
+                # Worker mort (mémoire, segfault de la lib PDF...) : on signale et on continue
+                result = (pdf_file, [], f"{type(e).__name__}: {e}")
+            # Relancer un fichier avant de rendre la main : les workers restent occupés
+            next_file = next(remaining, None)
+            if next_file is not None:
+                pending.append((next_file, submit(next_file)))
+            yield result
+
+
+def extract_pages(data_path, pdf_files, max_workers=None, on_file_done=None):
+    """Extrait les pages de plusieurs PDFs en parallèle
+
+    Args:
+        data_path: Dossier contenant les PDFs
+        pdf_files: Noms des fichiers à extraire
+        max_workers: Taille du pool (None = nombre de cœurs, 1 = sans pool)
+        on_file_done: Callback optionnel appelé (nom, nb_terminés, nb_total) à chaque fichier
+
+    Returns:
+        (pages, échecs) : pages est un dict {nom: [Document]} dans l'ordre de
+        pdf_files (résultat indépendant de l'ordre de fin des workers), échecs un
+        dict {nom: message d'erreur}. Un fichier en échec n'interrompt pas les autres.
+    """
+    pages = {}
+    failures = {}
+    for done, (pdf_file, docs, error) in enumerate(iter_pages(data_path, pdf_files, max_workers), 1):
+        if error is not None:
+            failures[pdf_file] = error
+        else:
+            pages[pdf_file] = docs
+        if on_file_done:
+            on_file_done(pdf_file, done, len(pdf_files))
+    return pages, failures
@@ -0,0 +1,162 @@
+"""
+Historique de conversation compact, plafonné et déversé sur disque.
+
+Les messages gardés en session ne contiennent pas les Documents LangChain de
+leurs sources, seulement des références {ids, source, page, also_in} : le
+texte des segments est relu dans la docstore à la demande. Au-delà de
+max_messages, les messages les plus anciens sont ajoutés au journal de la
+session (history/<utilisateur>/<session>.jsonl) et retirés de la mémoire.
+
+L'interface n'affiche qu'une fenêtre de messages récents ; les plus anciens
+sont relus page par page dans la mémoire ou le journal (accès direct par
+position, sans relire tout le fichier).
+
+Les journaux ne survivent pas à la session au-delà de la durée de
+conservation : prune_history supprime ceux qui n'ont pas été modifiés depuis
+max_age_days jours.
+"""
+
+import json
+import os
+import re
+import time
+import uuid
+
+HISTORY_DIR = "history"
+
+
+def source_refs(docs):
+    """Références compactes (identifiants, source, page, autres citations) des segments utilisés
+
+    Les références déjà compactes sont conservées telles quelles.
+    """
+    refs = []
+    for doc in docs:
+        if isinstance(doc, dict):
+            refs.append(doc)
+            continue
+        # Passage recollé à partir de plusieurs segments (context.merge_overlapping)
+        ids = doc.metadata.get("chunk_ids") or ([doc.id] if getattr(doc, "id", None) else [])
+        ref = {"ids": list(ids), "source": doc.metadata.get("source", "Inconnu"), "page": doc.metadata.get("page", "N/A")}
+        if doc.metadata.get("also_in"):
+            ref["also_in"] = doc.metadata["also_in"]
+        refs.append(ref)
+    return refs
+
+
+def ref_citations(ref):
+    """(source, page) d'une référence puis celles de ses doublons fusionnés à l'indexation"""
+    return [{"source": ref["source"], "page": ref["page"]}] + list(ref.get("also_in", ()))
+
+
+def resolve_refs(docstore, refs):
+    """Relit dans la docstore le texte des segments référencés
+
+    Returns:
+        Liste de textes (None si les segments ne sont plus dans l'index), dans l'ordre des références
+    """
+    ids = list(dict.fromkeys(cid for ref in refs for cid in ref.get("ids", ())))
+    if hasattr(docstore, "mget"):
+        found = dict(zip(ids, docstore.mget(ids)))
+    else:
+        found = {cid: docstore.search(cid) for cid in ids}
+    texts = []
+    for ref in refs:
+        docs = [found.get(cid) for cid in ref.get("ids", ())]
+        docs = [doc for doc in docs if doc is not None and not isinstance(doc, str)]
+        texts.append("\n[…]\n".join(doc.page_content for doc in docs) if docs else None)
+    return texts
+
+
+def _safe_name(name):
+    return re.sub(r"[^\w.-]", "_", name or "default")[:64] or "default"
+
+
+def prune_history(history_dir=HISTORY_DIR, max_age_days=7, keep=()):
+    """Supprime les journaux de session plus anciens que max_age_days jours
+
+    Args:
+        history_dir: Dossier des historiques (un sous-dossier par utilisateur)
+        max_age_days: Durée de conservation ; 0 ou moins désactive la purge
+        keep: Chemins à conserver quel que soit leur âge (sessions en cours)
+
+    Returns:
+        Nombre de journaux supprimés
+    """
+    if max_age_days <= 0 or not os.path.isdir(history_dir):
+        return 0
+    cutoff = time.time() - max_age_days * 86400
+    keep = {os.path.abspath(path) for path in keep}
+    removed = 0
+    for user in os.listdir(history_dir):
+        user_dir = os.path.join(history_dir, user)
+        if not os.path.isdir(user_dir):
+            continue
+        for name in os.listdir(user_dir):
+            path = os.path.join(user_dir, name)
+            if not name.endswith(".jsonl") or os.path.abspath(path) in keep:
+                continue
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass  # Supprimé entre-temps par une autre session
+        try:
+            os.rmdir(user_dir)  # Seulement s'il est vide
+        except OSError:
+            pass
+    return removed
+
+
+class ChatHistory:
+    """Messages d'une session : les plus récents en mémoire, les plus anciens dans un journal JSONL"""
+
+    def __init__(self, user, max_messages=50, history_dir=HISTORY_DIR, session_id=None):
+        self.max_messages = max(1, max_messages)
+        self.session_id = session_id or time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+        self.path = os.path.join(history_dir, _safe_name(user), f"{self.session_id}.jsonl")
+        self.messages = []
+        # Position (octets) de chaque message déversé dans le journal
+        self._offsets = []
+
+    def __len__(self):
+        return len(self._offsets) + len(self.messages)
+
+    @property
+    def spilled(self):
+        """Nombre de messages déversés sur disque"""
+        return len(self._offsets)
+
+    def append(self, role, content, sources=None):
+        """Ajoute un message ; ses sources (Documents ou références) sont réduites à des références"""
+        message = {"role": role, "content": content, "time": time.time()}
+        if sources:
+            message["sources"] = source_refs(sources)
+        self.messages.append(message)
+        self._spill()
+        return message
+
+    def _spill(self):
+        overflow = len(self.messages) - self.max_messages
+        if overflow <= 0:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'ab') as f:
+            for message in self.messages[:overflow]:
+                self._offsets.append(f.tell())
+                f.write((json.dumps(message, ensure_ascii=False) + "\n").encode('utf-8'))
+        del self.messages[:overflow]
+
+    def window(self, start, end):
+        """Messages de positions [start, end) dans toute la session (mémoire ou journal)"""
+        start, end = max(0, start), min(len(self), end)
+        result = []
+        if start < self.spilled:
+            with open(self.path, 'rb') as f:
+                f.seek(self._offsets[start])
+                for _ in range(min(end, self.spilled) - start):
+                    result.append(json.loads(f.readline()))
+        first = max(start, self.spilled) - self.spilled
+        result.extend(self.messages[first:max(first, end - self.spilled)])
+        return result
@@ -0,0 +1,197 @@
+"""
+Indexation en tâche de fond : un thread par processus, état persisté sur disque.
+
+L'indexation ne dépend plus du script Streamlit qui l'a lancée : rafraîchir
+la page ne l'interrompt pas, et toutes les sessions suivent sa progression.
+L'état (progression, messages, erreur) est écrit dans index_job/state.json ;
+l'index en cours de construction est sauvegardé tous les N lots dans
+index_job/checkpoint/ pour qu'une indexation interrompue (arrêt du serveur,
+erreur) reprenne là où elle s'était arrêtée.
+"""
+
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+import uuid
+
+JOB_DIR = "index_job"
+STATE_FILE = "state.json"
+CHECKPOINT_DIR = "checkpoint"
+
+# Nombre de messages conservés dans l'état de la tâche
+MAX_MESSAGES = 30
+
+
+class Reporter:
+    """Destinataire des messages et de la progression de l'indexation (ici : la console)"""
+
+    def progress(self, fraction, text=None):
+        pass
+
+    def message(self, level, text):
+        print(text, file=sys.stderr)
+
+    def info(self, text):
+        self.message("info", text)
+
+    def success(self, text):
+        self.message("success", text)
+
+    def warning(self, text):
+        self.message("warning", text)
+
+    def error(self, text):
+        self.message("error", text)
+
+
+def checkpoint_path(job_dir=JOB_DIR):
+    """Dossier du point de reprise de l'index en cours de construction"""
+    return os.path.join(job_dir, CHECKPOINT_DIR)
+
+
+def clear_checkpoint(job_dir=JOB_DIR):
+    """Supprime le point de reprise (indexation terminée)"""
+    path = checkpoint_path(job_dir)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+
+
+def read_state(job_dir=JOB_DIR):
+    """Dernier état enregistré de la tâche d'indexation, ou None"""
+    try:
+        with open(os.path.join(job_dir, STATE_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class IndexingJob(Reporter):
+    """Une exécution de l'indexation ; sert de Reporter et persiste son état"""
+
+    def __init__(self, job_dir=JOB_DIR):
+        self.job_dir = job_dir
+        self._lock = threading.Lock()
+        self._last_save = 0.0
+        self.state = {
+            "id": uuid.uuid4().hex[:12],
+            "status": "running",
+            "pid": os.getpid(),
+            "started_at": time.time(),
+            "updated_at": time.time(),
+            "finished_at": None,
+            "progress": 0.0,
+            "status_text": "Démarrage...",
+            "messages": [],
+            "error": None,
+        }
+        self._save(force=True)
+
+    def _save(self, force=False):
+        # Appelé avec _lock (sauf à la création) ; écritures espacées d'au moins 0,5 s
+        now = time.time()
+        self.state["updated_at"] = now
+        if not force and now - self._last_save < 0.5:
+            return
+        self._last_save = now
+        os.makedirs(self.job_dir, exist_ok=True)
+        path = os.path.join(self.job_dir, STATE_FILE)
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    def progress(self, fraction, text=None):
+        with self._lock:
+            self.state["progress"] = round(float(fraction), 4)
+            if text is not None:
+                self.state["status_text"] = text
+            self._save()
+
+    def message(self, level, text):
+        with self._lock:
+            self.state["messages"] = (self.state["messages"] + [[level, text]])[-MAX_MESSAGES:]
+            self._save(force=True)
+
+    def finish(self, status, error=None):
+        with self._lock:
+            self.state.update(status=status, error=error, finished_at=time.time())
+            if status == "done":
+                self.state["progress"] = 1.0
+            self._save(force=True)
+
+    def snapshot(self):
+        with self._lock:
+            return json.loads(json.dumps(self.state))
+
+
+class JobManager:
+    """Lance au plus une indexation à la fois dans le processus et expose son état"""
+
+    def __init__(self, job_dir=JOB_DIR):
+        self.job_dir = job_dir
+        self._lock = threading.Lock()
+        self._job = None
+        self._thread = None
+
+    def running(self):
+        with self._lock:
+            return self._thread is not None and self._thread.is_alive()
+
+    def start(self, target):
+        """Démarre target(job) dans un thread, sauf si une indexation est déjà en cours
+
+        target retourne une valeur vraie en cas de succès ; une valeur fausse ou
+        une exception marque la tâche en échec (le point de reprise est conservé).
+
+        Returns:
+            L'IndexingJob en cours (nouveau ou existant)
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return self._job
+            job = IndexingJob(self.job_dir)
+
+            def run():
+                try:
+                    ok = target(job)
+                    job.finish("done" if ok else "failed", None if ok else "Indexation interrompue (voir les messages)")
+                except Exception as e:
+                    job.error(f"❌ Erreur lors de l'indexation : {e}")
+                    job.finish("failed", f"{type(e).__name__}: {e}")
+
+            self._job = job
+            self._thread = threading.Thread(target=run, name=f"indexing-{job.state['id']}", daemon=True)
+            self._thread.start()
+            return job
+
+    def state(self):
+        """État de la dernière indexation (de ce processus, sinon celui enregistré sur disque)
+
+        Une tâche enregistrée comme « running » sans thread vivant dans ce processus
+        a été interrompue (redémarrage du serveur) : elle est signalée « interrupted ».
+        """
+        with self._lock:
+            job = self._job
+        if job is not None:
+            state = job.snapshot()
+        else:
+            state = read_state(self.job_dir)
+            if state is None:
+                return None
+            if state.get("status") == "running" and not _pid_alive(state.get("pid")):
+                state["status"] = "interrupted"
+        state["resumable"] = state["status"] != "running" and os.path.exists(checkpoint_path(self.job_dir))
+        return state
+
+
+def _pid_alive(pid):
+    # Tâche lancée par un autre processus (autre serveur Streamlit) encore actif ?
+    if not pid or pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except (OSError, ValueError):
+        return False
+    return True
@@ -0,0 +1,129 @@
+"""
+Indexation en flux : pages -> segments -> lots d'embeddings -> index.
+
+Chaque étape est un générateur qui ne tire de l'étape précédente que ce dont
+elle a besoin : les pages d'un PDF sont découpées dès leur extraction, les
+segments partent vers l'embedding par lots, et seuls le lot en cours et les
+quelques PDFs extraits en avance (voir extraction.iter_pages) sont en mémoire,
+quel que soit le nombre de fichiers dans data/.
+
+En découpage parent-enfant (ParentChildSplitter), seuls de petits segments
+enfants sans chevauchement sont vectorisés ; chacun garde l'identifiant de son
+passage parent (paragraphes, page), stocké à part dans la docstore et envoyé
+au modèle à sa place.
+"""
+
+import time
+
+
+class ParentChildSplitter:
+    """Découpage à deux niveaux : passages parents pour le contexte, segments enfants pour la recherche
+
+    Les enfants découpent chaque parent sans chevauchement : un même texte n'est
+    vectorisé qu'une fois, et les résultats voisins d'un même parent ne
+    l'envoient qu'une fois au modèle.
+    """
+
+    def __init__(self, child_splitter, parent_splitter=None):
+        self.child_splitter = child_splitter
+        # None : la page entière sert de parent
+        self.parent_splitter = parent_splitter
+
+    def split_hierarchy(self, docs):
+        """Liste de (parent, enfants) pour les pages données"""
+        parents = self.parent_splitter.split_documents(docs) if self.parent_splitter else list(docs)
+        return [(parent, self.child_splitter.split_documents([parent])) for parent in parents]
+
+    def split_documents(self, docs):
+        """Segments enfants seuls (statistiques de découpage)"""
+        return [child for _, children in self.split_hierarchy(docs) for child in children]
+
+
+def split_file(splitter, pdf_file, docs, make_id):
+    """Découpe les pages d'un fichier
+
+    Returns:
+        (segments, passages parents {identifiant: Document}) ; sans parents hors découpage parent-enfant
+    """
+    if not hasattr(splitter, "split_hierarchy"):
+        return splitter.split_documents(docs), {}
+    chunks, parents = [], {}
+    for p, (parent, children) in enumerate(splitter.split_hierarchy(docs)):
+        if not children:
+            continue
+        parent_id = make_id(pdf_file, f"parent-{p}")
+        parents[parent_id] = parent
+        for child in children:
+            child.metadata["parent_id"] = parent_id
+        chunks.extend(children)
+    return chunks, parents
+
+
+def iter_chunks(files, splitter, make_id, on_file=None, on_parents=None):
+    """Découpe les pages de chaque fichier au fil de l'eau
+
+    Args:
+        files: Itérable de (nom, pages, erreur), comme extraction.iter_pages
+        splitter: Découpeur LangChain (split_documents) ou ParentChildSplitter
+        make_id: Fonction (nom, position) -> identifiant de segment
+        on_file: Callback optionnel (nom, pages, identifiants, erreur) appelé une fois
+            par fichier, avant que ses segments soient transmis
+        on_parents: Callback optionnel (nom, {identifiant: passage parent}) appelé
+            avant on_file en découpage parent-enfant
+
+    Yields:
+        (Document, identifiant) de chaque segment
+    """
+    for pdf_file, docs, error in files:
+        if error is not None:
+            if on_file:
+                on_file(pdf_file, [], [], error)
+            continue
+        file_splits, parents = split_file(splitter, pdf_file, docs, make_id)
+        if parents and on_parents:
+            on_parents(pdf_file, parents)
+        ids = [make_id(pdf_file, i) for i in range(len(file_splits))]
+        if on_file:
+            on_file(pdf_file, docs, ids, None)
+        yield from zip(file_splits, ids)
+
+
+class AdaptiveBatcher:
+    """Regroupe un flux en lots dont la taille s'ajuste pour durer environ target_seconds
+
+    Les lots servis par le cache d'embeddings grossissent, les lots calculés
+    par le modèle restent assez petits pour que la progression reste fluide.
+    """
+
+    def __init__(self, target_seconds=2.0, initial_size=64, min_size=8, max_size=512):
+        self.target_seconds = target_seconds
+        self.min_size = min_size
+        self.max_size = max_size
+        self.size = max(min_size, min(initial_size, max_size))
+
+    def record(self, count, seconds):
+        """Ajuste la taille des prochains lots d'après la durée du dernier"""
+        if count <= 0 or seconds <= 0:
+            return
+        ideal = count * self.target_seconds / seconds
+        # Lissage : la taille évolue au plus d'un facteur 2 par lot
+        ideal = max(self.size / 2, min(ideal, self.size * 2))
+        self.size = int(max(self.min_size, min(self.max_size, ideal)))
+
+    def batches(self, items):
+        """Itère sur les lots (listes) ; chaque lot est constitué à la demande"""
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= self.size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def timed(self, items):
+        """Comme batches(), en mesurant le traitement de chaque lot par le consommateur"""
+        for batch in self.batches(items):
+            start = time.perf_counter()
+            yield batch
+            self.record(len(batch), time.perf_counter() - start)
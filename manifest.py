@@ -0,0 +1,95 @@
+"""
+Manifeste de l'index FAISS : garde, pour chaque PDF indexé, son empreinte
+(hash du contenu, taille, date de modification) et les identifiants des
+segments qu'il a produits. Permet une réindexation incrémentale.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_FORMAT = 1
+
+
+def file_sha256(path, block_size=1024 * 1024):
+    """Calcule le hash SHA-256 du contenu d'un fichier"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def fingerprint_files(data_path, pdf_files, previous=None):
+    """Retourne l'empreinte {nom: {sha256, size, mtime}} de chaque fichier
+
+    Le hash n'est recalculé que si la taille ou la date de modification a changé
+    par rapport au manifeste précédent.
+    """
+    previous = previous or {}
+    fingerprints = {}
+    for pdf_file in pdf_files:
+        stat = os.stat(os.path.join(data_path, pdf_file))
+        old = previous.get(pdf_file)
+        if old and old.get("size") == stat.st_size and old.get("mtime") == stat.st_mtime:
+            sha = old["sha256"]
+        else:
+            sha = file_sha256(os.path.join(data_path, pdf_file))
+        fingerprints[pdf_file] = {"sha256": sha, "size": stat.st_size, "mtime": stat.st_mtime}
+    return fingerprints
+
+
+def diff_files(previous, current):
+    """Compare deux états et retourne (ajoutés, modifiés, supprimés, inchangés)"""
+    added = sorted(name for name in current if name not in previous)
+    removed = sorted(name for name in previous if name not in current)
+    modified = sorted(
+        name for name in current
+        if name in previous and previous[name]["sha256"] != current[name]["sha256"]
+    )
+    unchanged = sorted(
+        name for name in current
+        if name in previous and previous[name]["sha256"] == current[name]["sha256"]
+    )
+    return added, modified, removed, unchanged
+
+
+def chunk_id(pdf_file, sha256, position):
+    """Identifiant stable d'un segment (même fichier + même contenu = mêmes IDs)"""
+    key = f"{pdf_file}\x00{sha256}\x00{position}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def load_manifest(index_path):
+    """Charge le manifeste de l'index, ou None s'il est absent ou illisible"""
+    path = os.path.join(index_path, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("format") != MANIFEST_FORMAT:
+        return None
+    return manifest
+
+
+def new_manifest(settings):
+    """Crée un manifeste vide pour les paramètres d'indexation donnés"""
+    return {"format": MANIFEST_FORMAT, "version": 0, "settings": dict(settings), "files": {}}
+
+
+def save_manifest(index_path, manifest):
+    """Écrit le manifeste (écriture atomique) en incrémentant sa version"""
+    manifest["version"] = manifest.get("version", 0) + 1
+    manifest["updated_at"] = time.time()
+    os.makedirs(index_path, exist_ok=True)
+    path = os.path.join(index_path, MANIFEST_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+    return manifest
@@ -0,0 +1,219 @@
+"""
+Mesures de latence : étapes du traitement (spans) et génération des réponses.
+
+- span() chronomètre une étape (embedding de la question, recherche FAISS,
+  construction du prompt, appel OpenAI, étapes de l'indexation...) et enregistre
+  sa durée et ses compteurs : en mémoire (dernières mesures, histogrammes
+  agrégés) et dans logs/spans.jsonl. Seuls les compteurs de COUNTED_ITEMS
+  (segments, pages...) sont cumulés par étape ; les autres attributs (k,
+  numéro de lot...) ne figurent que dans le journal.
+- record_generation() conserve le temps jusqu'au premier token et le débit de
+  chaque réponse dans logs/generation_metrics.jsonl.
+- prometheus_text() exporte les histogrammes au format texte Prometheus, servi
+  sur http://<hôte>:<port>/metrics par start_metrics_server().
+
+Les journaux JSONL tournent au-delà de LOG_MAX_BYTES (spans.jsonl.1, .2...,
+LOG_BACKUPS fichiers gardés).
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_DIR = "logs"
+GENERATION_LOG = os.path.join(METRICS_DIR, "generation_metrics.jsonl")
+SPAN_LOG = os.path.join(METRICS_DIR, "spans.jsonl")
+
+# Taille maximale d'un journal avant rotation, et nombre d'anciens journaux gardés
+LOG_MAX_BYTES = int(os.getenv("METRICS_LOG_MAX_MB", "20")) * 1024 * 1024
+LOG_BACKUPS = 3
+
+# Attributs de span cumulés par étape (rag_stage_items_total) : des quantités traitées
+COUNTED_ITEMS = ("chunks", "pages", "vectors", "queries")
+
+# Bornes des histogrammes de durée (secondes)
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+# Écritures des journaux : verrou distinct, les mesures en mémoire n'attendent pas le disque
+_log_lock = threading.Lock()
+_recent_generations = deque(maxlen=200)
+_recent_spans = deque(maxlen=500)
+_histograms = {}
+_current_trace = contextvars.ContextVar("rag_trace", default=None)
+_server = None
+
+
+def _rotate(path):
+    # Appelé avec _log_lock : spans.jsonl -> spans.jsonl.1 -> ... -> spans.jsonl.<LOG_BACKUPS>
+    for i in range(LOG_BACKUPS - 1, 0, -1):
+        if os.path.exists(f"{path}.{i}"):
+            os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+    os.replace(path, f"{path}.1")
+
+
+def _append_jsonl(path, entry):
+    line = json.dumps(entry, ensure_ascii=False) + "\n"
+    with _log_lock:
+        try:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            if os.path.exists(path) and os.path.getsize(path) + len(line) > LOG_MAX_BYTES:
+                _rotate(path)
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(line)
+        except OSError:
+            pass  # Les mesures ne doivent jamais faire échouer une réponse
+
+
+def record_generation(entry):
+    """Enregistre les mesures d'une génération (mémoire + fichier JSONL)"""
+    entry = dict(entry, timestamp=entry.get("timestamp", time.time()))
+    with _lock:
+        _recent_generations.append(entry)
+    _append_jsonl(GENERATION_LOG, entry)
+    return entry
+
+
+def recent_generations(limit=20):
+    """Retourne les mesures des dernières générations (la plus récente en dernier)"""
+    with _lock:
+        return list(_recent_generations)[-limit:]
+
+
+@contextmanager
+def trace(kind):
+    """Regroupe les spans d'une même requête ou indexation sous un identifiant commun"""
+    token = _current_trace.set(f"{kind}-{uuid.uuid4().hex[:8]}")
+    try:
+        yield _current_trace.get()
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def span(name, **counts):
+    """Chronomètre une étape ; les compteurs peuvent être complétés dans le bloc
+
+    Exemple :
+        with span("index.embed_batch", chunks=len(batch)) as s:
+            ...
+            s["cached"] = n
+    """
+    attrs = dict(counts)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield attrs
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        entry = {
+            "span": name,
+            "trace": _current_trace.get(),
+            "duration_ms": round(duration * 1000, 3),
+            "timestamp": time.time(),
+        }
+        entry.update(attrs)
+        if error:
+            entry["error"] = error
+        _record_span(name, duration, attrs, entry)
+
+
+def _record_span(name, duration, attrs, entry):
+    with _lock:
+        _recent_spans.append(entry)
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0, "items": {}}
+        for i, bound in enumerate(BUCKETS):
+            if duration <= bound:
+                histogram["buckets"][i] += 1
+        histogram["sum"] += duration
+        histogram["count"] += 1
+        for key in COUNTED_ITEMS:
+            value = attrs.get(key)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                histogram["items"][key] = histogram["items"].get(key, 0) + value
+    _append_jsonl(SPAN_LOG, entry)
+
+
+def recent_spans(limit=50):
+    """Retourne les derniers spans enregistrés (le plus récent en dernier)"""
+    with _lock:
+        return list(_recent_spans)[-limit:]
+
+
+def span_summary():
+    """Agrégats par étape : nombre, durée moyenne et totale"""
+    with _lock:
+        return [
+            {
+                "span": name,
+                "count": h["count"],
+                "mean_ms": round(h["sum"] / h["count"] * 1000, 3) if h["count"] else None,
+                "total_s": round(h["sum"], 3),
+                **h["items"],
+            }
+            for name, h in sorted(_histograms.items())
+        ]
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text():
+    """Histogrammes des étapes au format d'exposition texte Prometheus"""
+    lines = [
+        "# HELP rag_stage_duration_seconds Durée des étapes du pipeline RAG",
+        "# TYPE rag_stage_duration_seconds histogram",
+    ]
+    counters = []
+    with _lock:
+        for name, h in sorted(_histograms.items()):
+            stage = _label(name)
+            for bound, count in zip(BUCKETS, h["buckets"]):
+                lines.append(f'rag_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'rag_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {h["count"]}')
+            lines.append(f'rag_stage_duration_seconds_sum{{stage="{stage}"}} {h["sum"]:.6f}')
+            lines.append(f'rag_stage_duration_seconds_count{{stage="{stage}"}} {h["count"]}')
+            for key, value in sorted(h["items"].items()):
+                counters.append(f'rag_stage_items_total{{stage="{stage}",item="{_label(key)}"}} {value}')
+    if counters:
+        lines += ["# HELP rag_stage_items_total Éléments traités par étape", "# TYPE rag_stage_items_total counter"]
+        lines += counters
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        payload = prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """Sert /metrics (format Prometheus) dans un thread ; une seule fois par processus"""
+    global _server
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
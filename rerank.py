@@ -0,0 +1,151 @@
+"""
+Reclassement des candidats par un cross-encoder sur CPU.
+
+La recherche fournit un ensemble élargi de candidats (50 par défaut) ; le
+cross-encoder note chaque paire (question, segment) en un seul passage par
+lot, textes tronqués à max_length tokens, et seuls les mieux notés sont
+envoyés au modèle de langage.
+
+Les scores sont mis en cache par (question, segment). Si la notation dépasse
+le budget de latence, les top_n premiers candidats sont gardés dans l'ordre de
+la recherche ; la notation se termine en arrière-plan et remplit le cache.
+Le chargement du modèle (load(), appelé au préchargement) n'est pas compté
+dans le budget, et une question n'attend jamais derrière une notation déjà
+hors budget : si tous les threads de notation sont occupés, elle garde les
+top_n premiers candidats de la recherche.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+
+def pair_key(question, text):
+    """Clé de cache d'une paire (question, segment)"""
+    return hashlib.sha1(f"{question.strip()}\0{text}".encode('utf-8')).hexdigest()
+
+
+class CrossEncoderReranker:
+    """Cross-encoder partagé par les sessions, avec cache de scores et budget de latence"""
+
+    def __init__(self, model_name, max_length=256, cache_size=20000, workers=2):
+        self.model_name = model_name
+        self.max_length = max_length
+        self.cache_size = cache_size
+        self._model = None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        # Peu de threads de notation : les passages CPU se concurrencent entre sessions
+        self.workers = max(1, workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="rerank")
+        self._busy = 0
+        self.stats = {"queries": 0, "fallbacks": 0, "busy": 0, "pairs_scored": 0, "pairs_cached": 0}
+
+    def load(self):
+        """Charge le modèle (une fois) ; à appeler hors du budget de latence, au préchargement"""
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    self._model = CrossEncoder(self.model_name, max_length=self.max_length, device="cpu")
+        return self._model
+
+    def _cached(self, keys):
+        with self._lock:
+            scores = []
+            for key in keys:
+                score = self._cache.get(key)
+                if score is not None:
+                    self._cache.move_to_end(key)
+                scores.append(score)
+            return scores
+
+    def _store(self, keys, scores):
+        with self._lock:
+            for key, score in zip(keys, scores):
+                self._cache[key] = score
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def score(self, question, texts):
+        """Scores des segments pour la question (cache, puis un seul passage pour les manquants)"""
+        keys = [pair_key(question, text) for text in texts]
+        scores = self._cached(keys)
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if missing:
+            model = self.load()
+            computed = model.predict(
+                [(question, texts[i]) for i in missing], batch_size=len(missing), show_progress_bar=False
+            )
+            computed = [float(s) for s in computed]
+            self._store([keys[i] for i in missing], computed)
+            for i, score in zip(missing, computed):
+                scores[i] = score
+        with self._lock:
+            self.stats["pairs_scored"] += len(missing)
+            self.stats["pairs_cached"] += len(texts) - len(missing)
+        return scores
+
+    def _score_task(self, question, texts):
+        try:
+            return self.score(question, texts)
+        finally:
+            with self._lock:
+                self._busy -= 1
+
+    def rerank(self, question, docs, top_n, budget_s=None):
+        """Retourne les top_n segments selon le cross-encoder
+
+        Args:
+            question: La question de l'utilisateur
+            docs: Candidats (Documents) dans l'ordre de la recherche
+            top_n: Nombre de segments conservés
+            budget_s: Latence maximale de la notation (chargement du modèle non compris) ;
+                au-delà, les top_n premiers candidats sont gardés dans l'ordre de la recherche
+
+        Returns:
+            (segments retenus, rapport {reranked, latency_ms, cached})
+        """
+        try:
+            self.load()
+        except Exception as e:
+            # Modèle indisponible : ordre de la recherche
+            with self._lock:
+                self.stats["queries"] += 1
+                self.stats["fallbacks"] += 1
+            return docs[:top_n], {"reranked": False, "latency_ms": 0.0, "cached": 0, "error": f"{type(e).__name__}: {e}"}
+
+        start = time.perf_counter()
+        texts = [doc.page_content for doc in docs]
+        keys = [pair_key(question, text) for text in texts]
+        cached = sum(score is not None for score in self._cached(keys))
+        with self._lock:
+            self.stats["queries"] += 1
+            busy = self._busy >= self.workers
+            if busy:
+                self.stats["busy"] += 1
+                self.stats["fallbacks"] += 1
+            else:
+                self._busy += 1
+        if busy:
+            # Tous les threads notent encore des questions hors budget : ne pas faire la queue
+            return docs[:top_n], {"reranked": False, "latency_ms": round((time.perf_counter() - start) * 1000, 1), "cached": cached}
+        future = self._executor.submit(self._score_task, question, texts)
+        try:
+            scores = future.result(timeout=budget_s)
+        except Exception as e:
+            # Budget dépassé (TimeoutError) : ordre de la recherche, la notation remplit le cache
+            with self._lock:
+                self.stats["fallbacks"] += 1
+            report = {"reranked": False, "latency_ms": round((time.perf_counter() - start) * 1000, 1), "cached": cached}
+            if not isinstance(e, TimeoutError):
+                report["error"] = f"{type(e).__name__}: {e}"
+            return docs[:top_n], report
+
+        order = sorted(range(len(docs)), key=lambda i: -scores[i])[:top_n]
+        report = {"reranked": True, "latency_ms": round((time.perf_counter() - start) * 1000, 1), "cached": cached}
+        return [docs[i] for i in order], report
@@ -0,0 +1,217 @@
+"""
+Registre des ressources partagées par toutes les sessions Streamlit du processus.
+
+Streamlit réexécute app.py à chaque interaction, mais les modules importés
+restent en mémoire : le registre ci-dessous est donc unique par processus. Il
+garde une seule instance du modèle d'embeddings et une seule copie (en lecture
+seule) de chaque version de l'index FAISS. Chaque session détient un « bail »
+sur la version qu'elle utilise ; une version remplacée par une réindexation est
+libérée dès que plus aucune session ne la référence, puis supprimée du disque
+(voir versions.py). Tant qu'une version est en mémoire, le registre garde sur
+elle un marqueur de lecture : les autres processus ne la suppriment pas.
+"""
+
+import gc
+import threading
+import weakref
+from collections import deque
+
+from versions import collect, current_version, open_version, register_reader, release_reader, version_path
+
+
+def index_version(index_path):
+    """Identifiant de la version courante de l'index sur disque, ou None s'il n'existe pas"""
+    return current_version(index_path)
+
+
+class IndexLease:
+    """Référence d'une session vers une version partagée de l'index"""
+
+    def __init__(self, registry, version, vector_store):
+        self.version = version
+        self.vector_store = vector_store
+        # Libération automatique quand la session disparaît (déconnexion, onglet fermé)
+        self._finalizer = weakref.finalize(self, registry._release_index, version)
+
+    def release(self):
+        """Rend le bail (sans effet s'il a déjà été rendu)"""
+        self._finalizer()
+
+
+class ResourceRegistry:
+    """Modèle d'embeddings et index FAISS partagés, avec comptage de références
+
+    Les baux rendus (explicitement ou par le ramasse-miettes, qui peut se
+    déclencher n'importe où, y compris pendant que _index_lock est détenu) sont
+    seulement empilés ; la file est vidée par _collect, hors de tout verrou
+    détenu par l'appelant. Quiconque rend _index_lock appelle ensuite _collect.
+    """
+
+    def __init__(self):
+        self._model_lock = threading.RLock()
+        # Verrou distinct : le chargement d'un modèle ne bloque pas l'accès aux autres ressources
+        self._resource_lock = threading.RLock()
+        # Verrou court (comptage des baux) ; le chargement d'un index se fait sous _load_lock
+        self._index_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._released = deque()
+        self._embeddings = {}
+        self._resources = {}
+        self._indexes = {}
+        self._current = None
+        # Dossiers d'index déjà ouverts, dont les anciennes versions sont collectées
+        self._roots = set()
+
+    def get_embeddings(self, model_name, factory):
+        """Retourne l'unique instance du modèle model_name (créée au premier appel)"""
+        with self._model_lock:
+            if model_name not in self._embeddings:
+                self._embeddings[model_name] = factory()
+            return self._embeddings[model_name]
+
+    def get_resource(self, name, factory, valid=None):
+        """Retourne l'unique instance d'une ressource partagée (cache, client...)
+
+        Args:
+            name: Nom de la ressource
+            factory: Crée la ressource si elle n'existe pas (ou plus)
+            valid: Si fourni, une instance existante pour laquelle valid(instance)
+                est faux est recréée (tâche de fond terminée, par exemple)
+        """
+        with self._resource_lock:
+            if name not in self._resources or (valid is not None and not valid(self._resources[name])):
+                self._resources[name] = factory()
+            return self._resources[name]
+
+    def _lease(self, index_path, version):
+        # Appelé avec _index_lock : bail sur une version déjà en mémoire, ou None
+        entry = self._indexes.get(version)
+        if entry is None:
+            return None
+        self._roots.add(index_path)
+        self._current = version
+        entry["refs"] += 1
+        return IndexLease(self, version, entry["store"])
+
+    def acquire_index(self, index_path, loader):
+        """Prend un bail sur la version courante de l'index (chargée une seule fois)
+
+        Le chargement (plusieurs secondes) se fait hors de _index_lock : les
+        sessions qui rendent ou prennent un bail sur une version déjà chargée ne
+        l'attendent pas.
+
+        Args:
+            index_path: Dossier de l'index FAISS
+            loader: Fonction chargeant l'index depuis le dossier de la version courante,
+                si cette version n'est pas déjà en mémoire
+
+        Returns:
+            Un IndexLease, ou None si aucun index n'existe sur disque
+        """
+        version = index_version(index_path)
+        if version is None:
+            return None
+        try:
+            with self._index_lock:
+                lease = self._lease(index_path, version)
+            if lease is not None:
+                return lease
+            with self._load_lock:
+                # Une autre session a pu charger cette version pendant l'attente
+                with self._index_lock:
+                    lease = self._lease(index_path, version)
+                if lease is not None:
+                    return lease
+                # Marqueur posé avant le chargement : la version ne peut plus être collectée
+                version, marker = open_version(index_path)
+                if version is None:
+                    return None
+                try:
+                    store = loader(version_path(index_path, version))
+                except BaseException:
+                    release_reader(marker)
+                    raise
+                with self._index_lock:
+                    if version in self._indexes:
+                        # Version publiée par ce processus pendant le chargement
+                        release_reader(marker)
+                    else:
+                        self._indexes[version] = {"store": store, "refs": 0, "root": index_path, "marker": marker}
+                    return self._lease(index_path, version)
+        finally:
+            self._collect()
+
+    def publish_index(self, index_path, vector_store):
+        """Enregistre un index fraîchement construit comme version courante
+
+        Évite aux sessions de recharger depuis le disque l'index que l'indexation
+        vient d'écrire.
+        """
+        version = index_version(index_path)
+        if version is None:
+            return
+        with self._index_lock:
+            self._roots.add(index_path)
+            if version not in self._indexes:
+                self._indexes[version] = {
+                    "store": vector_store, "refs": 0, "root": index_path,
+                    "marker": register_reader(index_path, version),
+                }
+            self._current = version
+        self._collect()
+
+    def forget_index(self):
+        """Oublie la version courante (index retiré, voir versions.unpublish)"""
+        with self._index_lock:
+            self._current = None
+        self._collect()
+
+    def stats(self):
+        """Nombre de versions d'index en mémoire et de baux actifs"""
+        self._collect()
+        with self._index_lock:
+            stats = {
+                "models": len(self._embeddings),
+                "index_versions": len(self._indexes),
+                "leases": sum(entry["refs"] for entry in self._indexes.values()),
+            }
+        self._collect()
+        return stats
+
+    def _release_index(self, version):
+        # Peut être appelé par le ramasse-miettes dans un thread qui détient déjà
+        # _index_lock : empiler seulement, sans jamais attendre le verrou
+        self._released.append(version)
+        self._collect()
+
+    def _collect(self):
+        """Décompte les baux rendus, puis supprime les versions sans lecteur de la mémoire et du disque"""
+        if not self._index_lock.acquire(blocking=False):
+            return  # Le détenteur du verrou collectera en le rendant
+        try:
+            while self._released:
+                entry = self._indexes.get(self._released.popleft())
+                if entry is not None:
+                    entry["refs"] -= 1
+            stale = [v for v, entry in self._indexes.items() if entry["refs"] <= 0 and v != self._current]
+            markers = [self._indexes.pop(version)["marker"] for version in stale]
+            keep = {
+                root: [v for v, entry in self._indexes.items() if entry["root"] == root]
+                for root in self._roots
+            }
+        finally:
+            self._index_lock.release()
+        if stale:
+            # Fermer les fichiers (mémoire mappée, SQLite) avant de les supprimer ;
+            # hors verrou : les baux libérés par cette collecte sont simplement empilés
+            gc.collect()
+            for marker in markers:
+                release_reader(marker)
+        for root, versions in keep.items():
+            collect(root, keep=versions)
+        if self._released:
+            self._collect()
+
+
+# Registre unique pour le processus
+registry = ResourceRegistry()
@@ -0,0 +1,227 @@
+"""
+Partitionnement de l'index par source et recherche filtrée en parallèle.
+
+Chaque PDF forme un fragment (shard) : l'ensemble des positions FAISS de ses
+segments, avec leur page et l'année du document. Les filtres (sources,
+années, plage de pages) sont traduits en sélecteur d'identifiants FAISS
+(IDSelector) avant la recherche : FAISS ne calcule de distances que pour les
+segments retenus, au lieu de chercher dans tout l'index puis d'écarter les
+résultats.
+
+Les fragments retenus sont répartis en groupes de tailles comparables,
+cherchés en parallèle sur un pool de threads (FAISS libère le GIL pendant la
+recherche), puis les classements partiels sont fusionnés par tas.
+
+Une copie identique d'un PDF (manifest["files"][copie]["duplicate_of"]) n'a
+pas de segments à elle : elle est enregistrée comme alias du fragment de son
+original, et la filtrer interroge ce fragment. Les alias sont repris du
+manifeste à chaque chargement.
+
+Fichier du dossier d'index :
+    shards.npz   source et page de chaque position FAISS, année de chaque source
+"""
+
+import heapq
+import os
+import re
+from itertools import islice
+
+import numpy as np
+
+SHARDS_FILE = "shards.npz"
+
+# Année dans un nom de fichier (« policar-2022-... ») ou date AAAAMMJJ (« 20240305_walras »)
+_YEAR_RE = re.compile(r"(?<!\d)(19[5-9]\d|20[0-4]\d)(?!\d)")
+_DATE_RE = re.compile(r"(?<!\d)(19[5-9]\d|20[0-4]\d)(?=[01]\d[0-3]\d(?!\d))")
+
+
+def source_year(source, metadata=None):
+    """Année d'un document : d'après son nom, sinon sa date de création PDF (0 si inconnue)"""
+    for pattern in (_YEAR_RE, _DATE_RE):
+        match = pattern.search(source)
+        if match:
+            return int(match.group(1))
+    match = re.search(r"(19|20)\d{2}", str((metadata or {}).get("creationdate") or ""))
+    return int(match.group(0)) if match else 0
+
+
+class ShardMap:
+    """Source, page et année de chaque position FAISS ; un fragment par source"""
+
+    def __init__(self, sources, source_of, pages, years, aliases=None):
+        self.sources = list(sources)
+        self.source_of = np.asarray(source_of, dtype=np.int32)
+        self.pages = np.asarray(pages, dtype=np.int32)
+        self.years = np.asarray(years, dtype=np.int32)
+        # Positions regroupées par source (format CSR, comme les postings BM25)
+        counts = np.bincount(self.source_of, minlength=len(self.sources))
+        self._indptr = np.zeros(len(self.sources) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self._indptr[1:])
+        self._positions = np.argsort(self.source_of, kind="stable").astype(np.int64)
+        self._index = {source: i for i, source in enumerate(self.sources)}
+        # Copies identiques sans segments propres -> source indexée
+        self.aliases = {copy: original for copy, original in (aliases or {}).items() if original in self._index}
+
+    def __len__(self):
+        return len(self.source_of)
+
+    def sizes(self):
+        """Nombre de segments par source"""
+        return {source: int(self._indptr[i + 1] - self._indptr[i]) for i, source in enumerate(self.sources)}
+
+    def resolve(self, source):
+        """Source dont les segments représentent `source` (elle-même, ou l'original d'une copie)"""
+        return self.aliases.get(source, source)
+
+    def year(self, source):
+        """Année du document (0 si inconnue)"""
+        return int(self.years[self._index[self.resolve(source)]])
+
+    def page_range(self):
+        """(première, dernière) page connue, ou None"""
+        known = self.pages[self.pages >= 0]
+        return (int(known.min()), int(known.max())) if len(known) else None
+
+    @classmethod
+    def build(cls, documents, aliases=None):
+        """Construit la table à partir des Documents, dans l'ordre des positions FAISS
+
+        Args:
+            documents: Documents indexés, dans l'ordre des positions FAISS
+            aliases: Dict optionnel {copie: original} des copies identiques non indexées
+        """
+        index = {}
+        sources, years, source_of, pages = [], [], [], []
+        for doc in documents:
+            source = doc.metadata.get("source", "Inconnu")
+            i = index.get(source)
+            if i is None:
+                i = index[source] = len(sources)
+                sources.append(source)
+                years.append(source_year(source, doc.metadata))
+            source_of.append(i)
+            page = doc.metadata.get("page")
+            pages.append(page if isinstance(page, int) else -1)
+        return cls(sources, source_of, pages, years, aliases)
+
+    def select(self, sources=None, years=None, pages=None):
+        """Positions FAISS retenues par les filtres, fragment par fragment
+
+        Args:
+            sources: Noms des sources à interroger (None = toutes) ; une copie
+                sélectionne le fragment de son original
+            years: (min, max) inclus ; les documents d'année inconnue sont exclus
+            pages: (min, max) inclus, numérotation des métadonnées
+
+        Returns:
+            Dict {source: positions triées (int64)} des fragments non vides
+        """
+        if sources is None:
+            names = self.sources
+        else:
+            names = list(dict.fromkeys(self.resolve(s) for s in sources if self.resolve(s) in self._index))
+        selected = {}
+        for name in names:
+            i = self._index[name]
+            if years is not None and not years[0] <= self.years[i] <= years[1]:
+                continue
+            positions = self._positions[self._indptr[i]:self._indptr[i + 1]]
+            if pages is not None:
+                page = self.pages[positions]
+                positions = positions[(page >= pages[0]) & (page <= pages[1])]
+            if len(positions):
+                selected[name] = positions
+        return selected
+
+    def save(self, index_path):
+        """Sauvegarde la table dans index_path/shards.npz"""
+        tmp_path = os.path.join(index_path, SHARDS_FILE + ".tmp.npz")
+        np.savez(
+            tmp_path,
+            sources=np.array(self.sources, dtype=str),
+            source_of=self.source_of,
+            pages=self.pages,
+            years=self.years,
+        )
+        os.replace(tmp_path, os.path.join(index_path, SHARDS_FILE))
+
+    @classmethod
+    def load(cls, index_path, aliases=None):
+        """Charge la table sauvegardée (avec les alias donnés, voir build), ou None si elle n'existe pas"""
+        path = os.path.join(index_path, SHARDS_FILE)
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["sources"].tolist(), data["source_of"], data["pages"], data["years"], aliases)
+
+
+def group_shards(shards, groups):
+    """Répartit les fragments en au plus `groups` groupes de tailles comparables
+
+    Returns:
+        Liste de tableaux de positions, un par groupe
+    """
+    count = max(1, min(groups, len(shards)))
+    heap = [(0, g) for g in range(count)]
+    members = [[] for _ in range(count)]
+    # Plus gros fragments d'abord, chacun dans le groupe le moins chargé
+    for positions in sorted(shards.values(), key=len, reverse=True):
+        size, g = heapq.heappop(heap)
+        members[g].append(positions)
+        heapq.heappush(heap, (size + len(positions), g))
+    return [np.concatenate(m) for m in members if m]
+
+
+def _search_parameters(index, selector, k):
+    import faiss
+
+    # Les paramètres passés à la recherche remplacent ceux de l'index : les reprendre
+    if hasattr(index, "hnsw"):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=max(index.hnsw.efSearch, k))
+    if hasattr(index, "nprobe"):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+    return faiss.SearchParameters(sel=selector)
+
+
+def search_positions(index, vectors, k, positions):
+    """Recherche des k plus proches voisins parmi les seules positions données"""
+    import faiss
+
+    selector = faiss.IDSelectorBatch(positions)
+    return index.search(vectors, k, params=_search_parameters(index, selector, k))
+
+
+def fan_out_search(index, vectors, k, shards, executor=None, groups=4):
+    """Cherche dans les fragments sélectionnés en parallèle puis fusionne les k meilleurs
+
+    Args:
+        index: Index FAISS (exact ou approché)
+        vectors: Vecteurs des requêtes (float32, q x d)
+        k: Nombre de résultats par requête
+        shards: Dict {source: positions} (ShardMap.select)
+        executor: Pool de threads (None = recherche séquentielle)
+        groups: Nombre maximal de recherches parallèles
+
+    Returns:
+        Pour chaque requête, liste des positions FAISS, de la plus proche à la moins proche
+    """
+    import faiss
+
+    if not shards:
+        return [[] for _ in range(len(vectors))]
+    parts = group_shards(shards, groups)
+    if executor is None or len(parts) == 1:
+        results = [search_positions(index, vectors, k, part) for part in parts]
+    else:
+        results = list(executor.map(lambda part: search_positions(index, vectors, k, part), parts))
+
+    # Distances L2 croissantes ; produit scalaire : scores décroissants
+    sign = -1.0 if index.metric_type == faiss.METRIC_INNER_PRODUCT else 1.0
+    merged = []
+    for q in range(len(vectors)):
+        runs = [
+            [(sign * float(d), int(p)) for d, p in zip(distances[q], positions[q]) if p != -1]
+            for distances, positions in results
+        ]
+        merged.append([p for _, p in islice(heapq.merge(*runs), k)])
+    return merged
@@ -0,0 +1,46 @@
+import hashlib
+import os
+import shutil
+import sys
+
+import numpy as np
+import pytest
+
+# Modules du projet à la racine du dépôt (pas de paquet installable)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+SAMPLE_PDFS = ["20240305_walras.pdf", "Martine_Storti_Pour_un_feminisme_univers.pdf"]
+
+
+def fake_vector(text, dim=64):
+    """Sac de mots haché : vecteur déterministe sans modèle à télécharger"""
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in text.lower().split():
+        vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % dim] += 1
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).tolist()
+
+
+@pytest.fixture
+def indexing_app(tmp_path, monkeypatch):
+    """Module app prêt à indexer deux petits PDFs de data/ dans tmp_path, avec de faux embeddings"""
+    from langchain_core.embeddings import Embeddings
+
+    import app
+    from embedding_cache import CachedEmbeddings, EmbeddingCache
+
+    class FakeEmbeddings(Embeddings):
+        def embed_documents(self, texts):
+            return [fake_vector(text) for text in texts]
+
+        def embed_query(self, text):
+            return fake_vector(text)
+
+    os.makedirs(tmp_path / "data")
+    for name in SAMPLE_PDFS:
+        shutil.copy(os.path.join(ROOT, "data", name), tmp_path / "data" / name)
+    monkeypatch.chdir(tmp_path)  # Chemins de app relatifs au dossier courant
+    monkeypatch.setattr(app, "EXTRACTION_WORKERS", 1)
+    embeddings = CachedEmbeddings(FakeEmbeddings(), EmbeddingCache(str(tmp_path / "embedding_cache"), "fake", normalize=True))
+    monkeypatch.setattr(app, "get_embeddings", lambda: embeddings)
+    return app
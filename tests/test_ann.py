@@ -0,0 +1,40 @@
+import json
+
+import faiss
+import numpy as np
+
+import ann
+import embeddings
+from ann import rescore
+from bench import DEFAULT_QUERIES
+
+
+def test_rescore_reorders_candidates_by_exact_distance():
+    vectors = np.array([[0, 0], [1, 0], [2, 0], [3, 0]], dtype=np.float32)
+    index = faiss.IndexFlatL2(2)
+    index.add(vectors)
+    queries = np.array([[2.9, 0], [0.1, 0]], dtype=np.float32)
+    result = rescore(index, queries, [[0, 3, 2, -1], [-1, -1, -1, -1]], k=2)
+    assert result.tolist() == [[3, 2], [-1, -1]]
+
+
+def test_report_embeds_bench_questions_and_reports_disk_size(indexing_app, monkeypatch, tmp_path, capsys):
+    indexing_app.index_documents()
+    calls = []
+
+    def create_embeddings(backend, model_name, **kwargs):
+        calls.append((backend, model_name))
+        return indexing_app.get_embeddings()
+
+    monkeypatch.setattr(embeddings, "create_embeddings", create_embeddings)
+    output = tmp_path / "rapport.json"
+    assert ann.main(["report", "--index", indexing_app.FAISS_PATH, "--types", "Flat,SQ8", "--json", str(output)]) == 0
+    # Questions de bench.py, vectorisées par le modèle du manifeste (et non des segments du corpus)
+    assert calls == [("torch", indexing_app.EMBEDDING_MODEL)]
+    assert f"{len(DEFAULT_QUERIES)} requêtes" in capsys.readouterr().out
+
+    flat, sq8, sq8_rescored = json.loads(output.read_text(encoding="utf-8"))
+    assert flat["recall@10"] == 1.0 and sq8_rescored["rescore"] == 4
+    # Moins de mémoire, mais plus de disque : l'index exact reste à côté
+    assert sq8["bytes_per_vector"] < flat["bytes_per_vector"]
+    assert sq8["disk_bytes"] == flat["disk_bytes"] + sq8["size_bytes"] > flat["disk_bytes"]
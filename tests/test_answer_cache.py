@@ -0,0 +1,59 @@
+import numpy as np
+
+import answer_cache
+from answer_cache import AnswerCache
+
+
+def unit(*values):
+    vector = np.array(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_similarity_threshold_and_mode():
+    cache = AnswerCache(threshold=0.95)
+    cache.store("Qui était Walras ?", unit(1, 0, 0), "question", "v1", "Un économiste.", [])
+    hit = cache.lookup(unit(1, 0.1, 0), "question", "v1")
+    assert hit["answer"] == "Un économiste." and hit["similarity"] >= 0.95
+    assert cache.lookup(unit(1, 1, 0), "question", "v1") is None  # cosinus 0,71
+    assert cache.lookup(unit(1, 0, 0), "redaction", "v1") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
+
+
+def test_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache.time, "time", lambda: now[0])
+    cache = AnswerCache(ttl_seconds=60)
+    cache.store("q", unit(1, 0), "question", "v1", "réponse", [])
+    now[0] += 59
+    assert cache.lookup(unit(1, 0), "question", "v1") is not None
+    now[0] += 2
+    assert cache.lookup(unit(1, 0), "question", "v1") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_entries_match_their_index_version_only():
+    cache = AnswerCache()
+    cache.store("q", unit(1, 0), "question", "v1", "ancienne", [])
+    cache.store("q", unit(1, 0), "question", "v2", "nouvelle", [])
+    # Pendant la bascule, chaque version garde ses réponses
+    assert cache.lookup(unit(1, 0), "question", "v1")["answer"] == "ancienne"
+    assert cache.lookup(unit(1, 0), "question", "v2")["answer"] == "nouvelle"
+
+
+def test_versions_older_than_the_two_most_recent_are_dropped():
+    cache = AnswerCache(max_versions=2)
+    for version in ("v1", "v2"):
+        cache.store("q", unit(1, 0), "question", version, version, [])
+    cache.lookup(unit(1, 0), "question", "v3")
+    assert cache.stats()["entries"] == 1
+    assert cache.lookup(unit(1, 0), "question", "v2")["answer"] == "v2"
+    # v1 a été retirée : une session restée dessus ne retrouve plus sa réponse
+    assert cache.lookup(unit(1, 0), "question", "v1") is None
+
+
+def test_max_entries_evicts_oldest():
+    cache = AnswerCache(max_entries=2)
+    for i, vector in enumerate((unit(1, 0, 0), unit(0, 1, 0), unit(0, 0, 1))):
+        cache.store(f"q{i}", vector, "question", "v1", f"r{i}", [])
+    assert cache.lookup(unit(1, 0, 0), "question", "v1") is None
+    assert cache.lookup(unit(0, 0, 1), "question", "v1")["answer"] == "r2"
@@ -0,0 +1,57 @@
+import asyncio
+import json
+
+from batch_query import TokenRateLimiter, completed_ids, load_questions, question_id
+
+
+def test_repeated_questions_share_one_id(tmp_path):
+    path = tmp_path / "questions.txt"
+    path.write_text("Qui était Walras ?\nredaction\tRédigez une introduction\nQui était Walras ?\n", encoding="utf-8")
+    items = load_questions(str(path))
+    assert [item["question"] for item in items] == ["Qui était Walras ?", "Rédigez une introduction"]
+    assert items[0]["id"] == question_id("Qui était Walras ?", "question")
+    # Même texte dans un autre mode : autre question
+    assert items[1]["id"] == question_id("Rédigez une introduction", "redaction") != question_id("Rédigez une introduction", "question")
+
+
+def test_jsonl_explicit_ids(tmp_path):
+    path = tmp_path / "questions.jsonl"
+    path.write_text(
+        json.dumps({"question": "A ?", "id": 7}) + "\n" + json.dumps({"question": "B ?", "mode": "redaction"}) + "\n",
+        encoding="utf-8",
+    )
+    assert [(i["id"], i["mode"]) for i in load_questions(str(path))] == [("7", "question"), (question_id("B ?", "redaction"), "redaction")]
+
+
+def test_resume_after_lines_inserted(tmp_path):
+    questions = tmp_path / "questions.txt"
+    output = tmp_path / "reponses.jsonl"
+    questions.write_text("Première ?\nDeuxième ?\n", encoding="utf-8")
+    first = load_questions(str(questions))
+    with open(output, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({"id": first[0]["id"], "answer": "ok"}) + "\n")
+        f.write(json.dumps({"id": first[1]["id"], "answer": None, "error": "429"}) + "\n")
+        f.write('{"id": "tronqu')  # Arrêt brutal en cours d'écriture
+
+    # Questions insérées avant et entre les lignes déjà traitées
+    questions.write_text("Nouvelle ?\nPremière ?\nAutre ?\nDeuxième ?\n", encoding="utf-8")
+    done = completed_ids(str(output))
+    pending = [item["question"] for item in load_questions(str(questions)) if item["id"] not in done]
+    assert pending == ["Nouvelle ?", "Autre ?", "Deuxième ?"]
+
+
+def test_token_rate_limiter():
+    async def scenario():
+        limiter = TokenRateLimiter(6000)  # 100 tokens par seconde
+        assert await limiter.acquire(5900) == 5900
+        limiter.adjust(5900, 5000)  # Usage réel inférieur : 900 tokens rendus
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await limiter.acquire(1000)  # Disponibles : 1000
+        immediate = loop.time() - start
+        start = loop.time()
+        await limiter.acquire(20)  # Attend le remplissage (~0,2 s)
+        return immediate, loop.time() - start
+
+    immediate, waited = asyncio.run(scenario())
+    assert immediate < 0.05 and 0.1 < waited < 1.0
@@ -0,0 +1,34 @@
+from bm25 import BM25Index, reciprocal_rank_fusion, tokenize
+
+CHUNKS = [
+    ("c0", "Le marché du travail et les salaires en France"),
+    ("c1", "La théorie de l'équilibre général de Walras"),
+    ("c2", "Walras et l'équilibre : prix, marché et concurrence"),
+    ("c3", "Histoire du wokisme dans le débat public"),
+]
+
+
+def test_tokenize_strips_accents_and_stopwords():
+    assert tokenize("L'Équilibre général et les prix") == ["equilibre", "general", "prix"]
+
+
+def test_bm25_ranks_matching_chunks():
+    index = BM25Index.build(CHUNKS)
+    results = index.search("équilibre Walras marché", k=3)
+    assert [cid for cid, _ in results][:2] == ["c2", "c1"]
+    assert all(score > 0 for _, score in results)
+    assert index.search("inconnu") == []
+
+
+def test_bm25_save_load(tmp_path):
+    index = BM25Index.build(CHUNKS)
+    index.save(str(tmp_path))
+    loaded = BM25Index.load(str(tmp_path))
+    assert loaded.search("équilibre Walras marché", k=3) == index.search("équilibre Walras marché", k=3)
+    assert BM25Index.load(str(tmp_path / "absent")) is None
+
+
+def test_reciprocal_rank_fusion():
+    # b est deuxième puis premier : devant a (premier puis absent) et c
+    assert reciprocal_rank_fusion([["a", "b", "c"], ["b", "c"]]) == ["b", "c", "a"]
+    assert reciprocal_rank_fusion([]) == []
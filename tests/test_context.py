@@ -0,0 +1,90 @@
+import numpy as np
+from langchain_core.documents import Document
+
+from context import count_tokens, expand_to_parents, merge_overlapping, pack_context
+
+
+def doc(cid, text, source="a.pdf", page=0, **metadata):
+    return Document(id=cid, page_content=text, metadata=dict(metadata, source=source, page=page))
+
+
+def test_merge_overlapping_same_page():
+    first = doc("c1", "Le début du passage, puis un chevauchement assez long pour compter")
+    second = doc("c2", "un chevauchement assez long pour compter, et la suite du passage")
+    other = doc("c3", "un chevauchement assez long pour compter", page=1)
+    merged = merge_overlapping([(0, first), (1, second), (2, other)])
+    assert [(rank, count) for rank, _, count in merged] == [(0, 2), (2, 1)]
+    text = merged[0][1].page_content
+    assert text.startswith("Le début") and text.endswith("la suite du passage") and text.count("chevauchement") == 1
+    assert merged[0][1].metadata["chunk_ids"] == ["c1", "c2"]
+    assert "chunk_ids" not in first.metadata
+
+
+def test_expand_to_parents_once_per_parent():
+    parents = {
+        "p1": doc("p1", "Parent un", also_in=[{"source": "x.pdf", "page": 1}]),
+        "p2": doc("p2", "Parent deux"),
+    }
+    children = [
+        (0, doc("c1", "enfant 1", parent_id="p1")),
+        (1, doc("c2", "enfant 2", parent_id="p2")),
+        (2, doc("c3", "enfant 3", parent_id="p1", also_in=[{"source": "y.pdf", "page": 2}])),
+        (3, doc("c4", "orphelin", parent_id="absent")),
+    ]
+    expanded = expand_to_parents(children, parents)
+    assert [(rank, d.id) for rank, d in expanded] == [(0, "p1"), (1, "p2"), (3, "c4")]
+    assert expanded[0][1].metadata["also_in"] == [{"source": "x.pdf", "page": 1}, {"source": "y.pdf", "page": 2}]
+    # Le parent de la docstore n'est pas modifié
+    assert parents["p1"].metadata["also_in"] == [{"source": "x.pdf", "page": 1}]
+
+
+def test_pack_context_budget_and_order():
+    docs = [doc(f"c{i}", f"Passage numéro {i} " * 20, page=i) for i in range(4)]
+    vectors = np.eye(4, dtype=np.float32)
+    per_doc = count_tokens(docs[0].page_content)
+    packed, report = pack_context(docs, np.ones(4), vectors, token_budget=2 * per_doc, lambda_mult=1.0)
+    assert [d.id for d in packed] == ["c0", "c1"]
+    assert report["passages"] == 2 and report["over_budget"] == 2 and report["truncated"] == 0
+    assert report["tokens_after"] == 2 * per_doc
+    assert report["tokens_saved"] == report["tokens_before"] - report["tokens_after"]
+
+    packed, report = pack_context(docs, np.ones(4), vectors, token_budget=10 * per_doc, max_passages=3)
+    assert len(packed) == 3 and report["over_budget"] == 1
+
+
+def test_pack_context_truncates_oversized_first_passage():
+    long = doc("c0", "mot " * 500)
+    packed, report = pack_context([long], np.ones(2), np.ones((1, 2)), token_budget=50)
+    assert report["truncated"] == 1 and report["tokens_after"] <= 50
+    assert long.page_content.startswith(packed[0].page_content)
+    assert packed[0].metadata["truncated"] and "truncated" not in long.metadata
+
+
+def test_pack_context_keeps_citations_of_duplicates():
+    shared = {"source": "b.pdf", "page": 3}
+    docs = [
+        doc("c0", "Même passage dans deux fichiers", source="a.pdf", page=1),
+        Document(id="c1", page_content="Même passage dans deux fichiers", metadata=shared),
+        doc("c2", "Autre chose", source="c.pdf"),
+    ]
+    vectors = np.array([[1, 0, 0], [1, 0, 0.001], [0, 1, 0]], dtype=np.float32)
+    packed, report = pack_context(docs, np.array([1, 0.5, 0]), vectors, token_budget=1000)
+    assert report["duplicates"] == 1 and len(packed) == 2
+    kept = next(d for d in packed if d.page_content.startswith("Même"))
+    other = {"b.pdf": {"source": "a.pdf", "page": 1}, "a.pdf": shared}[kept.metadata["source"]]
+    assert kept.metadata["also_in"] == [other]
+    # Métadonnées d'origine (partagées avec la docstore) intactes
+    assert "also_in" not in docs[0].metadata and "also_in" not in shared
+
+
+def test_pack_context_parents_share_budget():
+    parents = {"p1": doc("p1", "Texte parent " * 10)}
+    children = [doc("c1", "enfant un", parent_id="p1"), doc("c2", "enfant deux", parent_id="p1")]
+    packed, report = pack_context(children, np.ones(2), np.eye(2), token_budget=1000, parents=parents)
+    assert [d.id for d in packed] == ["p1"]
+    assert report["tokens_after"] == count_tokens(parents["p1"].page_content)
+
+
+def test_pack_context_empty():
+    packed, report = pack_context([], np.ones(2), np.zeros((0, 2)), token_budget=100)
+    assert packed == [] and report["passages"] == 0 and report["tokens_saved"] == 0
@@ -0,0 +1,104 @@
+import shutil
+
+from langchain_core.documents import Document
+
+from dedup import ChunkDeduplicator, citations, duplicate_files, files_to_requeue
+from manifest import load_manifest
+
+
+def entry(sha, **extra):
+    return dict({"sha256": sha, "size": 1, "mtime": 0.0}, **extra)
+
+
+def test_duplicate_files_prefers_indexed_then_plain_name():
+    fingerprints = {"article.pdf": entry("x"), "article (1).pdf": entry("x"), "autre.pdf": entry("y")}
+    assert duplicate_files(fingerprints) == {"article (1).pdf": "article.pdf"}
+    assert duplicate_files(fingerprints, preferred={"article (1).pdf"}) == {"article.pdf": "article (1).pdf"}
+
+
+def test_requeue_copy_whose_original_changed_status():
+    # La copie devient l'original : son statut de copie change
+    previous = {"b.pdf": entry("x", duplicate_of="a.pdf")}
+    assert files_to_requeue(previous, ["b.pdf"], {}, ["a.pdf"]) == ["b.pdf"]
+
+
+def test_requeue_follows_merged_segments_transitively():
+    previous = {
+        "b.pdf": entry("2", dedup_sources=["a.pdf"]),
+        "c.pdf": entry("3", dedup_sources=["b.pdf"]),
+        "d.pdf": entry("4"),
+    }
+    assert files_to_requeue(previous, ["b.pdf", "c.pdf", "d.pdf"], {}, ["a.pdf"]) == ["b.pdf", "c.pdf"]
+
+
+def test_requeue_nothing_when_unaffected():
+    previous = {"b.pdf": entry("2", dedup_sources=["c.pdf"]), "c.pdf": entry("3")}
+    assert files_to_requeue(previous, ["b.pdf", "c.pdf"], {}, ["a.pdf"]) == []
+
+
+def chunk(text, source):
+    return Document(page_content=text, metadata={"source": source})
+
+
+PASSAGE = (
+    "Léon Walras publie en 1874 les Éléments d'économie politique pure, où il pose "
+    "les équations de l'équilibre général d'un système de marchés interdépendants "
+    "et décrit le tâtonnement par lequel un commissaire-priseur ajuste les prix."
+)
+
+
+def test_chunk_deduplicator_find_and_filter():
+    dedup = ChunkDeduplicator()
+    assert dedup.check("c0", chunk(PASSAGE, "a.pdf")) is None
+    # Quasi-doublon : même passage, un mot de plus en fin de segment
+    near = PASSAGE + " Lausanne"
+    assert dedup.find(dedup.hasher.signature(near)) == "c0"
+    assert dedup.find(dedup.hasher.signature("Pareto définit l'optimum qui porte son nom.")) is None
+
+    dropped = []
+    kept = list(dedup.filter(
+        [(chunk(near, "b.pdf"), "c1"), (chunk("Un tout autre passage sur Pareto.", "b.pdf"), "c2")],
+        lambda doc, cid, canonical: dropped.append((cid, canonical)),
+    ))
+    assert [cid for _, cid in kept] == ["c2"] and dropped == [("c1", "c0")]
+    assert len(dedup) == 2 and dedup.source("c0") == "a.pdf"
+
+
+def test_chunk_deduplicator_remove_and_retain():
+    dedup = ChunkDeduplicator.build([("c0", chunk(PASSAGE, "a.pdf")), ("c1", chunk("Un autre passage.", "b.pdf"))])
+    dedup.remove(["c0"])
+    signature = dedup.hasher.signature(PASSAGE)
+    assert dedup.find(signature) is None and len(dedup) == 1
+    # Une fois l'original retiré, le passage redevient un nouveau segment
+    assert dedup.check("c2", chunk(PASSAGE, "b.pdf")) is None
+    dedup.retain(["c2"])
+    assert len(dedup) == 1 and dedup.find(signature) == "c2"
+
+
+def test_chunk_deduplicator_save_load(tmp_path):
+    dedup = ChunkDeduplicator.build([("c0", chunk(PASSAGE, "a.pdf")), ("c1", chunk("Un autre passage.", None))])
+    dedup.remove(["c1"])
+    dedup.save(str(tmp_path))
+    loaded = ChunkDeduplicator.load(str(tmp_path))
+    assert len(loaded) == 1 and loaded.source("c0") == "a.pdf"
+    assert loaded.find(loaded.hasher.signature(PASSAGE)) == "c0"
+    # Signatures calculées avec d'autres paramètres : inutilisables
+    assert ChunkDeduplicator.load(str(tmp_path), num_perm=64) is None
+    assert ChunkDeduplicator.load(str(tmp_path / "absent")) is None
+
+
+def test_file_level_copy_tagged_duplicate_of(indexing_app):
+    shutil.copy("data/20240305_walras.pdf", "data/20240305_walras (1).pdf")
+    vector_store = indexing_app.index_documents()
+    files = load_manifest(indexing_app.resolve_index_path(indexing_app.FAISS_PATH))["files"]
+    assert files["20240305_walras (1).pdf"]["duplicate_of"] == "20240305_walras.pdf"
+    assert files["20240305_walras (1).pdf"]["chunk_ids"] == []
+    # Les segments de l'original citent la copie
+    docs = [doc for _, doc in indexing_app.stored_documents(vector_store)]
+    original = [doc for doc in docs if doc.metadata["source"] == "20240305_walras.pdf"]
+    assert original and all(
+        any(c.get("source") == "20240305_walras (1).pdf" for c in citations(doc)) for doc in original
+    )
+    assert not any(doc.metadata["source"] == "20240305_walras (1).pdf" for doc in docs)
+    # Filtrer sur la copie interroge les segments de l'original
+    assert list(vector_store.shards.select(sources=["20240305_walras (1).pdf"])) == ["20240305_walras.pdf"]
@@ -0,0 +1,126 @@
+import multiprocessing
+import zlib
+
+import numpy as np
+
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+
+
+def vectors(texts, dim=8):
+    # Vecteur déterministe par texte : relu à l'identique quelle que soit sa ligne
+    return np.array([np.random.default_rng(zlib.crc32(t.encode())).random(dim) for t in texts], dtype=np.float32)
+
+
+def open_cache(path, max_bytes=1024 * 1024):
+    return EmbeddingCache(str(path), "modele", normalize=True, max_bytes=max_bytes)
+
+
+def slots(cache):
+    return dict(cache._db.execute("SELECT key, slot FROM entries").fetchall())
+
+
+def test_round_trip(tmp_path):
+    cache = open_cache(tmp_path)
+    texts = ["un", "deux", "trois"]
+    assert cache.get_many(texts) == [None, None, None]
+    cache.put_many(texts, vectors(texts))
+    found = cache.get_many(["deux", "quatre", "un"])
+    assert np.array_equal(found[0], vectors(["deux"])[0]) and found[1] is None
+    assert np.array_equal(found[2], vectors(["un"])[0])
+    assert cache.stats()["entries"] == 3 and cache.stats()["hits"] == 2
+
+
+def test_two_instances_get_disjoint_slots(tmp_path):
+    first, second = open_cache(tmp_path), open_cache(tmp_path)
+    texts_a = [f"a{i}" for i in range(20)]
+    texts_b = [f"b{i}" for i in range(20)]
+    # Écritures entrelacées, chaque instance ignorant les lignes prises par l'autre
+    for i in range(0, 20, 5):
+        first.put_many(texts_a[i:i + 5], vectors(texts_a[i:i + 5]))
+        second.put_many(texts_b[i:i + 5], vectors(texts_b[i:i + 5]))
+    taken = list(slots(first).values())
+    assert len(taken) == len(set(taken)) == 40
+    for cache in (first, second):
+        found = cache.get_many(texts_a + texts_b)
+        assert np.array_equal(np.stack(found), vectors(texts_a + texts_b))
+
+
+def _fill(path, prefix):
+    cache = open_cache(path)
+    for i in range(0, 200, 10):
+        texts = [f"{prefix}{j}" for j in range(i, i + 10)]
+        cache.put_many(texts, vectors(texts))
+
+
+def test_processes_get_disjoint_slots(tmp_path):
+    processes = [multiprocessing.Process(target=_fill, args=(tmp_path, p)) for p in "xyz"]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    cache = open_cache(tmp_path)
+    texts = [f"{p}{j}" for p in "xyz" for j in range(200)]
+    assert len(set(slots(cache).values())) == 600
+    assert np.array_equal(np.stack(cache.get_many(texts)), vectors(texts))
+
+
+def test_lru_eviction_to_max_bytes(tmp_path):
+    row = 8 * 4
+    cache = open_cache(tmp_path, max_bytes=10 * row)
+    texts = [f"t{i}" for i in range(10)]
+    cache.put_many(texts, vectors(texts))
+    cache.get_many(texts[:3])  # Les plus récemment utilisés
+    cache.put_many(["n1", "n2", "n3"], vectors(["n1", "n2", "n3"]))
+    found = cache.get_many(texts + ["n1", "n2", "n3"])
+    kept = [t for t, v in zip(texts + ["n1", "n2", "n3"], found) if v is not None]
+    assert len(kept) == 10 and set(texts[:3]) <= set(kept) and {"n1", "n2", "n3"} <= set(kept)
+    # Lignes évincées réutilisées : le fichier ne dépasse pas la taille maximale
+    assert cache.stats()["bytes"] <= 10 * row
+
+
+def test_shrink_on_open_and_compact(tmp_path):
+    row = 8 * 4
+    texts = [f"t{i}" for i in range(40)]
+    cache = open_cache(tmp_path)
+    cache.put_many(texts, vectors(texts))
+    cache.get_many(texts[30:])
+    assert cache.stats()["bytes"] == 40 * row
+
+    # Taille maximale réduite : les entrées les plus récentes sont gardées, le fichier tronqué
+    smaller = open_cache(tmp_path, max_bytes=10 * row)
+    assert smaller.stats()["entries"] == 10 and smaller.stats()["bytes"] == 10 * row
+    assert np.array_equal(np.stack(smaller.get_many(texts[30:])), vectors(texts[30:]))
+
+    smaller._db.execute("BEGIN IMMEDIATE")
+    smaller._evict(4)
+    smaller._db.execute("COMMIT")
+    smaller.compact()
+    assert smaller.stats()["bytes"] == 4 * row
+    found = [v for v in smaller.get_many(texts[30:]) if v is not None]
+    assert len(found) == 4
+    assert max(slots(smaller).values()) == 3
+    for text in texts[30:]:
+        vector = smaller.get_many([text])[0]
+        assert vector is None or np.array_equal(vector, vectors([text])[0])
+
+
+class Counting:
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return vectors(texts).tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def test_cached_embeddings_compute_only_missing(tmp_path):
+    model = Counting()
+    embeddings = CachedEmbeddings(model, open_cache(tmp_path))
+    embeddings.embed_documents(["a", "b", "a"])
+    embeddings.embed_documents(["b", "c"])
+    embeddings.embed_query("a")
+    assert model.calls == [["a", "b"], ["c"]]
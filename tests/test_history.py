@@ -0,0 +1,63 @@
+import os
+import time
+
+from langchain_core.documents import Document
+
+from history import ChatHistory, prune_history, ref_citations, source_refs
+
+
+def fill(history, count):
+    for i in range(count):
+        history.append("user" if i % 2 == 0 else "assistant", f"message {i}")
+
+
+def contents(messages):
+    return [m["content"] for m in messages]
+
+
+def test_window_in_memory(tmp_path):
+    history = ChatHistory("alice", max_messages=10, history_dir=str(tmp_path))
+    fill(history, 4)
+    assert history.spilled == 0 and not os.path.exists(history.path)
+    assert contents(history.window(1, 3)) == ["message 1", "message 2"]
+
+
+def test_window_with_spill_over(tmp_path):
+    history = ChatHistory("alice", max_messages=3, history_dir=str(tmp_path))
+    fill(history, 8)
+    assert len(history) == 8 and history.spilled == 5 and len(history.messages) == 3
+    # Fenêtres dans le journal, à cheval sur le journal et la mémoire, en mémoire
+    assert contents(history.window(1, 4)) == ["message 1", "message 2", "message 3"]
+    assert contents(history.window(3, 7)) == ["message 3", "message 4", "message 5", "message 6"]
+    assert contents(history.window(6, 20)) == ["message 6", "message 7"]
+    assert contents(history.window(-5, 100)) == [f"message {i}" for i in range(8)]
+    assert history.window(8, 10) == []
+
+
+def test_sources_are_compact_refs(tmp_path):
+    history = ChatHistory("alice", max_messages=1, history_dir=str(tmp_path))
+    doc = Document(id="c1", page_content="texte", metadata={
+        "source": "a.pdf", "page": 2, "also_in": [{"source": "b.pdf", "page": 4}],
+    })
+    history.append("assistant", "réponse", sources=[doc])
+    history.append("user", "suite")
+    message = history.window(0, 1)[0]
+    assert message["sources"] == source_refs([doc]) == [
+        {"ids": ["c1"], "source": "a.pdf", "page": 2, "also_in": [{"source": "b.pdf", "page": 4}]}
+    ]
+    assert ref_citations(message["sources"][0]) == [{"source": "a.pdf", "page": 2}, {"source": "b.pdf", "page": 4}]
+
+
+def test_prune_history(tmp_path):
+    current = ChatHistory("alice", max_messages=1, history_dir=str(tmp_path))
+    fill(current, 2)
+    old = tmp_path / "bob" / "ancienne.jsonl"
+    old.parent.mkdir()
+    old.write_text("{}\n")
+    week_ago = time.time() - 8 * 86400
+    for path in (str(old), current.path):
+        os.utime(path, (week_ago, week_ago))
+
+    assert prune_history(str(tmp_path), max_age_days=0) == 0
+    assert prune_history(str(tmp_path), max_age_days=7, keep=[current.path]) == 1
+    assert not (tmp_path / "bob").exists() and os.path.exists(current.path)
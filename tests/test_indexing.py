@@ -0,0 +1,68 @@
+import shutil
+
+import pytest
+
+import docstore
+from indexing import checkpoint_path
+from manifest import load_manifest
+
+FIRST, SECOND = "20240305_walras.pdf", "Martine_Storti_Pour_un_feminisme_univers.pdf"
+FAIL_AFTER = 24  # Trois lots de 8 : les 19 segments du premier PDF et le début du second
+
+
+def stored_ids(vector_store):
+    ids = list(vector_store.index_to_docstore_id.values())
+    assert vector_store.index.ntotal == len(ids) == len(set(ids))  # Aucun segment en double
+    return set(ids)
+
+
+def test_resume_after_failure(indexing_app, monkeypatch):
+    app = indexing_app
+    monkeypatch.setattr(app, "INDEX_BATCH_SIZE", 8)
+    monkeypatch.setattr(app, "INDEX_CHECKPOINT_EVERY", 1)
+    model = app.get_embeddings().embeddings
+    embed_documents = model.embed_documents
+    embedded = []
+
+    def failing(texts):
+        # Panne durable une fois le premier PDF vectorisé (l'essai et sa reprise échouent)
+        if len(embedded) >= FAIL_AFTER:
+            raise RuntimeError("panne simulée")
+        embedded.extend(texts)
+        return embed_documents(texts)
+
+    monkeypatch.setattr(model, "embed_documents", failing)
+    assert app.index_documents() is None
+    checkpoint = load_manifest(checkpoint_path(app.INDEX_JOB_PATH))
+    assert checkpoint is not None and FIRST in checkpoint["files"] and SECOND not in checkpoint["files"]
+
+    monkeypatch.setattr(model, "embed_documents", embed_documents)
+    resumed = stored_ids(app.index_documents())
+    files = load_manifest(app.resolve_index_path(app.FAISS_PATH))["files"]
+    assert resumed == {cid for entry in files.values() for cid in entry["chunk_ids"]}
+
+    # Même index qu'une indexation complète sans panne
+    shutil.rmtree(app.FAISS_PATH)
+    clean = stored_ids(app.index_documents())
+    assert resumed == clean
+
+
+@pytest.mark.parametrize("growth", [0.25, 1.0])
+def test_checkpoint_spacing_grows_with_index(indexing_app, monkeypatch, growth):
+    app = indexing_app
+    monkeypatch.setattr(app, "INDEX_BATCH_SIZE", 8)
+    monkeypatch.setattr(app, "INDEX_CHECKPOINT_EVERY", 1)
+    monkeypatch.setattr(app, "INDEX_CHECKPOINT_GROWTH", growth)
+    save_store = docstore.save_store
+    sizes = []
+
+    def recording(vector_store, path, *args, **kwargs):
+        if path == checkpoint_path(app.INDEX_JOB_PATH):
+            sizes.append(vector_store.index.ntotal)
+        return save_store(vector_store, path, *args, **kwargs)
+
+    monkeypatch.setattr(docstore, "save_store", recording)
+    total = app.index_documents().index.ntotal
+    assert len(sizes) >= 2 and sizes[-1] <= total
+    for previous, size in zip(sizes, sizes[1:]):
+        assert size - previous >= growth * previous
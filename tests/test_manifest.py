@@ -0,0 +1,28 @@
+from manifest import diff_files, file_sha256, fingerprint_files
+
+
+def entry(sha, **extra):
+    return dict({"sha256": sha, "size": 1, "mtime": 0.0}, **extra)
+
+
+def test_diff_files():
+    previous = {"a.pdf": entry("1"), "b.pdf": entry("2"), "c.pdf": entry("3")}
+    current = {"a.pdf": entry("1"), "b.pdf": entry("20"), "d.pdf": entry("4")}
+    assert diff_files(previous, current) == (["d.pdf"], ["b.pdf"], ["c.pdf"], ["a.pdf"])
+
+
+def test_diff_files_first_run():
+    assert diff_files({}, {"a.pdf": entry("1")}) == (["a.pdf"], [], [], [])
+
+
+
+
+def test_fingerprint_files_rehashes_only_changed_files(tmp_path):
+    (tmp_path / "a.pdf").write_bytes(b"contenu")
+    first = fingerprint_files(str(tmp_path), ["a.pdf"])
+    assert first["a.pdf"]["sha256"] == file_sha256(str(tmp_path / "a.pdf"))
+    # Taille et date inchangées : empreinte reprise du manifeste précédent
+    previous = {"a.pdf": dict(first["a.pdf"], sha256="ancienne")}
+    assert fingerprint_files(str(tmp_path), ["a.pdf"], previous)["a.pdf"]["sha256"] == "ancienne"
+    (tmp_path / "a.pdf").write_bytes(b"contenu modifie")
+    assert fingerprint_files(str(tmp_path), ["a.pdf"], previous)["a.pdf"]["sha256"] == file_sha256(str(tmp_path / "a.pdf"))
@@ -0,0 +1,55 @@
+import threading
+
+from langchain_core.documents import Document
+
+from rerank import CrossEncoderReranker
+
+
+class SlowModel:
+    """Cross-encoder factice : note la longueur du texte, après feu vert"""
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def predict(self, pairs, **kwargs):
+        self.release.wait(5)
+        return [len(text) for _, text in pairs]
+
+
+def candidates(count=50):
+    return [Document(page_content="x" * (i + 1), metadata={"rank": i}) for i in range(count)]
+
+
+def reranker(workers=1):
+    reranker = CrossEncoderReranker("factice", workers=workers)
+    reranker._model = SlowModel()
+    return reranker
+
+
+def test_rerank_keeps_top_n_best_scores():
+    scorer = reranker()
+    scorer._model.release.set()
+    docs, report = scorer.rerank("question", candidates(), top_n=5, budget_s=5)
+    assert report["reranked"] and [d.metadata["rank"] for d in docs] == [49, 48, 47, 46, 45]
+
+
+def test_timeout_then_busy_keep_top_n_in_search_order():
+    scorer = reranker(workers=1)
+    docs, report = scorer.rerank("question", candidates(), top_n=5, budget_s=0.05)
+    assert not report["reranked"] and "error" not in report
+    assert [d.metadata["rank"] for d in docs] == [0, 1, 2, 3, 4]
+
+    # Le seul thread note encore la question hors budget : pas d'attente
+    docs, report = scorer.rerank("autre question", candidates(), top_n=5, budget_s=5)
+    assert not report["reranked"] and len(docs) == 5 and scorer.stats["busy"] == 1
+    scorer._model.release.set()
+
+
+def test_model_error_keeps_top_n(monkeypatch):
+    def missing():
+        raise OSError("modèle introuvable")
+
+    scorer = CrossEncoderReranker("factice")
+    monkeypatch.setattr(scorer, "load", missing)
+    docs, report = scorer.rerank("question", candidates(), top_n=5)
+    assert len(docs) == 5 and "OSError" in report["error"]
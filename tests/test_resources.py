@@ -0,0 +1,8 @@
+from resources import ResourceRegistry
+
+
+def test_get_resource_recreates_invalid():
+    registry = ResourceRegistry()
+    first = registry.get_resource("r", object)
+    assert registry.get_resource("r", object) is first
+    assert registry.get_resource("r", object, valid=lambda r: False) is not first
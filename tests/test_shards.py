@@ -0,0 +1,80 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+from bm25 import BM25Index
+from shards import ShardMap, fan_out_search
+
+CHUNKS = [
+    ("c0", "Keynes"),
+    ("c1", "Walras"),
+    ("c2", "Walras et Pareto"),
+]
+
+
+def test_bm25_allowed_positions():
+    index = BM25Index.build(CHUNKS)
+    assert [cid for cid, _ in index.search("Walras", allowed=[1])] == ["c1"]
+    assert index.search("Walras", allowed=[0]) == []
+
+
+@pytest.fixture
+def shard_map():
+    docs = [
+        Document(page_content="", metadata={"source": "a-2019.pdf", "page": 0}),
+        Document(page_content="", metadata={"source": "b-2023.pdf", "page": 0}),
+        Document(page_content="", metadata={"source": "a-2019.pdf", "page": 3}),
+        Document(page_content="", metadata={"source": "c.pdf", "page": 1}),
+        Document(page_content="", metadata={"source": "b-2023.pdf", "page": 5}),
+    ]
+    return ShardMap.build(docs)
+
+
+def test_shard_select(shard_map):
+    assert shard_map.sizes() == {"a-2019.pdf": 2, "b-2023.pdf": 2, "c.pdf": 1}
+    selected = shard_map.select()
+    assert {name: list(p) for name, p in selected.items()} == {"a-2019.pdf": [0, 2], "b-2023.pdf": [1, 4], "c.pdf": [3]}
+    # Année inconnue exclue par un filtre d'années
+    assert set(shard_map.select(years=(2018, 2024))) == {"a-2019.pdf", "b-2023.pdf"}
+    assert {name: list(p) for name, p in shard_map.select(pages=(1, 4)).items()} == {"a-2019.pdf": [2], "c.pdf": [3]}
+    assert list(shard_map.select(sources=["b-2023.pdf", "absent.pdf"])) == ["b-2023.pdf"]
+
+
+def test_copy_selects_original_shard(shard_map):
+    docs = [Document(page_content="", metadata={"source": "a-2019.pdf", "page": 0})]
+    shards = ShardMap.build(docs, aliases={"a-2019 (1).pdf": "a-2019.pdf", "orpheline.pdf": "absent.pdf"})
+    assert shards.aliases == {"a-2019 (1).pdf": "a-2019.pdf"}
+    assert {name: list(p) for name, p in shards.select(sources=["a-2019 (1).pdf"]).items()} == {"a-2019.pdf": [0]}
+    assert list(shards.select(sources=["a-2019.pdf", "a-2019 (1).pdf"])) == ["a-2019.pdf"]
+    assert shards.year("a-2019 (1).pdf") == 2019
+
+
+def test_shard_map_save_load(tmp_path, shard_map):
+    shard_map.save(str(tmp_path))
+    loaded = ShardMap.load(str(tmp_path), aliases={"c (1).pdf": "c.pdf"})
+    assert loaded.sources == shard_map.sources and loaded.sizes() == shard_map.sizes()
+    assert list(loaded.select(sources=["c (1).pdf"])) == ["c.pdf"]
+
+
+@pytest.mark.parametrize("metric", [faiss.METRIC_L2, faiss.METRIC_INNER_PRODUCT])
+def test_fan_out_search_matches_filtered_brute_force(metric):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((200, 16)).astype(np.float32)
+    queries = rng.standard_normal((3, 16)).astype(np.float32)
+    index = faiss.IndexFlat(16, metric)
+    index.add(vectors)
+    shards = {f"s{i}": np.arange(i, 200, 7, dtype=np.int64) for i in range(5)}
+    allowed = np.sort(np.concatenate(list(shards.values())))
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        results = fan_out_search(index, queries, 10, shards, executor=executor, groups=3)
+    for q, result in enumerate(results):
+        if metric == faiss.METRIC_L2:
+            scores = ((vectors[allowed] - queries[q]) ** 2).sum(axis=1)
+        else:
+            scores = -(vectors[allowed] @ queries[q])
+        assert result == list(allowed[np.argsort(scores, kind="stable")[:10]])
+    assert fan_out_search(index, queries, 10, {}) == [[], [], []]
@@ -0,0 +1,43 @@
+import gzip
+
+from langchain_core.documents import Document
+
+from text_cache import cache_file, is_cached, load_pages, prune, save_pages
+
+
+def pages():
+    common = {"producer": "pdfTeX", "total_pages": 2}
+    return [
+        Document(page_content="Première page", metadata=dict(common, source="a.pdf", page=0, page_label="i")),
+        Document(page_content="Seconde page", metadata=dict(common, source="a.pdf", page=1, page_label="1")),
+    ]
+
+
+def test_round_trip_under_another_name(tmp_path):
+    cache = str(tmp_path)
+    save_pages(cache, "abc", pages())
+    assert is_cached(cache, "abc") and not is_cached(cache, "") and not is_cached(cache, "def")
+    loaded = load_pages(cache, "abc", "copie.pdf")
+    assert [d.page_content for d in loaded] == ["Première page", "Seconde page"]
+    assert [d.metadata for d in loaded] == [
+        dict(d.metadata, source="copie.pdf") for d in pages()
+    ]
+
+
+def test_missing_or_truncated_entry(tmp_path):
+    cache = str(tmp_path)
+    assert load_pages(cache, "abc", "a.pdf") is None
+    save_pages(cache, "abc", pages())
+    with gzip.open(cache_file(cache, "abc"), 'rt', encoding='utf-8') as f:
+        header = f.readline()
+    with gzip.open(cache_file(cache, "abc"), 'wt', encoding='utf-8') as f:
+        f.write(header)
+    assert load_pages(cache, "abc", "a.pdf") is None
+
+
+def test_prune(tmp_path):
+    cache = str(tmp_path)
+    save_pages(cache, "abc", pages())
+    save_pages(cache, "def", pages())
+    assert prune(cache, keep={"abc"}) == 1
+    assert is_cached(cache, "abc") and not is_cached(cache, "def")
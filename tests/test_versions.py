@@ -0,0 +1,155 @@
+import gc
+import os
+import subprocess
+import sys
+
+import pytest
+
+import versions
+from resources import ResourceRegistry
+
+
+@pytest.fixture(autouse=True)
+def no_grace(monkeypatch):
+    # Le délai de grâce après publication est testé à part
+    monkeypatch.setattr(versions, "GRACE_S", 0)
+
+
+def publish(root):
+    version, staging = versions.new_version(root)
+    with open(os.path.join(staging, "index.faiss"), 'w') as f:
+        f.write(version)
+    return versions.publish(root, version), version
+
+
+def listed(root):
+    return sorted(os.listdir(os.path.join(root, versions.VERSIONS_DIR)))
+
+
+def test_publish_switches_current(tmp_path):
+    root = str(tmp_path)
+    assert versions.current_version(root) is None
+    path, version = publish(root)
+    assert versions.current_version(root) == version
+    assert versions.resolve_index_path(root) == path
+    assert listed(root) == [version]
+
+
+def test_collect_keeps_current_staging_and_kept(tmp_path):
+    root = str(tmp_path)
+    _, v1 = publish(root)
+    _, v2 = publish(root)
+    _, v3 = publish(root)
+    staging_version, _ = versions.new_version(root)
+    assert versions.collect(root, keep=[v2]) == [v1]
+    assert listed(root) == sorted([v2, v3, staging_version + ".tmp"])
+
+
+def test_collect_waits_for_grace_period(tmp_path, monkeypatch):
+    root = str(tmp_path)
+    _, v1 = publish(root)
+    publish(root)
+    monkeypatch.setattr(versions, "GRACE_S", 3600)
+    assert versions.collect(root) == []
+    assert v1 in listed(root)
+
+
+def test_unpublish_then_collect(tmp_path):
+    root = str(tmp_path)
+    _, version = publish(root)
+    versions.unpublish(root)
+    assert versions.current_version(root) is None
+    assert versions.collect(root) == [version]
+
+
+def test_legacy_index_is_read_then_collected(tmp_path):
+    root = str(tmp_path)
+    (tmp_path / "index.faiss").write_text("legacy")
+    assert versions.current_version(root) == versions.LEGACY_VERSION
+    assert versions.resolve_index_path(root) == root
+    publish(root)
+    assert versions.collect(root) == [versions.LEGACY_VERSION]
+    assert not (tmp_path / "index.faiss").exists()
+
+
+def test_reader_marker_protects_version(tmp_path):
+    root = str(tmp_path)
+    _, v1 = publish(root)
+    with versions.reading(root) as path:
+        assert path == versions.version_path(root, v1)
+        publish(root)
+        assert versions.collect(root) == []
+    assert versions.collect(root) == [v1]
+    assert os.listdir(os.path.join(root, versions.READERS_DIR)) == []
+
+
+def test_marker_of_other_process(tmp_path):
+    root = str(tmp_path)
+    _, v1 = publish(root)
+    code = f"import versions, time; versions.register_reader({root!r}, {v1!r}); print(flush=True); time.sleep(30)"
+    reader = subprocess.Popen(
+        [sys.executable, "-c", code], stdout=subprocess.PIPE, cwd=os.path.dirname(versions.__file__)
+    )
+    try:
+        reader.stdout.readline()
+        publish(root)
+        assert versions.reader_versions(root) == {v1}
+        assert versions.collect(root) == []
+    finally:
+        reader.kill()
+        reader.wait()
+    # Marqueur d'un processus arrêté : retiré, la version est collectée
+    assert versions.collect(root) == [v1]
+
+
+class Store:
+    def __init__(self, path):
+        self.path = path
+
+
+def test_registry_lease_lifecycle(tmp_path):
+    root = str(tmp_path)
+    registry = ResourceRegistry()
+    loads = []
+
+    def loader(path):
+        loads.append(path)
+        return Store(path)
+
+    assert registry.acquire_index(root, loader) is None
+    _, v1 = publish(root)
+    first = registry.acquire_index(root, loader)
+    second = registry.acquire_index(root, loader)
+    assert first.version == second.version == v1
+    assert first.vector_store is second.vector_store and len(loads) == 1
+    assert registry.stats()["leases"] == 2
+    # Version en mémoire : marquée pour les autres processus
+    assert versions.reader_versions(root) == {v1}
+
+    _, v2 = publish(root)
+    third = registry.acquire_index(root, loader)
+    assert third.version == v2 and len(loads) == 2
+    first.release()
+    first.release()  # Sans effet
+    assert registry.stats() == {"models": 0, "index_versions": 2, "leases": 2}
+
+    # Dernier bail de l'ancienne version rendu par le ramasse-miettes
+    del second
+    gc.collect()
+    stats = registry.stats()
+    assert stats["index_versions"] == 1 and stats["leases"] == 1
+    assert listed(root) == [v2]
+    assert versions.reader_versions(root) == {v2}
+    third.release()
+    assert registry.stats()["index_versions"] == 1  # La version courante reste en mémoire
+
+
+def test_registry_forgets_unpublished_index(tmp_path):
+    root = str(tmp_path)
+    registry = ResourceRegistry()
+    publish(root)
+    registry.acquire_index(root, Store).release()
+    versions.unpublish(root)
+    registry.forget_index()
+    assert registry.stats()["index_versions"] == 0
+    assert listed(root) == []
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Cache du texte extrait des PDFs, par empreinte de contenu.
+
+L'analyse des PDFs (PyPDFLoader) est l'étape la plus lente de l'indexation.
+Le texte de chaque page est donc conservé dans text_cache/<sha256>.jsonl.gz :
+une ligne d'en-tête (métadonnées communes à toutes les pages), puis une ligne
+par page (texte et métadonnées propres à la page : numéro, libellé...). Le
+nom du fichier n'y figure pas : deux PDFs de même contenu partagent l'entrée.
+
+Une réindexation après un changement de découpage (CHUNK_SIZE, CHUNK_OVERLAP)
+repart de ce cache sans rouvrir un seul PDF, et la commande ci-dessous
+redécoupe tout le corpus avec d'autres paramètres :
+
+Usage :
+    python text_cache.py rechunk --chunk-size 800 --chunk-overlap 150 [--reindex] [--json stats.json]
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+TEXT_CACHE_DIR = "text_cache"
+TEXT_CACHE_FORMAT = 1
+
+_SUFFIX = ".jsonl.gz"
+
+
+def cache_file(cache_dir, sha256):
+    """Chemin de l'entrée du cache pour un contenu donné"""
+    return os.path.join(cache_dir, sha256 + _SUFFIX)
+
+
+def is_cached(cache_dir, sha256):
+    """Indique si le texte de ce contenu est déjà en cache"""
+    return bool(sha256) and os.path.exists(cache_file(cache_dir, sha256))
+
+
+def save_pages(cache_dir, sha256, docs):
+    """Enregistre les pages (Documents) extraites d'un PDF"""
+    metas = [{k: v for k, v in doc.metadata.items() if k != "source"} for doc in docs]
+    common = dict(metas[0]) if metas else {}
+    for meta in metas[1:]:
+        common = {k: v for k, v in common.items() if k in meta and meta[k] == v}
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cache_file(cache_dir, sha256)
+    # Fichier temporaire propre au processus : plusieurs workers peuvent extraire le même contenu
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=6) as f:
+        header = {"format": TEXT_CACHE_FORMAT, "pages": len(docs), "metadata": common}
+        f.write(json.dumps(header, ensure_ascii=False) + "\n")
+        for doc, meta in zip(docs, metas):
+            own = {k: v for k, v in meta.items() if k not in common}
+            f.write(json.dumps({"metadata": own, "text": doc.page_content}, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+
+
+def load_pages(cache_dir, sha256, source):
+    """Pages d'un PDF relues dans le cache, ou None si ce contenu n'y est pas
+
+    Args:
+        cache_dir: Dossier du cache
+        sha256: Empreinte du contenu du PDF (manifest.fingerprint_files)
+        source: Nom du fichier, remis dans metadata["source"]
+
+    Returns:
+        Liste de Documents (une par page), comme PyPDFLoader, ou None
+    """
+    from langchain_core.documents import Document
+
+    if not sha256:
+        return None
+    try:
+        with gzip.open(cache_file(cache_dir, sha256), 'rt', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            if header.get("format") != TEXT_CACHE_FORMAT:
+                return None
+            docs = []
+            for line in f:
+                page = json.loads(line)
+                metadata = dict(header["metadata"], **page["metadata"], source=source)
+                docs.append(Document(page_content=page["text"], metadata=metadata))
+    except (OSError, EOFError, ValueError, KeyError):
+        return None  # Entrée absente ou tronquée : le PDF sera réextrait
+    return docs if len(docs) == header.get("pages") else None
+
+
+def prune(cache_dir, keep):
+    """Supprime les entrées dont l'empreinte n'est pas dans keep (PDFs retirés de data/)
+
+    Returns:
+        Nombre d'entrées supprimées
+    """
+    if not os.path.isdir(cache_dir):
+        return 0
+    removed = 0
+    for name in os.listdir(cache_dir):
+        if name.endswith(_SUFFIX) and name[:-len(_SUFFIX)] not in keep:
+            try:
+                os.remove(os.path.join(cache_dir, name))
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def rechunk(args):
+    """Redécoupe le texte en cache de tout le corpus et retourne les statistiques des segments"""
+    import app
+    from manifest import fingerprint_files, load_manifest
+    from versions import reading
+
+    app.CHUNK_SIZE, app.CHUNK_OVERLAP = args.chunk_size, args.chunk_overlap
+    pdf_files = sorted(f for f in os.listdir(app.DATA_PATH) if f.endswith('.pdf'))
+    # Empreintes reprises du manifeste tant que taille et date sont inchangées
+    with reading(app.FAISS_PATH) as index_path:
+        manifest = load_manifest(index_path) or {}
+    fingerprints = fingerprint_files(app.DATA_PATH, pdf_files, manifest.get("files"))
+
+    start = time.perf_counter()
+    splitter = app.create_text_splitter()
+    lengths, pages, missing = [], 0, []
+    for name in pdf_files:
+        docs = load_pages(args.cache, fingerprints[name]["sha256"], name)
+        if docs is None:
+            missing.append(name)
+            continue
+        pages += len(docs)
+        lengths.extend(len(chunk.page_content) for chunk in splitter.split_documents(docs))
+    seconds = time.perf_counter() - start
+
+    stats = {
+        "chunk_size": args.chunk_size,
+        "chunk_overlap": args.chunk_overlap,
+        "files": len(pdf_files) - len(missing),
+        "pages": pages,
+        "chunks": len(lengths),
+        "chars_per_chunk": {
+            "mean": round(float(np.mean(lengths)), 1) if lengths else None,
+            "p50": int(np.percentile(lengths, 50)) if lengths else None,
+            "max": max(lengths, default=None),
+        },
+        "seconds": round(seconds, 3),
+        "missing": missing,
+    }
+    if args.reindex:
+        # Paramètres de découpage différents : reconstruction complète, texte relu dans le cache
+        if os.path.normpath(args.index) != os.path.normpath(app.FAISS_PATH):
+            # Index d'essai à part : son propre point de reprise
+            app.INDEX_JOB_PATH = os.path.normpath(args.index) + "_job/"
+        app.FAISS_PATH = args.index
+        app.TEXT_CACHE_PATH = args.cache
+        stats["reindexed"] = app.index_documents() is not None
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cache du texte extrait des PDFs")
+    sub = parser.add_subparsers(dest="command", required=True)
+    cmd = sub.add_parser("rechunk", help="Redécoupe le corpus depuis le cache, sans ouvrir les PDFs")
+    cmd.add_argument("--chunk-size", type=int, required=True)
+    cmd.add_argument("--chunk-overlap", type=int, required=True)
+    cmd.add_argument("--cache", default=TEXT_CACHE_DIR, help="Dossier du cache")
+    cmd.add_argument("--reindex", action="store_true",
+                     help="Reconstruire aussi l'index avec ces paramètres (PDFs absents du cache extraits)")
+    cmd.add_argument("--index", default="faiss_index/", help="Dossier de l'index à reconstruire avec --reindex")
+    cmd.add_argument("--json", help="Écrit aussi les statistiques dans ce fichier JSON")
+    args = parser.parse_args(argv)
+
+    stats = rechunk(args)
+    payload = json.dumps(stats, ensure_ascii=False, indent=1)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            f.write(payload + "\n")
+    print(payload)
+    if stats["missing"]:
+        print(f"⚠️ {len(stats['missing'])} PDF(s) absent(s) du cache : lancez une indexation pour les extraire",
+              file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+"""
+Versions de l'index sur disque, publiées par bascule atomique d'un pointeur.
+
+Chaque indexation écrit un index complet dans un dossier de préparation
+(versions/<version>.tmp), le renomme une fois tous ses fichiers écrits, puis
+remplace le fichier CURRENT (nom de la version courante) par os.replace : un
+lecteur voit l'ancienne version ou la nouvelle, jamais un index à moitié
+écrit. Une version publiée n'est plus jamais modifiée.
+
+Les sessions qui interrogent l'ancienne version la gardent jusqu'à ce qu'elles
+passent à la nouvelle ; collect() supprime ensuite les versions que plus aucun
+lecteur ne détient (voir resources.ResourceRegistry). Sous Windows, un fichier
+encore ouvert ne peut pas être supprimé : la suppression est retentée à la
+collecte suivante.
+
+Les lecteurs des autres processus (second serveur Streamlit, batch_query.py,
+rapports en ligne de commande) sont signalés par un marqueur par version et
+par processus (readers/<version>.<pid>.<jeton>) : open_version() le crée puis
+vérifie que la version est toujours courante, collect() ne supprime pas une
+version dont un marqueur appartient à un processus vivant. publish() marque
+de même la version qu'il publie, du renommage jusqu'à l'écriture de CURRENT.
+collect() ne supprime enfin aucune version moins de GRACE_S secondes après
+une publication (lecteurs sans marqueur qui viennent de lire CURRENT).
+
+Disposition du dossier de l'index :
+    CURRENT                nom de la version courante (vide : aucun index)
+    versions/<version>/    index.faiss, docstore.sqlite, bm25.npz, manifest.json...
+    readers/               marqueurs des lecteurs (un fichier vide par version lue et par processus)
+
+Un dossier sans CURRENT qui contient index.faiss est un index non versionné
+(ancien format) : il est lu tel quel jusqu'à la prochaine publication.
+"""
+
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+READERS_DIR = "readers"
+
+# Délai après une publication avant de collecter : couvre un lecteur qui vient
+# de lire CURRENT sans poser de marqueur
+GRACE_S = 60
+
+# Version d'un index non versionné, lu directement dans son dossier
+LEGACY_VERSION = "legacy"
+
+_STAGING_SUFFIX = ".tmp"
+
+
+def current_version(index_root):
+    """Nom de la version courante, LEGACY_VERSION pour un index non versionné, ou None"""
+    try:
+        with open(os.path.join(index_root, CURRENT_FILE), 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return LEGACY_VERSION if os.path.exists(os.path.join(index_root, "index.faiss")) else None
+
+
+def version_path(index_root, version):
+    """Dossier des fichiers d'une version"""
+    if version == LEGACY_VERSION:
+        return index_root
+    return os.path.join(index_root, VERSIONS_DIR, version)
+
+
+def resolve_index_path(index_path):
+    """Dossier de la version courante si index_path est versionné, sinon index_path lui-même"""
+    version = current_version(index_path)
+    return index_path if version is None else version_path(index_path, version)
+
+
+def new_version(index_root):
+    """Crée le dossier de préparation d'une nouvelle version
+
+    Les dossiers de préparation laissés par une indexation interrompue sont supprimés.
+
+    Returns:
+        (nom de la version, dossier de préparation)
+    """
+    versions_dir = os.path.join(index_root, VERSIONS_DIR)
+    if os.path.isdir(versions_dir):
+        for name in os.listdir(versions_dir):
+            if name.endswith(_STAGING_SUFFIX):
+                shutil.rmtree(os.path.join(versions_dir, name), ignore_errors=True)
+    version = time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+    staging = version_path(index_root, version) + _STAGING_SUFFIX
+    os.makedirs(staging)
+    return version, staging
+
+
+def _write_pointer(index_root, version):
+    path = os.path.join(index_root, CURRENT_FILE)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def publish(index_root, version):
+    """Finalise le dossier de préparation et en fait la version courante
+
+    Returns:
+        Dossier de la version publiée
+    """
+    path = version_path(index_root, version)
+    # Marqueur de publication : ni courante ni en préparation entre les deux étapes
+    marker = register_reader(index_root, version)
+    try:
+        os.rename(path + _STAGING_SUFFIX, path)
+        _write_pointer(index_root, version)
+    finally:
+        release_reader(marker)
+    return path
+
+
+def unpublish(index_root):
+    """Retire la version courante (index supprimé) ; ses fichiers partent à la collecte suivante"""
+    os.makedirs(index_root, exist_ok=True)
+    _write_pointer(index_root, "")
+
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def register_reader(index_root, version):
+    """Pose un marqueur de lecture sur une version (visible des autres processus)
+
+    Returns:
+        Chemin du marqueur, à rendre avec release_reader
+    """
+    readers_dir = os.path.join(index_root, READERS_DIR)
+    os.makedirs(readers_dir, exist_ok=True)
+    marker = os.path.join(readers_dir, f"{version}.{os.getpid()}.{uuid.uuid4().hex[:6]}")
+    open(marker, 'w').close()
+    return marker
+
+
+def release_reader(marker):
+    """Retire un marqueur de lecture (sans effet s'il n'existe plus)"""
+    if marker is None:
+        return
+    try:
+        os.remove(marker)
+    except OSError:
+        pass
+
+
+def reader_versions(index_root):
+    """Versions marquées par un processus vivant ; les marqueurs des processus arrêtés sont retirés"""
+    readers_dir = os.path.join(index_root, READERS_DIR)
+    names = os.listdir(readers_dir) if os.path.isdir(readers_dir) else []
+    versions = set()
+    for name in names:
+        version, _, rest = name.partition(".")
+        pid = rest.partition(".")[0]
+        if pid.isdigit() and _pid_alive(int(pid)):
+            versions.add(version)
+        else:
+            release_reader(os.path.join(readers_dir, name))
+    return versions
+
+
+def open_version(index_root):
+    """Pose un marqueur de lecture sur la version courante
+
+    Le marqueur est posé avant de revérifier CURRENT : si une publication est
+    passée entre-temps, il est déplacé sur la nouvelle version.
+
+    Returns:
+        (version, marqueur) ; (None, None) si aucun index n'existe
+    """
+    while True:
+        version = current_version(index_root)
+        if version is None:
+            return None, None
+        marker = register_reader(index_root, version)
+        if current_version(index_root) == version:
+            return version, marker
+        release_reader(marker)
+
+
+@contextmanager
+def reading(index_root):
+    """Dossier de la version courante, protégé de collect() pendant le bloc with
+
+    Pour les lecteurs hors du serveur (batch_query.py, rapports) : un index non
+    versionné ou absent donne index_root lui-même.
+    """
+    version, marker = open_version(index_root)
+    try:
+        yield index_root if version is None else version_path(index_root, version)
+    finally:
+        release_reader(marker)
+
+
+def collect(index_root, keep=()):
+    """Supprime du disque les versions qui ne sont ni courantes ni encore lues
+
+    Une version n'est supprimée que sans marqueur d'un processus vivant
+    (lecture ou publication en cours) et plus de GRACE_S secondes après la
+    dernière publication.
+
+    Args:
+        index_root: Dossier de l'index
+        keep: Versions détenues par des lecteurs (en plus de la version courante)
+
+    Returns:
+        Liste des versions supprimées
+    """
+    # CURRENT lu avant les marqueurs : un lecteur qui a validé son marqueur après
+    # cette lecture lit cette version ou une plus récente, marquée ou en préparation
+    keep = set(keep) | {current_version(index_root)} | reader_versions(index_root)
+    removed = []
+    versions_dir = os.path.join(index_root, VERSIONS_DIR)
+    names = os.listdir(versions_dir) if os.path.isdir(versions_dir) else []
+    try:
+        if time.time() - os.path.getmtime(os.path.join(index_root, CURRENT_FILE)) < GRACE_S:
+            return removed  # Publication récente : collecte suivante
+    except OSError:
+        pass
+    for name in names:
+        # Dossier de préparation : index en cours d'écriture
+        if name in keep or name.endswith(_STAGING_SUFFIX):
+            continue
+        path = os.path.join(versions_dir, name)
+        shutil.rmtree(path, ignore_errors=True)
+        if not os.path.exists(path):
+            removed.append(name)
+    # Fichiers d'un index non versionné remplacé par une version publiée
+    if LEGACY_VERSION not in keep and os.path.exists(os.path.join(index_root, CURRENT_FILE)):
+        legacy = [
+            name for name in os.listdir(index_root)
+            if not name.startswith(CURRENT_FILE) and os.path.isfile(os.path.join(index_root, name))
+        ]
+        for name in legacy:
+            try:
+                os.remove(os.path.join(index_root, name))
+            except OSError:
+                pass
+        if legacy:
+            removed.append(LEGACY_VERSION)
+    return removed